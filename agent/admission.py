@@ -0,0 +1,260 @@
+# 准入控制：/chat 的全局并发上限 + 每个客户端的并发上限 + 有界等待队列 + 请求截止时间
+
+"""
+每个 /chat 请求都会占用一个 MCP 会话、一条 LLM 连接和若干 Medusa 请求，流量尖峰时不加限制就会
+一路放大到上游。这里在入口处做准入：
+- 全局最多 ADMISSION_MAX_CONCURRENT 个请求同时跑 agent 循环，多出来的进有界队列（FIFO）排队
+- 同一个客户端（按来源 IP 区分；只有来自 TRUSTED_PROXIES 的请求才认 X-Client-Id 头，否则谁都能换个头绕过限额
+  或者冒充别人耗光别人的配额）最多 ADMISSION_MAX_PER_CLIENT 个请求在跑或在排队
+- 拒绝要快：客户端超限 -> 429，队列满 / 排队超过 ADMISSION_QUEUE_TIMEOUT -> 503，都带 Retry-After
+  （按最近请求的平均耗时和队列长度估算）
+- 截止时间用 contextvar 传下去：deadline_scope(秒) 之后 remaining() 返回剩余秒数，
+  agent_loop 用它收紧工具超时，并通过 call_tool 的 _meta 传给 MCP server；
+  到点后 api 取消整个 agent 循环（asyncio.wait_for / until_deadline），进行中的 LLM 和工具调用一起取消
+- 在跑/排队的数量、拒绝次数、排队耗时都导出到 metrics
+"""
+import asyncio
+import contextvars
+import ipaddress
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Deque, Dict, Optional, TypeVar
+
+from metrics import registry
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", "16"))
+ADMISSION_MAX_PER_CLIENT = int(os.getenv("ADMISSION_MAX_PER_CLIENT", "4"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "64"))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))  # 最多排队多久（秒）
+CHAT_DEADLINE = float(os.getenv("CHAT_DEADLINE", "60"))  # 单个请求从到达到返回的总预算（秒）
+# 逗号分隔的 IP / CIDR（网关、反向代理），只有来自这些地址的请求才按 X-Client-Id 头区分客户端
+TRUSTED_PROXIES = [ipaddress.ip_network(p.strip(), strict=False)
+                   for p in os.getenv("TRUSTED_PROXIES", "").split(",") if p.strip()]
+
+rejected_total = registry.counter("admission_rejected_total", "被准入控制拒绝的请求数，reason=client_limit/queue_full/queue_timeout")
+deadline_exceeded_total = registry.counter("deadline_exceeded_total", "超过截止时间被取消的请求（或批量里的单条）数")
+queue_wait_seconds = registry.histogram("admission_queue_wait_seconds", "请求在准入队列里等待的时间")
+
+T = TypeVar("T")
+
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+def client_key(host: Optional[str], header: Optional[str]) -> str:
+    """准入按哪个键计数：默认来源 IP；来源是受信任的代理并且带了 X-Client-Id 时才用这个头"""
+    if header and host and _trusted(host):
+        return header
+    return host or "unknown"
+
+
+def _trusted(host: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(ip in net for net in TRUSTED_PROXIES)
+
+
+class Rejected(Exception):
+    """准入被拒绝；api 层转成 status_code + Retry-After 头"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(f"{reason}, retry after {retry_after}s")
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """在这个作用域（以及从这里派生的 asyncio task）里 remaining() 返回剩余时间"""
+    token = _deadline.set(time.monotonic() + seconds)
+    try:
+        yield
+    finally:
+        try:
+            _deadline.reset(token)
+        except ValueError:
+            pass  # 异步生成器在别的 task 里收尾
+
+
+def remaining() -> Optional[float]:
+    """当前请求还剩多少秒；不在 deadline_scope 里返回 None"""
+    deadline = _deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class Ticket:
+    """一次准入占用的名额，release() 可以重复调用（流式响应在生成器和后台任务里都会释放）"""
+    __slots__ = ("controller", "client", "weight", "started", "released")
+
+    def __init__(self, controller: "AdmissionController", client: str, weight: int):
+        self.controller = controller
+        self.client = client
+        self.weight = weight
+        self.started = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, max_per_client: int = ADMISSION_MAX_PER_CLIENT,
+                 max_queue: int = ADMISSION_MAX_QUEUE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_per_client = max(1, max_per_client)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[tuple] = deque()  # (weight, future)
+        self._per_client: Dict[str, int] = {}
+        self._avg_seconds = 1.0  # 最近请求耗时的指数滑动平均，用来估算 Retry-After
+        self.admitted = 0
+
+    def _retry_after(self, ahead: int) -> int:
+        return max(1, min(60, math.ceil(self._avg_seconds * (ahead + 1) / self.max_concurrent)))
+
+    def _reject(self, status_code: int, reason: str, ahead: int):
+        rejected_total.inc(reason=reason)
+        raise Rejected(status_code, reason, self._retry_after(ahead))
+
+    async def acquire(self, client: str, weight: int = 1, timeout: Optional[float] = None) -> Ticket:
+        """
+        拿到名额返回 Ticket（用完必须 release）；拿不到抛 Rejected。
+        weight 是这个请求会同时跑几个 agent 循环（批量接口 = 它的并发度）。
+        timeout 是请求自己还能等多久（通常是 remaining()），和 queue_timeout 取较小的。
+        """
+        weight = max(1, min(weight, self.max_concurrent, self.max_per_client))
+        if self._per_client.get(client, 0) + weight > self.max_per_client:
+            self._reject(429, "client_limit", 0)
+        if self._waiters or self.in_flight + weight > self.max_concurrent:
+            if len(self._waiters) >= self.max_queue:
+                self._reject(503, "queue_full", len(self._waiters))
+        ticket = Ticket(self, client, weight)
+        self._per_client[client] = self._per_client.get(client, 0) + weight
+        try:
+            await self._wait_for_slot(weight, self.queue_timeout if timeout is None else min(self.queue_timeout, timeout))
+        except BaseException:
+            self._drop_client(client, weight)
+            raise
+        queue_wait_seconds.observe(time.monotonic() - ticket.started)
+        ticket.started = time.monotonic()
+        self.admitted += 1
+        return ticket
+
+    async def _wait_for_slot(self, weight: int, timeout: float):
+        if not self._waiters and self.in_flight + weight <= self.max_concurrent:
+            self.in_flight += weight
+            return
+        fut = asyncio.get_running_loop().create_future()
+        entry = (weight, fut)
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout)
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                self.in_flight -= weight  # 超时的同时刚好被唤醒，名额还回去
+                self._wake()
+            else:
+                fut.cancel()
+                try:
+                    self._waiters.remove(entry)
+                except ValueError:
+                    pass
+                self._wake()  # 排在队头的大请求走了，后面的小请求也许能进
+            if isinstance(e, asyncio.TimeoutError):
+                self._reject(503, "queue_timeout", len(self._waiters))
+            raise
+
+    def _wake(self):
+        while self._waiters:
+            weight, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if self.in_flight + weight > self.max_concurrent:
+                return  # 严格 FIFO，不让小请求插队饿死大请求
+            self._waiters.popleft()
+            self.in_flight += weight
+            fut.set_result(None)
+
+    def _drop_client(self, client: str, weight: int):
+        n = self._per_client.get(client, 0) - weight
+        if n > 0:
+            self._per_client[client] = n
+        else:
+            self._per_client.pop(client, None)
+
+    def _release(self, ticket: Ticket):
+        self.in_flight -= ticket.weight
+        self._drop_client(ticket.client, ticket.weight)
+        self._avg_seconds = 0.9 * self._avg_seconds + 0.1 * (time.monotonic() - ticket.started)
+        self._wake()
+
+    @asynccontextmanager
+    async def admit(self, client: str, weight: int = 1, timeout: Optional[float] = None):
+        ticket = await self.acquire(client, weight, timeout)
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self) -> dict:
+        return {"in_flight": self.in_flight, "queue_depth": len(self._waiters), "clients": len(self._per_client),
+                "admitted": self.admitted, "max_concurrent": self.max_concurrent,
+                "max_per_client": self.max_per_client, "max_queue": self.max_queue,
+                "avg_seconds": round(self._avg_seconds, 3)}
+
+    def collect(self):
+        s = self.stats()
+        return [("admission_in_flight", "gauge", "正在跑的请求占用的名额", {}, s["in_flight"]),
+                ("admission_queue_depth", "gauge", "准入队列里排队的请求数", {}, s["queue_depth"]),
+                ("admission_clients", "gauge", "当前有请求在跑或在排队的客户端数", {}, s["clients"])]
+
+
+async def until_deadline(events: AsyncIterator[T]) -> AsyncIterator[T]:
+    """
+    流式接口用：在单独的 task 里跑 events，逐个转交，最多等到当前 deadline_scope 的截止时间；
+    超时就取消那个 task（进行中的 LLM / 工具调用随之取消）并抛 DeadlineExceeded。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                await queue.put(event)
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout=remaining())
+            except asyncio.TimeoutError:
+                deadline_exceeded_total.inc()
+                raise DeadlineExceeded("request deadline exceeded") from None
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        if not task.done():
+            task.cancel()
+            try:
+                await task
+            except BaseException:
+                pass
@@ -3,7 +3,8 @@ import os
 from contextlib import AsyncExitStack#上下文管理器，管理多个异步资源的打开和关闭
 from mcp import ClientSession, StdioServerParameters#客户端会话和配置如何启动服务器进程
 from mcp.client.stdio import stdio_client#最核心，用于通过标准输入输出与MCP服务器通信（弹出终端）
-from anthropic import Anthropic#Claude官方SDK
+from agent_loop import run_agent#ReAct 循环（内部使用共享的异步 Claude 客户端）
+from llm_client import close_llm_client
 from dotenv import load_dotenv#从.env文件加载环境变量
 
 load_dotenv()#加载环境变量
@@ -35,58 +36,21 @@ async def run_agent_loop(user_query: str):#定义异步函数接受用户的查
         
         print(f"🔧 Agent 已加载工具: {[t['name'] for t in available_tools]}")
 
-        client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))#初始化Claude客户端实例，需要读取api_key
-        
-        # 初始化对话历史，放入用户的问题
-        messages = [{"role": "user", "content": user_query}]
-
         print("🤖 Agent 开始思考...")
 
-        # 🔄 核心循环：支持多步行动，ReAct模式：即先思考再行动的循环
-        while True:
-            # 调用 LLM
-            response = client.messages.create(#调用LLM提供的参数
-                model="claude-3-5-sonnet-20241022",#模型类型
-                max_tokens=1024,#最大生成长度
-                tools=available_tools,#提供可供使用的工具列表
-                messages=messages#提供对话历史
-            )
-
-            # 把 LLM 的回复（可能是思考，也可能是工具调用请求）加入历史保持上下文连贯
-            messages.append({"role": "assistant", "content": response.content})
-
-            # 判断 LLM 是否想调用工具
-            if response.stop_reason == "tool_use":#停止推理原因为llm决定调用工具
-                # 找到它想调用的那个工具块
-                tool_use = next(block for block in response.content if block.type == "tool_use")
-                tool_name = tool_use.name#工具名
-                tool_args = tool_use.input#工具参数
-                
-                print(f"👉 LLM 决定调用工具: {tool_name} | 参数: {tool_args}")
-                
-                # 执行工具
-                result = await session.call_tool(tool_name, tool_args)#使用工具
-                tool_output = result.content[0].text#获取工具返回的文本结果，content[0]没有开启“思维链 (Chain of Thought)”等高级功能的情况下，Claude 的普通文本回复通常也只包含一个文本块;如果是一个健壮的生产环境代码，不应该直接取 [0]，而是应该遍历列表。
-                
-                print(f"📦 工具返回结果: {tool_output[:100]}...") # 只打印前100个字避免刷屏
-
-                # 把工具结果作为 User 视角的 tool_result 加入历史保持上下文连贯
-                messages.append({
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "tool_result",
-                            "tool_use_id": tool_use.id,
-                            "content": tool_output
-                        }
-                    ]
-                })
-                # 循环继续，LLM 会看到工具结果，然后决定是继续调用下一个工具，还是回答问题
-            else:#stop_reason!=tool_use(通常=end_turn)
-                # 如果没有调用工具，说明它生成了最终回复，打印并退出循环
-                final_text = response.content[0].text
-                print(f"\n🤖 Agent 最终回复:\n{final_text}")
-                break
+        # 🔄 核心循环：支持多步行动，ReAct模式：即先思考再行动的循环（见 agent_loop.run_agent）
+        # stream=True：LLM 生成的文字边生成边打印，不用等整轮结束
+        async for event in run_agent(session, available_tools, user_query, stream=True):
+            if event["type"] == "token":
+                print(event["text"], end="", flush=True)
+            elif event["type"] == "tool_call":
+                print(f"\n👉 LLM 决定调用工具: {event['name']} | 参数: {event['input']}")
+            elif event["type"] == "tool_result":
+                print(f"📦 工具返回结果: {event['output'][:100]}...") # 只打印前100个字避免刷屏
+            elif event["type"] == "final":
+                print(f"\n\n🤖 Agent 最终回复:\n{event['reply']}")
+
+    await close_llm_client()
 
 if __name__ == "__main__":
     question = "帮我查一下 Sweatshirt 的价格，然后告诉我它的详细材质。"
@@ -0,0 +1,198 @@
+# ReAct 循环：api.py 和 agent_client.py 共用
+
+"""
+run_agent 是一个异步生成器，边跑边产出事件，方便 /chat 直接取最终结果、/chat/stream 逐条推给前端：
+- {"type": "token", "text": ...}           LLM 正在生成的文本片段（仅 stream=True）
+- {"type": "tool_call", "id", "name", "input"}
+- {"type": "tool_result", "id", "name", "output", "is_error", "cached"}
+- {"type": "final", "reply": ..., "llm_calls": n, "tool_calls": m, "usage": {...}}
+同一轮回复里的所有 tool_use 块会并发执行，结果放进同一条 user 消息里一起交回给 LLM。
+传入 tool_cache（answer_cache.ToolResultCache）时，只读工具的结果按输入复用，不再走 MCP。
+传入 history（conversation.Conversation.messages）时在已有历史后面接着对话，本轮消息直接追加进去。
+传入 context（grounding.context 检索到的参考资料）时，它作为一个 text 块放在本轮问题的前面。
+工具定义、system prompt 和最后一条消息上都打了 prompt caching 断点，final 里的 usage 汇总了
+每次调用的 input/output tokens 和缓存读写量，方便对比。
+在 admission.deadline_scope 里调用时，工具超时不超过请求剩余时间，剩余时间也会传给 MCP server。
+"""
+import asyncio
+import os
+from typing import AsyncIterator, List, Optional
+
+from admission import remaining
+from conversation import build_request_messages, CACHE_CONTROL
+from llm_client import get_llm_client, MODEL_NAME, MAX_TOKENS
+from metrics import llm_tokens
+from tracing import span, current_traceparent
+
+MAX_STEPS = 5  # 最多循环 5 次，防止死循环
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "15"))  # 单个工具调用的超时（秒）
+SYSTEM_PROMPT = os.getenv(
+    "AGENT_SYSTEM_PROMPT",
+    "你是 SmartShopper 商城的导购助手。需要商品信息时调用工具查询，不要编造价格、库存或材质；"
+    "需要多个商品的详情（比如对比）时用 get_products_details 一次查完，并用 fields 只要需要的字段；"
+    "问题前面附了 <retrieved_products> 检索结果时，够用就直接回答，不用再调 search_products；"
+    "回答简洁，提到商品时带上商品 ID。",
+)
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "1") == "1"
+
+
+def cached_tools(tools: List[dict]) -> List[dict]:
+    """在最后一个工具定义上打断点：工具列表是每个请求都一样的前缀"""
+    if not PROMPT_CACHING or not tools:
+        return tools
+    return tools[:-1] + [dict(tools[-1], cache_control=CACHE_CONTROL)]
+
+
+def system_blocks(system: str) -> List[dict]:
+    block = {"type": "text", "text": system}
+    if PROMPT_CACHING:
+        block["cache_control"] = CACHE_CONTROL
+    return [block]
+
+
+def _add_usage(total: dict, usage):
+    if usage is None:
+        return
+    for key, kind in (("input_tokens", "input"), ("output_tokens", "output"),
+                      ("cache_creation_input_tokens", "cache_write"), ("cache_read_input_tokens", "cache_read")):
+        n = getattr(usage, key, None) or 0
+        total[key] += n
+        llm_tokens.inc(n, type=kind)
+    total["per_call_input_tokens"].append(getattr(usage, "input_tokens", 0) or 0)
+
+
+def _block_dict(block) -> dict:
+    # SDK 的 content block 转成普通 dict，会话历史里只存可序列化的数据
+    return block.model_dump(exclude_none=True) if hasattr(block, "model_dump") else dict(block)
+
+
+async def _call_tool(session, name: str, arguments: dict):
+    # traceparent 放在请求的 _meta 里，MCP server 那边的 span 就能挂到这次工具调用下面；
+    # 请求有截止时间时把剩余毫秒数也带过去，server 超时后会取消进行中的 Medusa 请求
+    meta = {"traceparent": current_traceparent()}
+    left = remaining()
+    if left is not None:
+        meta["deadline_ms"] = int(left * 1000)
+    return await session.call_tool(name, arguments, meta=meta)
+
+
+async def _run_tool(session, tool_use, timeout: float = TOOL_TIMEOUT, tool_cache=None) -> dict:
+    """执行一个工具调用，超时或异常都转成 is_error 的 tool_result，不影响同一轮的其他工具"""
+    with span("tool.call", tool=tool_use.name) as sp:
+        result = await _run_tool_inner(session, tool_use, timeout, tool_cache)
+        sp.set(cached=result["cached"], is_error=result["is_error"])
+        return result
+
+
+async def _run_tool_inner(session, tool_use, timeout: float, tool_cache) -> dict:
+    if tool_cache is not None:
+        output = tool_cache.get(tool_use.name, tool_use.input)
+        if output is not None:
+            return {"type": "tool_result", "id": tool_use.id, "name": tool_use.name,
+                    "output": output, "is_error": False, "cached": True}
+    left = remaining()
+    if left is not None:
+        timeout = min(timeout, left)  # 不超过整个请求剩下的时间
+    try:
+        result = await asyncio.wait_for(_call_tool(session, tool_use.name, tool_use.input), timeout=timeout)
+        output = "\n".join(c.text for c in result.content if getattr(c, "type", "") == "text")
+        is_error = bool(getattr(result, "isError", False))
+    except asyncio.TimeoutError:
+        output, is_error = f"工具 {tool_use.name} 超时（{timeout}s）", True
+    except Exception as e:
+        output, is_error = f"工具 {tool_use.name} 调用异常: {str(e)}", True
+    if tool_cache is not None and not is_error:
+        tool_cache.set(tool_use.name, tool_use.input, output)
+    return {"type": "tool_result", "id": tool_use.id, "name": tool_use.name,
+            "output": output, "is_error": is_error, "cached": False}
+
+
+async def _call_llm(messages: List[dict], tools: List[dict], stream: bool, system: List[dict]):
+    """调用一次 LLM，stream=True 时先逐个 yield 文本片段，最后 yield 完整的 Message"""
+    client = get_llm_client()
+    if PROMPT_CACHING:
+        messages = build_request_messages(messages)
+    if not stream:
+        yield await client.messages.create(
+            model=MODEL_NAME,
+            max_tokens=MAX_TOKENS,
+            system=system,
+            tools=tools,
+            messages=messages
+        )
+        return
+    async with client.messages.stream(
+        model=MODEL_NAME,
+        max_tokens=MAX_TOKENS,
+        system=system,
+        tools=tools,
+        messages=messages
+    ) as s:
+        async for event in s:
+            if event.type == "text":
+                yield {"type": "token", "text": event.text}
+        yield await s.get_final_message()
+
+
+async def run_agent(session, tools: List[dict], user_query: str,
+                    stream: bool = False, max_steps: int = MAX_STEPS, tool_cache=None,
+                    history: Optional[List[dict]] = None, system: str = SYSTEM_PROMPT,
+                    context: Optional[str] = None) -> AsyncIterator[dict]:
+    messages = history if history is not None else []
+    if context:
+        messages.append({"role": "user", "content": [{"type": "text", "text": context},
+                                                     {"type": "text", "text": user_query}]})
+    else:
+        messages.append({"role": "user", "content": user_query})
+    tools = cached_tools(tools)
+    system = system_blocks(system)
+    llm_calls = tool_calls = 0
+    usage = {"input_tokens": 0, "output_tokens": 0, "cache_creation_input_tokens": 0,
+             "cache_read_input_tokens": 0, "per_call_input_tokens": []}
+
+    def final(reply: str) -> dict:
+        return {"type": "final", "reply": reply, "llm_calls": llm_calls, "tool_calls": tool_calls, "usage": usage}
+
+    for step in range(max_steps):
+        response = None
+        with span("llm.call", model=MODEL_NAME, stream=stream, step=step) as sp:
+            async for item in _call_llm(messages, tools, stream, system):
+                if isinstance(item, dict):
+                    yield item
+                else:
+                    response = item
+            resp_usage = getattr(response, "usage", None)
+            sp.set(stop_reason=response.stop_reason,
+                   input_tokens=getattr(resp_usage, "input_tokens", None),
+                   cache_read_input_tokens=getattr(resp_usage, "cache_read_input_tokens", None))
+        llm_calls += 1
+        _add_usage(usage, resp_usage)
+
+        messages.append({"role": "assistant", "content": [_block_dict(b) for b in response.content]})
+
+        if response.stop_reason == "tool_use":
+            tool_uses = [b for b in response.content if b.type == "tool_use"]
+            for b in tool_uses:
+                yield {"type": "tool_call", "id": b.id, "name": b.name, "input": b.input}
+
+            # 一轮里的所有工具并发执行，每个都有自己的超时
+            results = await asyncio.gather(*(_run_tool(session, b, tool_cache=tool_cache) for b in tool_uses))
+            tool_calls += len(results)
+            for r in results:
+                yield r
+
+            messages.append({
+                "role": "user",
+                "content": [{
+                    "type": "tool_result",
+                    "tool_use_id": r["id"],
+                    "content": r["output"],
+                    "is_error": r["is_error"],
+                } for r in results]
+            })
+        else:
+            final_text = "".join(b.text for b in response.content if b.type == "text")
+            yield final(final_text)
+            return
+
+    yield final("")
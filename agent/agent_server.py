@@ -1,11 +1,27 @@
 # agent_server.py
 # 在 agent 的 MCP 工作流中也可以把 RAG-built prompt 作为工具的内部来源（即当 Agent 决定 search_products 时，Server 会先做检索，把检索结果一并返回给 Agent/LLM）。
-from mcp.server.fastmcp import FastMCP#用来快速创建Model Context Protocol服务器的工具
+from mcp.server.fastmcp import FastMCP, Context#用来快速创建Model Context Protocol服务器的工具
+from mcp.server.fastmcp.exceptions import ToolError#工具里抛出它，客户端收到的是 isError=True 的结果
 import httpx#导入httpx库，用于发送HTTP异步请求
 import asyncio#导入asyncio库，用于异步编程
 import json#json库处理json数据
 import os#导入os库，用于操作系统相关功能
+import re
+import sys
+import logging#stdout 是 MCP 的 stdio 协议通道，日志只能写 stderr
 from dotenv import load_dotenv#从.env文件加载环境变量
+from typing import Dict, List, NamedTuple, Optional
+from ttl_cache import TTLCache#带 TTL 的 LRU 缓存 + single-flight
+from catalog_store import get_catalog, CATALOG_MAX_AGE#ingest 维护的本地商品目录镜像（SQLite）
+from metrics import registry, cache_collector
+from tracing import span
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+load_dotenv()
+
+logging.basicConfig(stream=sys.stderr, level=os.getenv("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s [mcp-server] %(message)s")
+log = logging.getLogger("agent_server")
 
 # 🔴 这里填入你刚才在后台复制的 Publishable API Key (pk_...)
 # 如果你找不到 Key，先留空试试，但 Medusa 2.0 通常需要它
@@ -14,7 +30,32 @@ API_KEY=os.getenv("MEDUSA_API_KEY")# Medusa的公开API密钥
 # 定义服务名称
 mcp = FastMCP("My-Ecom-Agent")#创建名为"My-Ecom-Agent"的MCP服务器实例
 # 这里的地址必须是你 Medusa 运行的地址
-MEDUSA_API_URL = "http://localhost:9000"#指向本地运行的Medusa API服务器后续请求都会发往这个网址
+MEDUSA_API_URL = os.getenv("MEDUSA_API_URL", "http://localhost:9000")#指向本地运行的Medusa API服务器后续请求都会发往这个网址
+
+# 进程内共享一个 httpx 客户端：连接池 + keep-alive，不再每次调用都新建 TCP 连接
+MEDUSA_MAX_CONNECTIONS = int(os.getenv("MEDUSA_MAX_CONNECTIONS", "20"))
+MEDUSA_TIMEOUT = float(os.getenv("MEDUSA_TIMEOUT", "10"))
+# 商品数据变化不频繁，短时间内同样的查询直接走缓存
+MEDUSA_CACHE_TTL = float(os.getenv("MEDUSA_CACHE_TTL", "60"))
+MEDUSA_CACHE_SIZE = int(os.getenv("MEDUSA_CACHE_SIZE", "1024"))
+
+# search_products 的 limit 上限；get_products_details 一次最多查多少个商品、输出的预算（近似 token 数）
+SEARCH_MAX_LIMIT = 20
+PRODUCTS_DETAILS_MAX = int(os.getenv("PRODUCTS_DETAILS_MAX", "20"))
+PRODUCTS_DETAILS_TOKEN_BUDGET = int(os.getenv("PRODUCTS_DETAILS_TOKEN_BUDGET", "800"))
+# get_products_details 的 fields 参数 -> Medusa store API 的 fields 选择器（id / title / handle 总是返回）
+PRODUCT_FIELDS = {
+    "price": ["*variants", "*variants.prices"],
+    "material": ["material"],
+    "options": ["*options", "*options.values"],
+    "variants": ["*variants", "*variants.options", "*options", "*options.values"],  # 要靠 options 识别纯规格组合的变体标题
+    "description": ["description"],
+}
+
+_http_client: Optional[httpx.AsyncClient] = None
+medusa_cache = TTLCache(maxsize=MEDUSA_CACHE_SIZE, ttl=MEDUSA_CACHE_TTL)
+# Medusa 连续失败（连接错误、超时、5xx）后熔断，工具直接返回“暂时不可用”的错误结果，不再每次卡满 MEDUSA_TIMEOUT
+medusa_breaker = CircuitBreaker("medusa")
 
 def get_headers():
     headers = {}
@@ -23,109 +64,407 @@ def get_headers():
         headers["x-publishable-api-key"] = API_KEY
     return headers
 
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            base_url=MEDUSA_API_URL,
+            headers=get_headers(),
+            timeout=MEDUSA_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=MEDUSA_MAX_CONNECTIONS,
+                max_keepalive_connections=MEDUSA_MAX_CONNECTIONS,
+                keepalive_expiry=30,
+            ),
+        )
+    return _http_client
+
+class MedusaResponse(NamedTuple):
+    status_code: int
+    data: Optional[dict]
+    text: str
+
+class MedusaUnavailable(Exception):
+    """Medusa 返回 5xx；partial 是出错之前已经查到的商品"""
+
+    def __init__(self, message: str, partial: Optional[Dict[str, dict]] = None):
+        super().__init__(message)
+        self.partial = partial or {}
+
+def unavailable(e: Exception) -> ToolError:
+    """
+    连接失败、超时、5xx、熔断这类上游故障要以 isError 的结果返回给 agent：
+    api 那边的工具结果缓存和答案缓存都不会存它，Medusa 恢复后下一次请求就能拿到真结果。
+    """
+    if isinstance(e, CircuitOpen):
+        return ToolError(f"商品服务暂时不可用，请稍后再试（{e}）")
+    return ToolError(f"商品服务请求失败: {str(e)}")
+
+async def medusa_get(path: str, params: Optional[dict] = None) -> MedusaResponse:
+    """
+    GET Medusa store API。按 (path, params) 缓存成功的响应，
+    并发的相同请求只会真正发出一次。熔断打开时抛 CircuitOpen。
+    """
+    # 列表参数（id[]=a&id[]=b）转成 tuple 才能当 key
+    key = (path, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in (params or {}).items())))
+
+    async def fetch():
+        with span("medusa.http", path=path) as sp:
+            response = await get_http_client().get(path, params=params)
+            sp.set(status=response.status_code)
+        if response.status_code == 200:
+            return MedusaResponse(200, response.json(), "")
+        return MedusaResponse(response.status_code, None, response.text)
+
+    async def load():
+        return await medusa_breaker.call(fetch, is_failure=lambda r: r.status_code >= 500)
+
+    return await medusa_cache.get_or_load(key, load, cache_if=lambda r: r.status_code == 200)
+
+def request_meta(ctx: Optional[Context], key: str):
+    """api 进程通过 call_tool(meta={...}) 传过来的字段；不在请求上下文里（比如直接调用函数测试）返回 None"""
+    try:
+        meta = ctx.request_context.meta if ctx is not None else None
+        return getattr(meta, key, None)
+    except Exception:
+        return None
+
+def tool_span(name: str, ctx: Optional[Context], **attrs):
+    """工具调用的 span，挂在 api 进程通过 call_tool(meta={"traceparent": ...}) 传过来的父 span 下面"""
+    return span(f"mcp.tool.{name}", parent=request_meta(ctx, "traceparent"), **attrs)
+
+async def within_deadline(coro, ctx: Optional[Context], name: str) -> str:
+    """
+    api 进程把请求剩余的时间放在 meta 的 deadline_ms 里；超过就不再等，返回 isError 的结果（不会进缓存）。
+    进行中的 Medusa 请求由 medusa_cache 的 single-flight task 持有，不跟着取消：
+    同一个 key 上别的还有时间的请求照样拿到结果，结果也照样进缓存。
+    """
+    budget_ms = request_meta(ctx, "deadline_ms")
+    if budget_ms is None:
+        return await coro
+    try:
+        return await asyncio.wait_for(coro, timeout=max(float(budget_ms), 0.0) / 1000)
+    except asyncio.TimeoutError:
+        log.warning(f"⏱️ {name} 超过请求截止时间，已放弃等待")
+        raise ToolError(f"{name} 超时：请求已超过截止时间") from None
+
+@mcp.resource("stats://medusa-cache")
+def medusa_cache_stats() -> str:
+    """Medusa 响应缓存的命中/未命中计数"""
+    return json.dumps(medusa_cache.stats())
+
+def local_catalog():
+    """本地目录镜像可用且在 CATALOG_MAX_AGE 内同步过才返回，否则返回 None（调用方走线上 API）"""
+    catalog = get_catalog()
+    if catalog is None:
+        return None
+    try:
+        return catalog if catalog.is_fresh(CATALOG_MAX_AGE) else None
+    except Exception:
+        return None
+
+def _catalog_collector():
+    catalog = get_catalog()
+    if catalog is None:
+        return []
+    return [("catalog_local_hits", "gauge", "工具直接用本地目录镜像回答的次数", {}, catalog.local_hits),
+            ("catalog_fallbacks", "gauge", "本地目录没有结果、回退到 Medusa 的次数", {}, catalog.fallbacks)]
+
+registry.register_collector(cache_collector("medusa", medusa_cache.stats))
+registry.register_collector(_catalog_collector)
+registry.register_collector(medusa_breaker.collect)
+
+@mcp.resource("metrics://snapshot")
+def metrics_snapshot() -> str:
+    """本进程的指标快照（JSON），api 的 /metrics 会从每个池内会话拉取后合并"""
+    return json.dumps(registry.snapshot({"process": f"mcp-{os.getpid()}"}), ensure_ascii=False)
+
+@mcp.resource("stats://catalog")
+def catalog_stats() -> str:
+    """本地目录镜像的规模、同步时间和本地命中/回退线上次数"""
+    catalog = get_catalog()
+    return json.dumps(catalog.stats() if catalog else {"enabled": False})
+
+def format_price(p: dict) -> str:
+    # Medusa 的价格结构很深: variants -> prices -> amount
+    price_str = "价格暂无"
+    variants = p.get('variants', [])
+    if variants:
+        # 取第一个变体的价格列表
+        prices = variants[0].get('prices', [])
+        # 这里的逻辑是：优先找 USD 或 EUR，或者直接取第一个
+        # 注意：Medusa 这里的 amount 通常是“分”，比如 1950 代表 19.50
+        if prices:
+            # 简单起见，直接取第一个价格
+            raw_amount = prices[0].get('amount', 0)
+            currency = prices[0].get('currency_code', 'usd').upper()
+            # 除以100转成元
+            final_price = raw_amount / 100
+            price_str = f"{final_price} {currency}"
+    return price_str
+
+def format_search_results(products: list) -> str:
+    if not products:
+        return "查询成功，但没有找到任何匹配的商品。"
+    found = []
+    for p in products:
+        title = p.get('title', '未知商品')
+        p_id = p.get('id', '')
+        # 把 ID 也返回给 LLM，方便它下一步查询详情
+        found.append(f"- {title} (ID: {p_id}) | 价格: {format_price(p)}")
+    return "找到以下商品:\n" + "\n".join(found)
+
+def format_product_details(product: dict) -> str:
+    title = product.get('title', '未知')
+    description = product.get('description', '暂无描述')
+    material = product.get('material', '未知材质')
+
+    # 整理变体信息（比如尺码、颜色）
+    options_info = []
+    if 'options' in product:
+        for opt in product['options']:
+            values = [v['value'] for v in opt.get('values', [])]
+            options_info.append(f"{opt['title']}: {', '.join(values)}")
+
+    return (
+        f"商品名: {title}\n"
+        f"描述: {description}\n"
+        f"材质: {material}\n"
+        f"可选规格: {' | '.join(options_info)}\n"
+    )
+
+_CJK_CHAR = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+def approx_tokens(text: str) -> int:
+    """粗略估计 LLM 的 token 数：中日韩字符一个字约一个 token，其余约 4 个字符一个 token"""
+    cjk = len(_CJK_CHAR.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+def _truncate_tokens(text: str, budget: int) -> str:
+    used = 0.0
+    for i, ch in enumerate(text):
+        used += 1 if _CJK_CHAR.match(ch) else 0.25
+        if used > budget:
+            return text[:i].rstrip() + "…"
+    return text
+
+def _price_summary(p: dict) -> Optional[str]:
+    amounts: Dict[str, set] = {}
+    for v in p.get('variants') or []:
+        for price in (v.get('prices') or [])[:1]:
+            if price.get('amount') is not None:
+                amounts.setdefault(price.get('currency_code', '').upper(), set()).add(price['amount'] / 100)
+    if not amounts:
+        return None
+    # 各变体价格相同就只写一个，不同就写区间
+    return " / ".join(f"{min(a)} {c}".strip() if len(a) == 1 else f"{min(a)}-{max(a)} {c}".strip()
+                      for c, a in amounts.items())
+
+def _compact_fields(p: dict, fields: List[str]) -> List[tuple]:
+    """按 fields 的顺序给出 (字段名, 值)，已经去掉空值和重复"""
+    out = []
+    for field in fields:
+        if field == "price":
+            value = _price_summary(p)
+        elif field == "material":
+            value = p.get('material')
+        elif field == "options":
+            value = "; ".join(f"{opt.get('title', '')}: {'/'.join(dict.fromkeys(str(v.get('value', '')) for v in opt.get('values') or []))}"
+                              for opt in p.get('options') or [])
+        elif field == "variants":
+            # "S / Black" 这种只是规格组合的变体标题，规格里已经有了
+            known = {str(v.get('value', '')).lower() for opt in p.get('options') or [] for v in opt.get('values') or []}
+            value = ", ".join(dict.fromkeys(
+                v['title'] for v in p.get('variants') or []
+                if v.get('title') and not all(x.strip().lower() in known for x in re.split(r"[/|,]", v['title']) if x.strip())))
+        else:
+            value = (p.get('description') or '').strip()
+        if value:
+            out.append(({"price": "价格", "material": "材质", "options": "规格", "variants": "变体",
+                         "description": "描述"}[field], value))
+    return out
+
+def format_products_compact(products: List[dict], fields: List[str], not_found: List[str] = (),
+                            budget: int = PRODUCTS_DETAILS_TOKEN_BUDGET) -> str:
+    """
+    每个商品一行 "[ID] 标题 | 价格: … | 材质: …"，总长度控制在 budget（近似 token）以内：
+    预算平均分给每个商品，放不下时描述按剩余预算截短，其他字段整个省略。
+    """
+    per_product = max(budget // max(len(products), 1), 40)
+    lines, trimmed = [], False
+    for p in products:
+        parts = [f"[{p.get('id', '')}] {p.get('title', '未知商品')}"]
+        used = approx_tokens(parts[0])
+        for name, value in _compact_fields(p, fields):
+            piece = f"{name}: {value}"
+            cost = approx_tokens(piece) + 1
+            if used + cost <= per_product:
+                parts.append(piece)
+                used += cost
+                continue
+            trimmed = True
+            room = per_product - used - approx_tokens(name) - 2
+            if name == "描述" and room >= 8:
+                parts.append(f"{name}: {_truncate_tokens(value, room)}")
+                used = per_product
+        lines.append(" | ".join(parts))
+    if not_found:
+        lines.append(f"未找到: {', '.join(not_found)}")
+    if trimmed:
+        lines.append("（部分字段因长度限制已省略，需要完整信息请用 get_product_details 查单个商品）")
+    return "\n".join(lines) if lines else "没有找到任何商品。"
+
+def medusa_fields(fields: List[str]) -> str:
+    selectors = ["id", "title", "handle"] + [s for f in fields for s in PRODUCT_FIELDS[f]]
+    return ",".join(dict.fromkeys(selectors))
+
+async def fetch_products(product_ids: List[str], fields: List[str]) -> Dict[str, dict]:
+    """
+    用列表接口的 id 过滤一次取回多个商品，fields 只要需要的字段；
+    这个 Medusa 版本不认某个 fields 选择器（400）就去掉 fields 重试，列表接口用不了再并发逐个取。
+    """
+    wanted = set(product_ids)
+    params = {"id[]": list(product_ids), "limit": len(product_ids), "fields": medusa_fields(fields)}
+    response = await medusa_get("/store/products", params=params)
+    if response.status_code == 400:
+        params.pop("fields")
+        response = await medusa_get("/store/products", params=params)
+    if response.status_code == 200:
+        return {p['id']: p for p in response.data.get('products', []) if p.get('id') in wanted}
+    log.warning(f"批量查询失败 (状态码 {response.status_code})，改为逐个查询")
+    responses = await asyncio.gather(*(medusa_get(f"/store/products/{pid}") for pid in product_ids))
+    failed = [r.status_code for r in responses if r.status_code >= 500]
+    found = {pid: r.data.get('product', {}) for pid, r in zip(product_ids, responses) if r.status_code == 200}
+    if failed:
+        raise MedusaUnavailable(f"状态码 {failed[0]}", found)
+    return found
+
 @mcp.tool()
-async def search_products(query: str) -> str:
+async def search_products(query: str, limit: int = 5, ctx: Context = None) -> str:
     """
     搜索商城里的商品。返回商品列表、ID和价格。
-    如果用户问“有什么T恤”，就用这个。
+    如果用户问“有什么T恤”，就用这个。limit 是最多返回几个（默认 5，最多 20）。
     """
-    print(f"🔍 正在搜索: {query} ...")
-    
+    log.info(f"🔍 正在搜索: {query} ...")
+    limit = max(1, min(int(limit or 5), SEARCH_MAX_LIMIT))
+    with tool_span("search_products", ctx) as sp:
+        return await within_deadline(_search_products(query, limit, sp), ctx, "search_products")
+
+async def _search_products(query: str, limit: int, sp) -> str:
+    catalog = local_catalog()
+    if catalog is not None:
+        with span("catalog.search"):
+            products = catalog.search(query, limit=limit)
+        if products:
+            catalog.local_hits += 1
+            sp.set(source="catalog")
+            return format_search_results(products)
+        catalog.fallbacks += 1  # 本地没搜到（比如分词差异），再问一次线上
+
+    sp.set(source="medusa")
     try:
-        async with httpx.AsyncClient() as client:
-            # Medusa 2.0 的搜索参数通常是 q
-            params = {"q": query, "limit": 5} 
-            
-            response = await client.get(
-                f"{MEDUSA_API_URL}/store/products", 
-                headers=get_headers(),
-                params=params
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                products = data.get('products', [])
-                
-                if not products:
-                     return "查询成功，但没有找到任何匹配的商品。"
-
-                found = []
-                for p in products:
-                    title = p.get('title', '未知商品')
-                    p_id = p.get('id', '')
-                    
-                    # ✅ 任务一：修复价格显示
-                    # Medusa 的价格结构很深: variants -> prices -> amount
-                    price_str = "价格暂无"
-                    variants = p.get('variants', [])
-                    if variants:
-                        # 取第一个变体的价格列表
-                        prices = variants[0].get('prices', [])
-                        # 这里的逻辑是：优先找 USD 或 EUR，或者直接取第一个
-                        # 注意：Medusa 这里的 amount 通常是“分”，比如 1950 代表 19.50
-                        if prices:
-                            # 简单起见，直接取第一个价格
-                            raw_amount = prices[0].get('amount', 0)
-                            currency = prices[0].get('currency_code', 'usd').upper()
-                            # 除以100转成元
-                            final_price = raw_amount / 100
-                            price_str = f"{final_price} {currency}"
-                    
-                    # 把 ID 也返回给 LLM，方便它下一步查询详情
-                    found.append(f"- {title} (ID: {p_id}) | 价格: {price_str}")
-                
-                return "找到以下商品:\n" + "\n".join(found)
-            else:
-                print(f"Error Body: {response.text}") 
-                return f"搜索失败 (状态码 {response.status_code})"
+        # Medusa 2.0 的搜索参数通常是 q
+        params = {"q": query, "limit": limit}
+        
+        response = await medusa_get("/store/products", params=params)
     except Exception as e:
-        return f"发生异常: {str(e)}"
+        raise unavailable(e) from e
+
+    if response.status_code == 200:
+        # ✅ 任务一：修复价格显示（见 format_price）
+        return format_search_results(response.data.get('products', []))
+    log.warning(f"Error Body: {response.text}")
+    if response.status_code >= 500:
+        raise unavailable(MedusaUnavailable(f"状态码 {response.status_code}"))
+    return f"搜索失败 (状态码 {response.status_code})"
 
 # ✅ 任务二：新增获取商品详情工具
 @mcp.tool()
-async def get_product_details(product_id: str) -> str:
+async def get_product_details(product_id: str, ctx: Context = None) -> str:
     """
     获取特定商品的详细信息（材质、描述、所有变体等）。
     必须提供商品的 ID (例如: prod_01H...)。
     当用户问“这件衣服是什么材质”或“详细介绍一下”时使用。
     """
-    print(f"📖 正在查询详情 ID: {product_id} ...")
-    
+    log.info(f"📖 正在查询详情 ID: {product_id} ...")
+    with tool_span("get_product_details", ctx) as sp:
+        return await within_deadline(_get_product_details(product_id, sp), ctx, "get_product_details")
+
+async def _get_product_details(product_id: str, sp) -> str:
+    catalog = local_catalog()
+    if catalog is not None:
+        with span("catalog.get"):
+            product = catalog.get(product_id)
+        if product is not None:
+            catalog.local_hits += 1
+            sp.set(source="catalog")
+            return format_product_details(product)
+        catalog.fallbacks += 1  # 上次同步之后才上架的商品，去线上查
+
+    sp.set(source="medusa")
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{MEDUSA_API_URL}/store/products/{product_id}",
-                headers=get_headers()
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                # 注意 Medusa get by ID 返回结构通常是 { "product": {...} }
-                product = data.get('product', {})
-                
-                title = product.get('title', '未知')
-                description = product.get('description', '暂无描述')
-                material = product.get('material', '未知材质')
-                
-                # 整理变体信息（比如尺码、颜色）
-                options_info = []
-                if 'options' in product:
-                    for opt in product['options']:
-                        values = [v['value'] for v in opt.get('values', [])]
-                        options_info.append(f"{opt['title']}: {', '.join(values)}")
-                
-                info = (
-                    f"商品名: {title}\n"
-                    f"描述: {description}\n"
-                    f"材质: {material}\n"
-                    f"可选规格: {' | '.join(options_info)}\n"
-                )
-                return info
-            else:
-                return f"查询详情失败: 找不到 ID 为 {product_id} 的商品"
-                
+        response = await medusa_get(f"/store/products/{product_id}")
     except Exception as e:
-        return f"查询详情异常: {str(e)}"
+        raise unavailable(e) from e
+
+    if response.status_code == 200:
+        # 注意 Medusa get by ID 返回结构通常是 { "product": {...} }
+        return format_product_details(response.data.get('product', {}))
+    if response.status_code >= 500:
+        raise unavailable(MedusaUnavailable(f"状态码 {response.status_code}"))
+    return f"查询详情失败: 找不到 ID 为 {product_id} 的商品"
+
+@mcp.tool()
+async def get_products_details(product_ids: List[str], fields: Optional[List[str]] = None,
+                               ctx: Context = None) -> str:
+    """
+    一次获取多个商品的详细信息，每个商品一行紧凑输出。
+    需要两个及以上商品的信息时（比如“比较这三件卫衣”）用它，不要逐个调用 get_product_details。
+    product_ids: 商品 ID 列表 (例如: ["prod_01H...", "prod_01J..."])，最多 20 个。
+    fields: 只返回需要的字段，可选 price / material / options / variants / description；不填返回全部。
+    """
+    log.info(f"📚 正在批量查询详情: {len(product_ids)} 个商品, fields={fields} ...")
+    with tool_span("get_products_details", ctx, requested=len(product_ids)) as sp:
+        return await within_deadline(_get_products_details(product_ids, fields, sp), ctx, "get_products_details")
+
+async def _get_products_details(product_ids: List[str], fields: Optional[List[str]], sp) -> str:
+    ids = list(dict.fromkeys(pid.strip() for pid in product_ids if pid and pid.strip()))[:PRODUCTS_DETAILS_MAX]
+    if not ids:
+        return "请至少提供一个商品 ID"
+    unknown = [f for f in fields or [] if f not in PRODUCT_FIELDS]
+    if unknown:
+        return f"不支持的字段: {', '.join(unknown)}；可选: {', '.join(PRODUCT_FIELDS)}"
+    fields = list(dict.fromkeys(fields)) if fields else list(PRODUCT_FIELDS)
+
+    found: Dict[str, dict] = {}
+    catalog = local_catalog()
+    if catalog is not None:
+        with span("catalog.get_many", n=len(ids)):
+            found = catalog.get_many(ids)
+        if found:
+            catalog.local_hits += 1
+        if len(found) < len(ids):
+            catalog.fallbacks += 1  # 上次同步之后才上架的商品，去线上查
+    missing = [pid for pid in ids if pid not in found]
+    sp.set(source="catalog" if not missing else "medusa" if not found else "mixed")
+
+    error = None
+    if missing:
+        try:
+            found.update(await fetch_products(missing, fields))
+        except Exception as e:
+            found.update(getattr(e, "partial", {}))
+            error = unavailable(e)
+    products = [found[pid] for pid in ids if pid in found]
+    if error and not products:
+        raise error
+    # 出错时没查到的商品不算“不存在”
+    not_found = [pid for pid in ids if pid not in found] if error is None else []
+    out = format_products_compact(products, fields, not_found)
+    if error:
+        # 本地目录里查到的那部分照样给 LLM 看，但整个结果标成出错，不进缓存
+        raise ToolError(f"{out}\n{error}")
+    return out
 
 if __name__ == "__main__":
-    mcp.run()#Server 启动后才会挂起，一直监听 Client发过来的指令
\ No newline at end of file
+    mcp.run()#Server 启动后才会挂起，一直监听 Client发过来的指令
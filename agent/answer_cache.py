@@ -0,0 +1,223 @@
+# 语义答案缓存：挡在 agent 循环前面，相似问题直接返回上次的最终回复；工具结果按输入缓存，按商品 ID 失效
+
+"""
+"Sweatshirt 是什么材质" 这类问题会被反复问，每次都跑一遍 Claude + MCP 的多步循环。
+- SemanticAnswerCache: 用 embeddings 模型给 query 编码（归一化向量），和缓存里的 query 做余弦相似度，
+  超过 ANSWER_CACHE_THRESHOLD 就直接返回缓存的回复。TTL + LRU 淘汰。
+- ToolResultCache: search_products / get_product_details / get_products_details 这类只读工具，按 (工具名, 输入) 缓存输出，
+  即使答案没命中，新一轮 agent 循环里查同一个商品也不用再走 MCP / Medusa。
+- 每条缓存都记着它涉及的商品 ID（工具输入和输出里出现的 prod_...）。ingest 把变化/下架的商品写进
+  catalog_store 的 changes 流水，AgentCache 定期增量拉取，把涉及这些商品的答案和工具结果一起删掉。
+"""
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Iterable, List, NamedTuple, Optional, Set
+
+import numpy as np
+
+from catalog_store import get_catalog
+from ttl_cache import TTLCache
+
+log = logging.getLogger("answer_cache")
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2048"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "1800"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))  # 余弦相似度阈值
+TOOL_CACHE_SIZE = int(os.getenv("TOOL_CACHE_SIZE", "4096"))
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "600"))
+TOOL_CACHE_TOOLS = set(os.getenv("TOOL_CACHE_TOOLS", "search_products,get_product_details,get_products_details").split(","))
+INVALIDATION_POLL_SECONDS = float(os.getenv("ANSWER_CACHE_POLL_SECONDS", "5"))
+
+_PRODUCT_ID = re.compile(r"\bprod_[A-Za-z0-9]+")
+
+
+def product_ids_in(*values) -> Set[str]:
+    """从工具输入/输出里找出商品 ID"""
+    found = set()
+    for v in values:
+        text = v if isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+        found.update(_PRODUCT_ID.findall(text))
+    return found
+
+
+class AnswerEntry(NamedTuple):
+    query: str
+    reply: str
+    product_ids: frozenset
+    expires_at: float
+
+
+class SemanticAnswerCache:
+    def __init__(self, maxsize: int = ANSWER_CACHE_SIZE, ttl: float = ANSWER_CACHE_TTL,
+                 threshold: float = ANSWER_CACHE_THRESHOLD):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self._entries: "OrderedDict[int, AnswerEntry]" = OrderedDict()
+        self._vectors = {}  # entry id -> 归一化的 query 向量
+        self._matrix = None  # 查找用的 (n, dim) 矩阵，条目变化后才重建
+        self._matrix_ids: List[int] = []
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._vectors.pop(entry_id, None)
+        self._matrix = None
+
+    def _expire(self):
+        now = time.monotonic()
+        for entry_id in [i for i, e in self._entries.items() if e.expires_at < now]:
+            self._drop(entry_id)
+
+    def lookup(self, emb: np.ndarray) -> Optional[AnswerEntry]:
+        self._expire()
+        if not self._entries:
+            self.misses += 1
+            return None
+        if self._matrix is None:
+            self._matrix_ids = list(self._vectors)
+            self._matrix = np.stack([self._vectors[i] for i in self._matrix_ids])
+        sims = self._matrix @ _unit(emb)
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            self.misses += 1
+            return None
+        entry_id = self._matrix_ids[best]
+        self._entries.move_to_end(entry_id)
+        self.hits += 1
+        return self._entries[entry_id]
+
+    def store(self, query: str, emb: np.ndarray, reply: str, product_ids: Iterable[str] = ()):
+        if not reply:
+            return
+        entry_id = self._next_id
+        self._next_id += 1
+        self._entries[entry_id] = AnswerEntry(query, reply, frozenset(product_ids), time.monotonic() + self.ttl)
+        self._vectors[entry_id] = _unit(emb)
+        self._matrix = None
+        while len(self._entries) > self.maxsize:
+            self._drop(next(iter(self._entries)))  # 淘汰最久没用的
+
+    def invalidate_products(self, product_ids: Iterable[str]) -> int:
+        wanted = set(product_ids)
+        victims = [i for i, e in self._entries.items() if e.product_ids & wanted]
+        for entry_id in victims:
+            self._drop(entry_id)
+        self.invalidated += len(victims)
+        return len(victims)
+
+    def clear(self):
+        self._entries.clear()
+        self._vectors.clear()
+        self._matrix = None
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "invalidated": self.invalidated,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+class ToolResultCache:
+    def __init__(self, maxsize: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL,
+                 tools: Iterable[str] = TOOL_CACHE_TOOLS):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._products = {}  # key -> 涉及的商品 ID
+        self.tools = set(tools)
+        self.invalidated = 0
+
+    @staticmethod
+    def key(name: str, tool_input: dict):
+        return name, json.dumps(tool_input, sort_keys=True, ensure_ascii=False)
+
+    def get(self, name: str, tool_input: dict) -> Optional[str]:
+        if name not in self.tools:
+            return None
+        output = self._cache.get(self.key(name, tool_input))
+        if output is None:
+            self._cache.misses += 1
+        else:
+            self._cache.hits += 1
+        return output
+
+    def set(self, name: str, tool_input: dict, output: str):
+        if name not in self.tools:
+            return
+        key = self.key(name, tool_input)
+        self._cache.set(key, output)
+        self._products[key] = product_ids_in(tool_input, output)
+        if len(self._products) > 2 * self._cache.maxsize:
+            # 被 LRU 淘汰的 key 顺手清掉
+            live = set(self._cache._data)
+            self._products = {k: v for k, v in self._products.items() if k in live}
+
+    def invalidate_products(self, product_ids: Iterable[str]) -> int:
+        wanted = set(product_ids)
+        keys = {k for k, pids in self._products.items() if pids & wanted}
+        for k in keys:
+            self._products.pop(k, None)
+        n = self._cache.invalidate(lambda k: k in keys)
+        self.invalidated += n
+        return n
+
+    def clear(self):
+        self._cache.invalidate()
+        self._products.clear()
+
+    def stats(self) -> dict:
+        return dict(self._cache.stats(), invalidated=self.invalidated)
+
+
+class AgentCache:
+    """api.py 持有一个：答案缓存 + 工具结果缓存 + 从目录变更流水拉取失效"""
+
+    def __init__(self, answers: Optional[SemanticAnswerCache] = None, tools: Optional[ToolResultCache] = None,
+                 poll_seconds: float = INVALIDATION_POLL_SECONDS):
+        self.answers = answers or SemanticAnswerCache()
+        self.tools = tools or ToolResultCache()
+        self.poll_seconds = poll_seconds
+        self._seq: Optional[int] = None
+        self._last_poll = 0.0
+
+    def invalidate_products(self, product_ids: Iterable[str]) -> int:
+        product_ids = list(product_ids)
+        return self.answers.invalidate_products(product_ids) + self.tools.invalidate_products(product_ids)
+
+    def poll_invalidations(self, force: bool = False) -> int:
+        """最多每 poll_seconds 查一次 changes 流水；目录镜像没开时只靠 TTL"""
+        now = time.monotonic()
+        if not force and now - self._last_poll < self.poll_seconds:
+            return 0
+        self._last_poll = now
+        catalog = get_catalog()
+        if catalog is None:
+            return 0
+        try:
+            if self._seq is None:
+                self._seq = catalog.latest_change()  # 启动时缓存是空的，之前的变更不用管
+                return 0
+            self._seq, changed = catalog.changes_since(self._seq)
+        except Exception as e:
+            log.warning(f"⚠️ 读取商品变更流水失败: {e}")
+            return 0
+        return self.invalidate_products(changed) if changed else 0
+
+    def stats(self) -> dict:
+        return {"answers": self.answers.stats(), "tools": self.tools.stats(), "change_seq": self._seq}
+
+
+def _unit(v) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
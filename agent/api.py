@@ -1,20 +1,76 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 import asyncio
+import json
+import logging
 import os
 import sys
-from contextlib import AsyncExitStack
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
 
 # 复用我们之前的 Client 代码逻辑
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
-from anthropic import Anthropic
 from dotenv import load_dotenv
+from agent_loop import run_agent
+from llm_client import get_llm_client, close_llm_client
+from mcp_pool import MCPSessionPool, default_server_params, POOL_SIZE
+from answer_cache import AgentCache, ANSWER_CACHE_ENABLED, product_ids_in
+from conversation import Conversation, ConversationStore
+import grounding
+from admission import (AdmissionController, Rejected, DeadlineExceeded, deadline_scope, remaining, until_deadline,
+                       deadline_exceeded_total, client_key, CHAT_DEADLINE)
+from metrics import registry, cache_collector, merge, render
+from tracing import instrument_app, recent_spans, span
 
 load_dotenv()
 
-app = FastAPI()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s [api] %(message)s")
+log = logging.getLogger("api")
+
+SERVER_SCRIPT_PATH = os.getenv(
+    "MCP_SERVER_SCRIPT",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "agent_server.py")
+)
+
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))  # 单个批量请求最多多少条 query
+CHAT_BATCH_CONCURRENCY = int(os.getenv("CHAT_BATCH_CONCURRENCY", str(POOL_SIZE)))
+
+# 常驻的 MCP 会话池，在 lifespan 里启动/关闭
+mcp_pool = MCPSessionPool(default_server_params(SERVER_SCRIPT_PATH), size=POOL_SIZE)
+# 语义答案缓存 + 工具结果缓存，ANSWER_CACHE_ENABLED=0 时关闭
+agent_cache = AgentCache() if ANSWER_CACHE_ENABLED else None
+# 服务端多轮会话，按 session_id 保存（TTL + LRU）
+conversations = ConversationStore()
+# 准入控制：全局 / 每客户端并发上限 + 有界排队，超限快速返回 429/503
+admission = AdmissionController()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await mcp_pool.start()
+    get_llm_client()  # 提前建好共享的异步 LLM 客户端
+    if agent_cache is not None:
+        try:
+            import embeddings
+            await asyncio.to_thread(embeddings.warmup)  # 答案缓存要给 query 编码，模型先加载好
+        except Exception as e:
+            log.warning(f"⚠️ embedding 模型预热失败，答案缓存会在第一次请求时再试: {e}")
+    if grounding.CHAT_GROUNDING != "off":
+        try:
+            await asyncio.to_thread(grounding.warmup)  # 检索接地要用向量库和 BM25 索引
+        except Exception as e:
+            log.warning(f"⚠️ 检索索引预热失败，检索接地会在第一次请求时再试: {e}")
+    try:
+        yield
+    finally:
+        await mcp_pool.close()
+        await close_llm_client()
+
+app = FastAPI(lifespan=lifespan)
+instrument_app(app)  # 每个请求一个 span，响应头里带 traceparent
 
 # 允许 Vue 前端跨域访问
 app.add_middleware(
@@ -24,78 +80,313 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-SERVER_SCRIPT_PATH = "D:\\Multi_Agent\\agent\\agent_server.py"
+@app.exception_handler(Rejected)
+async def rejected_handler(request: Request, exc: Rejected):
+    log.warning(f"🚦 拒绝请求 ({exc.reason}), Retry-After {exc.retry_after}s")
+    return JSONResponse(status_code=exc.status_code, content={"detail": exc.reason, "retry_after": exc.retry_after},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+def client_id(request: Request) -> str:
+    """按来源 IP 区分客户端；网关后面所有请求同一个 IP，网关在 TRUSTED_PROXIES 里时改按 X-Client-Id 头"""
+    return client_key(request.client.host if request.client else None, request.headers.get("x-client-id"))
 
 class ChatRequest(BaseModel):
     query: str
+    session_id: Optional[str] = None  # 不传就开一个新会话，响应里会带回 session_id；只认服务端发过的
+
+def conversation_for(session_id: Optional[str]) -> Conversation:
+    conversation = conversations.get_or_create(session_id)
+    if conversation is None:
+        # 过期或者不是服务端发的 ID：客户端去掉 session_id 重新开一个会话
+        raise HTTPException(status_code=404, detail="session not found")
+    return conversation
+
+async def lookup_answer(user_query: str, conversation):
+    """
+    返回 (query 向量, 命中的缓存条目)；缓存关闭或编码失败时都是 None，照常走 agent 循环。
+    只有会话的第一轮才查/写答案缓存，追问的答案依赖上文，不能跨会话复用。
+    商品变更流水每轮都要拉（有节流）：追问虽然不查答案缓存，工具结果缓存照样在用。
+    """
+    if agent_cache is None:
+        return None, None
+    agent_cache.poll_invalidations()
+    if not conversation.is_new:
+        return None, None
+    try:
+        from retriever import batcher  # query 编码走 retriever 的 LRU + 微批
+        emb = await batcher.embed(user_query)
+    except Exception as e:
+        log.warning(f"⚠️ query 编码失败，跳过答案缓存: {e}")
+        return None, None
+    return emb, agent_cache.answers.lookup(emb)
+
+class AnswerRecorder:
+    """跟着 run_agent 的事件记下涉及的商品 ID，循环正常结束才写入答案缓存"""
+
+    def __init__(self, user_query: str, emb):
+        self.user_query = user_query
+        self.emb = emb
+        self.product_ids = set()
+        self.had_error = False
+
+    def ground(self, hits: List[dict]):
+        # 答案可能只用了检索接地的结果、没调工具，商品 ID 也要记上，商品更新时才能让这条答案失效
+        self.product_ids |= {h["metadata"]["product_id"] for h in hits if h["metadata"].get("product_id")}
+
+    def observe(self, event: dict):
+        if event["type"] == "tool_call":
+            self.product_ids |= product_ids_in(event["input"])
+        elif event["type"] == "tool_result":
+            self.product_ids |= product_ids_in(event["output"])
+            self.had_error = self.had_error or event["is_error"]
+        elif event["type"] == "final" and self.emb is not None and not self.had_error:
+            agent_cache.answers.store(self.user_query, self.emb, event["reply"], self.product_ids)
+
+def _tool_cache():
+    return agent_cache.tools if agent_cache is not None else None
+
+def _runtime_collector():
+    rows = [("mcp_pool_idle", "gauge", "MCP 会话池空闲会话数", {}, mcp_pool.stats()["idle"]),
+            ("mcp_pool_restarts", "gauge", "MCP 会话重启次数", {}, mcp_pool.stats()["restarts"]),
+            ("conversations", "gauge", "当前保存的会话数", {}, len(conversations))]
+    retriever = sys.modules.get("retriever")  # 只有答案缓存或检索接地用到过 query 编码才会加载
+    if retriever is not None:
+        rows += cache_collector("query_embedding", retriever.query_cache.stats)()
+    return rows
+
+registry.register_collector(_runtime_collector)
+registry.register_collector(admission.collect)
+if agent_cache is not None:
+    registry.register_collector(cache_collector("answer", agent_cache.answers.stats))
+    registry.register_collector(cache_collector("tool_result", agent_cache.tools.stats))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 文本格式：本进程 + 每个 MCP server 子进程（通过 metrics://snapshot 拉取）的指标"""
+    snapshots = [registry.snapshot({"process": "api"})]
+    for text in await mcp_pool.read_resource_all("metrics://snapshot"):
+        try:
+            snapshots.append(json.loads(text))
+        except ValueError:
+            continue
+    return PlainTextResponse(render(merge(*snapshots)), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces")
+async def traces_endpoint(trace_id: Optional[str] = None, limit: int = 200):
+    """本进程最近的 span（TRACE_EXPORTER=jsonl 时 MCP server 子进程的 span 也写进 TRACE_EXPORT_PATH，按 trace_id 能串起来）"""
+    return recent_spans(trace_id, limit)
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """答案缓存 / 工具结果缓存的命中率和失效计数"""
+    return agent_cache.stats() if agent_cache is not None else {"enabled": False}
+
+@app.get("/admission/stats")
+async def admission_stats():
+    """准入控制的当前并发、排队深度和配置"""
+    return admission.stats()
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    conversation = conversations.get(session_id)
+    if conversation is None:
+        raise HTTPException(status_code=404, detail="session not found")
+    return conversation.stats()
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    return {"deleted": conversations.delete(session_id)}
 
 @app.post("/chat")
-async def chat_endpoint(request: ChatRequest):
+async def chat_endpoint(request: ChatRequest, http_request: Request):
     """
     接收前端发来的问题，运行 Agent 循环，返回最终答案。
+    带上上次返回的 session_id 就是同一个会话里的追问；session_id 不存在（过期或不是服务端发的）返回 404。
+    超过并发/排队上限返回 429/503（带 Retry-After），超过 CHAT_DEADLINE 返回 504。
     """
     user_query = request.query
-    print(f"🌐 收到前端请求: {user_query}")
+    log.info(f"🌐 收到前端请求: {user_query}")
+    conversation = conversation_for(request.session_id)
 
+    with deadline_scope(CHAT_DEADLINE):  # 排队时间也算在截止时间里
+        async with admission.admit(client_id(http_request), timeout=remaining()):
+            try:
+                # 到点取消整个 agent 循环，进行中的 LLM 请求和工具调用一起取消
+                return await asyncio.wait_for(answer_query(user_query, conversation), timeout=remaining())
+            except asyncio.TimeoutError:
+                deadline_exceeded_total.inc()
+                log.error(f"⏱️ 请求超过截止时间 {CHAT_DEADLINE}s: {user_query}")
+                raise HTTPException(status_code=504, detail="deadline exceeded")
+            except Exception as e:
+                log.error(f"❌ Error: {str(e)}")
+                raise HTTPException(status_code=500, detail=str(e))
+
+async def answer_query(user_query: str, conversation) -> dict:
+    """一轮完整的问答（先查答案缓存，再跑 agent 循环），/chat 和 /chat/batch 共用"""
+    # 检索接地和查答案缓存同时开始（query 只 encode 一次），拿会话锁、借 MCP 会话的时候检索也在跑
+    prefetch = grounding.prefetch(user_query, conversation)
     try:
-        # --- 这里就是 agent_client.py 的核心逻辑 ---
-        server_params = StdioServerParameters(
-            command="python", 
-            args=[SERVER_SCRIPT_PATH],
-            env=None
-        )
-
-        async with AsyncExitStack() as stack:
-            read, write = await stack.enter_async_context(stdio_client(server_params))
-            session = await stack.enter_async_context(ClientSession(read, write))
-            await session.initialize()
-            
-            tools_result = await session.list_tools()
-            available_tools = [{
-                "name": t.name, 
-                "description": t.description, 
-                "input_schema": t.inputSchema
-            } for t in tools_result.tools]
-
-            client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
-            messages = [{"role": "user", "content": user_query}]
-            
-            final_reply = ""
-
-            # 最多循环 5 次，防止死循环
-            for _ in range(5):
-                response = client.messages.create(
-                    model="claude-3-5-sonnet-20241022",
-                    max_tokens=1024,
-                    tools=available_tools,
-                    messages=messages
-                )
-                
-                messages.append({"role": "assistant", "content": response.content})
-
-                if response.stop_reason == "tool_use":
-                    tool_use = next(b for b in response.content if b.type == "tool_use")
-                    tool_name = tool_use.name
-                    tool_args = tool_use.input
-                    
-                    print(f"⚙️ 调用工具: {tool_name}")
-                    
-                    result = await session.call_tool(tool_name, tool_args)
-                    tool_output = result.content[0].text
-                    
-                    messages.append({
-                        "role": "user",
-                        "content": [{"type": "tool_result", "tool_use_id": tool_use.id, "content": tool_output}]
-                    })
-                else:
-                    final_reply = response.content[0].text
-                    break
-            
-            return {"reply": final_reply}
+        emb, hit = await lookup_answer(user_query, conversation)
+        if hit is not None:
+            # 相似问题之前答过，LLM 和 Medusa 都不用碰
+            conversation.record(user_query, hit.reply)
+            return {"reply": hit.reply, "llm_calls": 0, "tool_calls": 0, "cached": True,
+                    "session_id": conversation.session_id, "usage": None}
+        recorder = AnswerRecorder(user_query, emb)
 
-    except Exception as e:
-        print(f"❌ Error: {str(e)}")
-        raise HTTPException(status_code=500, detail=str(e))
+        # --- 核心逻辑和 agent_client.py 一样，都在 agent_loop.run_agent 里 ---
+        # 从池子里借一个已完成握手的会话，工具列表也已经缓存好了
+        async with conversation.turn() as history, mcp_pool.session() as session:
+            context, hits = await grounding.context(prefetch)
+            recorder.ground(hits)
+            final = {"reply": ""}
+            async for event in run_agent(session, mcp_pool.tools, user_query, tool_cache=_tool_cache(),
+                                         history=history, context=context):
+                recorder.observe(event)
+                if event["type"] == "tool_call":
+                    log.info(f"⚙️ 调用工具: {event['name']}")
+                elif event["type"] == "final":
+                    final = event
+            conversation.last_usage = final.get("usage")
+    finally:
+        grounding.cancel(prefetch)  # 缓存命中或中途失败时检索结果用不上
+
+    return {"reply": final["reply"], "llm_calls": final.get("llm_calls"), "tool_calls": final.get("tool_calls"),
+            "cached": False, "grounded": len(hits), "session_id": conversation.session_id,
+            "usage": final.get("usage")}
+
+class BatchChatRequest(BaseModel):
+    queries: List[str]
+    concurrency: Optional[int] = None  # 同时跑几个 agent 循环，默认 CHAT_BATCH_CONCURRENCY，上限是 MCP 会话池大小
+
+@app.post("/chat/batch")
+async def chat_batch_endpoint(request: BatchChatRequest, http_request: Request):
+    """
+    批量问答（离线评测、目录 QA、预热答案缓存用）：每条 query 都是独立的单轮会话，不进会话存储。
+    答案缓存打开时所有 query 先一次 encode；agent 循环按有限并发跑，
+    结果按完成顺序以 NDJSON 流式返回，每行带 index 对应请求里的位置；单条失败只影响那一行。
+    准入按并发度占名额（并发 4 的批量 = 4 个 /chat），每条各有 CHAT_DEADLINE 的截止时间。
+    """
+    queries = request.queries
+    if len(queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"too many queries (max {BATCH_MAX_QUERIES})")
+    concurrency = max(1, min(request.concurrency or CHAT_BATCH_CONCURRENCY, mcp_pool.size,
+                             admission.max_per_client))
+    log.info(f"🌐 收到批量请求: {len(queries)} 条, 并发 {concurrency}")
+    ticket = await admission.acquire(client_id(http_request), weight=concurrency)
+
+    async def lines():
+        try:
+            async for line in _batch_lines():
+                yield line
+        finally:
+            ticket.release()
+
+    async def _batch_lines():
+        with span("chat.batch", n=len(queries), concurrency=concurrency) as sp:
+            parent = sp.traceparent
+            if agent_cache is not None and queries:
+                try:
+                    from retriever import embed_query_texts
+                    # 一次 encode 全部 query，写进 query 缓存，后面每条查答案缓存时直接命中
+                    await asyncio.to_thread(embed_query_texts, queries)
+                except Exception as e:
+                    log.warning(f"⚠️ 批量 query 编码失败，逐条编码: {e}")
+        sem = asyncio.Semaphore(concurrency)
+
+        async def one(i: int):
+            async with sem:
+                row = {"index": i, "query": queries[i]}
+                try:
+                    with span("chat.batch.item", parent=parent, index=i), deadline_scope(CHAT_DEADLINE):
+                        row.update(await asyncio.wait_for(
+                            answer_query(queries[i], Conversation(f"batch-{uuid.uuid4().hex}")), timeout=remaining()))
+                except asyncio.TimeoutError:
+                    deadline_exceeded_total.inc()
+                    row["error"] = "deadline exceeded"
+                except Exception as e:
+                    log.error(f"❌ 批量第 {i} 条失败: {e}")
+                    row["error"] = str(e)
+                return row
+
+        tasks = [asyncio.ensure_future(one(i)) for i in range(len(queries))]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield json.dumps(await fut, ensure_ascii=False) + "\n"
+        finally:
+            for t in tasks:  # 客户端断开时不再继续跑剩下的
+                t.cancel()
+
+    # 客户端在开始读之前就断开时生成器不会运行，后台任务兜底释放名额（release 可重复调用）
+    return StreamingResponse(lines(), media_type="application/x-ndjson", background=BackgroundTask(ticket.release))
+
+def _sse(event: dict) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: ChatRequest, http_request: Request):
+    """
+    SSE 版本的 /chat：LLM 的文本片段、工具调用和工具结果一产生就推给前端，
+    首字节时间不再是所有 ReAct 步骤耗时之和。
+    session_id 不存在返回 404；准入在开始推流之前做，超限直接 429/503；超过截止时间推一个 error 事件后结束。
+    检索接地命中时先推一个 grounding 事件（检索到的商品 ID）。
+    """
+    user_query = request.query
+    log.info(f"🌐 收到前端流式请求: {user_query}")
+    conversation = conversation_for(request.session_id)
+    deadline_at = time.monotonic() + CHAT_DEADLINE
+    ticket = await admission.acquire(client_id(http_request), timeout=CHAT_DEADLINE)
+
+    async def event_source():
+        try:
+            with span("chat.stream", session_id=conversation.session_id), \
+                    deadline_scope(deadline_at - time.monotonic()):
+                async for chunk in _stream_events():
+                    yield chunk
+        finally:
+            ticket.release()
+
+    async def _stream_events():
+        try:
+            yield _sse({"type": "session", "session_id": conversation.session_id})
+            # agent 循环在单独的 task 里跑，到点就取消（进行中的 LLM / 工具调用一起取消）
+            async for event in until_deadline(_agent_events()):
+                yield _sse(event)
+        except DeadlineExceeded:
+            log.error(f"⏱️ 流式请求超过截止时间 {CHAT_DEADLINE}s: {user_query}")
+            yield _sse({"type": "error", "detail": "deadline exceeded"})
+        except Exception as e:
+            log.error(f"❌ Error: {str(e)}")
+            yield _sse({"type": "error", "detail": str(e)})
+
+    async def _agent_events():
+        prefetch = grounding.prefetch(user_query, conversation)
+        try:
+            emb, hit = await lookup_answer(user_query, conversation)
+            if hit is not None:
+                conversation.record(user_query, hit.reply)
+                yield {"type": "token", "text": hit.reply}
+                yield {"type": "final", "reply": hit.reply, "llm_calls": 0, "tool_calls": 0, "cached": True}
+                return
+            recorder = AnswerRecorder(user_query, emb)
+            async with conversation.turn() as history, mcp_pool.session() as session:
+                context, hits = await grounding.context(prefetch)
+                recorder.ground(hits)
+                if hits:
+                    yield {"type": "grounding", "product_ids": [h["metadata"].get("product_id") for h in hits]}
+                async for event in run_agent(session, mcp_pool.tools, user_query, stream=True,
+                                             tool_cache=_tool_cache(), history=history, context=context):
+                    recorder.observe(event)
+                    if event["type"] == "tool_call":
+                        log.info(f"⚙️ 调用工具: {event['name']}")
+                    elif event["type"] == "final":
+                        conversation.last_usage = event["usage"]
+                    yield event
+        finally:
+            grounding.cancel(prefetch)
+
+    # 客户端在开始读之前就断开时生成器不会运行，后台任务兜底释放名额（release 可重复调用）
+    return StreamingResponse(event_source(), media_type="text/event-stream", background=BackgroundTask(ticket.release))
 
 if __name__ == "__main__":
     import uvicorn
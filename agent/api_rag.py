@@ -1,19 +1,49 @@
 #把 RAG 整合到现有 FastAPI（这是把 RAG 做为一个可调用端点的示例）
 
-from fastapi import FastAPI
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+from typing import List
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from indexer_chroma import create_collection
-from retriever import embed_query, retrieve
+import bm25
+import embeddings
+from vector_store import get_store
+from retriever import aretrieve, aretrieve_many, query_cache
+from metrics import registry, cache_collector, render
+from tracing import instrument_app
 from rag_agent_tools import build_rag_prompt, ask_llm
 from dotenv import load_dotenv
 load_dotenv()
 
-app = FastAPI()
-col = create_collection()
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "1000"))  # 单个批量请求最多多少条 query
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # import 时不再加载模型/打开 Chroma，在这里显式预热，第一个请求就不用等
+    await asyncio.to_thread(embeddings.warmup)
+    await asyncio.to_thread(get_store)
+    await asyncio.to_thread(bm25.get_index)
+    yield
+
+app = FastAPI(lifespan=lifespan)
+instrument_app(app)
+registry.register_collector(cache_collector("query_embedding", query_cache.stats))
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus 文本格式：请求 / embed / 向量查询 / BM25 各阶段的耗时直方图和 query 缓存命中率"""
+    return PlainTextResponse(render(registry.snapshot({"process": "api_rag"})),
+                             media_type="text/plain; version=0.0.4")
 
 class QueryReq(BaseModel):
     query: str
 
+class BatchQueryReq(BaseModel):
+    queries: List[str]
+
 # 你需要实现 llm_client(prompt) 来调用你的 LLM（Anthropic/OpenAI）。这里只放一个伪实现。
 # llm_client_stub 只是占位，实际要把 prompt 发给 Claude/OpenAI/Local LLM（Anthropic 的 API 还可以，但需要你封装请求并解析返回）。关键点：让 LLM 输出 JSON（用明确指令、schema、示例 few-shot）。
 def llm_client_stub(prompt: str):
@@ -23,11 +53,14 @@ def llm_client_stub(prompt: str):
 @app.post("/rag_query")
 async def rag_query(q: QueryReq):
     # 1. retrieve top docs for context
-    q_emb = embed_query(q.query)
-    res = col.query(query_embeddings=[q_emb], n_results=3)
-    docs = res['documents'][0] if 'documents' in res else []
+    # 并发请求的 query embedding 会被微批合并，向量查询在线程里跑，不阻塞事件循环
+    hits = await aretrieve(q.query, top_k=3)
+    return answer_from_hits(q.query, hits)
 
-    prompt = build_rag_prompt(q.query, docs)
+def answer_from_hits(query: str, hits: list) -> dict:
+    docs = [h["doc"] for h in hits]
+
+    prompt = build_rag_prompt(query, docs)
     kind, payload = ask_llm(prompt, llm_client_stub)
     if kind == "tool":
         # Example: route to actual MCP tools or local functions
@@ -35,4 +68,27 @@ async def rag_query(q: QueryReq):
         params = payload.params
         return {"tool": action, "params": params}
     else:
-        return {"answer": payload}
\ No newline at end of file
+        return {"answer": payload}
+
+@app.post("/rag_query/batch")
+async def rag_query_batch(req: BatchQueryReq):
+    """
+    批量版 /rag_query（离线评测、目录 QA、预热缓存用）：所有 query 一次 encode、一次多 query 向量检索，
+    结果按完成顺序以 NDJSON 流式返回，每行带 index 对应请求里的位置；单条失败只影响那一行。
+    """
+    if len(req.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"too many queries (max {BATCH_MAX_QUERIES})")
+
+    async def lines():
+        async for i, hits in aretrieve_many(req.queries, top_k=3):
+            row = {"index": i, "query": req.queries[i]}
+            if isinstance(hits, Exception):
+                row["error"] = str(hits)
+            else:
+                try:
+                    row.update(answer_from_hits(req.queries[i], hits))
+                except Exception as e:
+                    row["error"] = str(e)
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
\ No newline at end of file
@@ -0,0 +1,58 @@
+# 多商品详情基准：对比“逐个调用 get_product_details”和“一次 get_products_details”
+# 看 Medusa 请求数、工具调用次数（= agent 循环里的 LLM 往返次数）、总耗时和 tool_result 的长度。
+# 用本地 Medusa 桩（fake_medusa），不走本地目录镜像，不需要 Claude。
+# 用法: python bench_bulk_details.py --sizes 3 10 20 --latency-ms 20
+
+import argparse
+import asyncio
+import os
+import time
+
+os.environ["CATALOG_ENABLED"] = "0"  # 只测线上 API 这条路径
+
+import httpx
+
+import agent_server
+import fake_medusa
+
+
+async def run(stub, ids, mode: str, fields=None):
+    agent_server.medusa_cache.invalidate()  # 冷缓存
+    before = stub.state.requests
+    t0 = time.perf_counter()
+    if mode == "single":
+        outs = [await agent_server.get_product_details(pid) for pid in ids]  # LLM 每一步只调一个工具
+        calls = len(ids)
+    else:
+        outs = [await agent_server.get_products_details(ids, fields)]
+        calls = 1
+    elapsed = (time.perf_counter() - t0) * 1000
+    text = "\n".join(outs)
+    return calls, stub.state.requests - before, elapsed, len(text), agent_server.approx_tokens(text), text
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 10, 20])
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--show", action="store_true", help="打印批量工具的输出")
+    args = parser.parse_args()
+
+    stub = fake_medusa.make_app(n_products=200, latency_ms=args.latency_ms)
+    agent_server._http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://medusa")
+    catalog = fake_medusa.make_catalog(200)
+
+    print(f"{'products':>8} {'mode':<22} {'tool calls':>10} {'medusa req':>10} {'ms':>8} {'chars':>7} {'~tokens':>8}")
+    for n in args.sizes:
+        ids = [p["id"] for p in catalog[:n]]
+        for mode, fields in (("single", None), ("bulk", None), ("bulk", ["price", "material"])):
+            label = mode if fields is None else f"{mode} fields={','.join(fields)}"
+            calls, requests, ms, chars, tokens, text = await run(stub, ids, mode, fields)
+            print(f"{n:>8} {label:<22} {calls:>10} {requests:>10} {ms:>8.1f} {chars:>7} {tokens:>8}")
+            if args.show and mode == "bulk":
+                print(text)
+    await agent_server._http_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
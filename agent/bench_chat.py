@@ -0,0 +1,92 @@
+# /chat 延迟基准：对比“每个请求启动一个 agent_server.py 子进程”与“常驻 MCP 会话池”
+# 用进程内的假 LLM（fake_llm.py，固定一次 search_products 调用 + 一次最终回复）代替 Claude，只测 MCP 侧开销。
+# 用法: python bench_chat.py --requests 50 --concurrency 4
+
+import argparse
+import asyncio
+import statistics
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import httpx
+from mcp import ClientSession
+from mcp.client.stdio import stdio_client
+
+import api
+import fake_llm
+from llm_client import set_llm_client
+
+api.agent_cache = None  # 每个请求都是同一个问题，这里测的是 MCP 会话池本身，不让答案缓存短路
+
+
+class SpawnPerRequest:
+    """旧行为：每个请求都启动子进程 + initialize + list_tools"""
+
+    def __init__(self, server_params):
+        self.server_params = server_params
+        self.tools = []
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @asynccontextmanager
+    async def session(self):
+        async with AsyncExitStack() as stack:
+            read, write = await stack.enter_async_context(stdio_client(self.server_params))
+            session = await stack.enter_async_context(ClientSession(read, write))
+            await session.initialize()
+            tools_result = await session.list_tools()
+            self.tools = [{"name": t.name, "description": t.description, "input_schema": t.inputSchema}
+                          for t in tools_result.tools]
+            yield session
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+async def run(label: str, n: int, concurrency: int):
+    latencies = []
+    sem = asyncio.Semaphore(concurrency)
+    # lifespan 退出时会关掉共享的 LLM 客户端，每一轮都重新接一次假 LLM
+    set_llm_client(fake_llm.make_client(fake_llm.make_app(latency_ms=0, token_delay_ms=0)))
+    async with api.app.router.lifespan_context(api.app):
+        transport = httpx.ASGITransport(app=api.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            async def one():
+                async with sem:
+                    t0 = time.perf_counter()
+                    r = await client.post("/chat", json={"query": "Sweatshirt 多少钱"})
+                    r.raise_for_status()
+                    latencies.append((time.perf_counter() - t0) * 1000)
+
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one() for _ in range(n)))
+            wall = time.perf_counter() - t0
+    print(f"{label:<18} n={n:<5} c={concurrency:<3} "
+          f"p50={statistics.median(latencies):8.1f}ms  p99={percentile(latencies, 99):8.1f}ms  "
+          f"rps={n / wall:7.1f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    pooled = api.mcp_pool
+
+    api.mcp_pool = SpawnPerRequest(pooled.server_params)
+    await run("before (spawn)", args.requests, args.concurrency)
+
+    api.mcp_pool = pooled
+    await run("after (pool)", args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
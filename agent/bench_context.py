@@ -0,0 +1,87 @@
+# 多轮对话上下文基准：同一个会话连续问 N 个问题，对比每轮发给 LLM 的 input tokens
+# baseline: 历史原样累积、不打 prompt caching 断点（旧行为 + 多轮）
+# managed : conversation.Conversation 裁剪旧 tool_result + 工具/system/最后一条消息上的缓存断点
+# 用进程内假 LLM（fake_llm.py，会按断点模拟缓存读写）和假的 MCP 会话，不需要 Claude / Medusa。
+# 用法: python bench_context.py --turns 8
+
+import argparse
+import asyncio
+from types import SimpleNamespace
+
+import agent_loop
+import fake_llm
+from agent_loop import run_agent
+from agent_server import format_search_results
+from conversation import Conversation
+from fake_medusa import make_catalog
+from llm_client import set_llm_client
+
+QUESTIONS = ["Sweatshirt 多少钱", "有没有黑色的 hoodie", "推荐几件 t-shirt", "有什么 sweatpants",
+             "shorts 有哪些颜色", "cap 多少钱", "有没有 organic cotton 的衣服", "wool blend 的外套"]
+
+TOOLS = [
+    {"name": "search_products", "description": "搜索商城里的商品。返回商品列表、ID和价格。",
+     "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}, "required": ["query"]}},
+    {"name": "get_product_details", "description": "获取特定商品的详细信息（材质、描述、所有变体等）。",
+     "input_schema": {"type": "object", "properties": {"product_id": {"type": "string"}},
+                      "required": ["product_id"]}},
+]
+
+
+class FakeSession:
+    """代替 MCP ClientSession：search_products 返回和真实工具同样格式的 20 条结果"""
+
+    def __init__(self, n_products: int = 2000):
+        self.catalog = make_catalog(n_products, seed=0)
+
+    async def call_tool(self, name, arguments, **kwargs):
+        words = arguments.get("query", "").lower().split()
+        hits = [p for p in self.catalog if any(w in p["title"].lower() for w in words)][:20]
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=format_search_results(hits))],
+                               isError=False)
+
+
+async def run(mode: str, turns: int):
+    fake = fake_llm.make_app(latency_ms=0, token_delay_ms=0)
+    set_llm_client(fake_llm.make_client(fake))
+    agent_loop.PROMPT_CACHING = mode == "managed"
+    session = FakeSession()
+    conversation = Conversation("bench")
+    history = []
+    rows = []
+    for i in range(turns):
+        q = QUESTIONS[i % len(QUESTIONS)]
+        final = None
+        if mode == "managed":
+            async with conversation.turn() as h:
+                async for event in run_agent(session, TOOLS, q, history=h):
+                    if event["type"] == "final":
+                        final = event
+        else:
+            async for event in run_agent(session, TOOLS, q, history=history):
+                if event["type"] == "final":
+                    final = event
+        rows.append(final["usage"])
+    return rows
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=8)
+    args = parser.parse_args()
+
+    for mode in ("baseline", "managed"):
+        rows = await run(mode, args.turns)
+        print(f"\n== {mode} ==")
+        print(f"{'turn':>4} {'input':>8} {'cache_read':>11} {'cache_write':>12} {'per call input':>20}")
+        for i, u in enumerate(rows, 1):
+            print(f"{i:>4} {u['input_tokens']:>8} {u['cache_read_input_tokens']:>11} "
+                  f"{u['cache_creation_input_tokens']:>12} {str(u['per_call_input_tokens']):>20}")
+        total = sum(u["input_tokens"] for u in rows)
+        read = sum(u["cache_read_input_tokens"] for u in rows)
+        write = sum(u["cache_creation_input_tokens"] for u in rows)
+        print(f"合计: 未缓存 input {total}, cache_read {read}, cache_write {write}, 全部 {total + read + write}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
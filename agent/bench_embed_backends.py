@@ -0,0 +1,162 @@
+# embedding 后端基准：torch / onnx / onnx-int8 各自在独立子进程里加载（RSS 互不干扰），比较
+#   加载耗时、批量吞吐（chunks/s）、单条查询 encode 延迟 p50/p95、峰值 RSS
+# 再以 torch 后端 + float32 存储为基线（没测 torch 就用第一个后端），在固定查询集上比较
+# 每个“后端 x 向量存储精度（FAISS_STORAGE）”组合的 recall@k 和向量占用。
+# 语料是 fake_medusa 的商品按 chunker 分出来的 chunk；磁盘 embedding 缓存关闭，每次都真的 encode。
+# --fake-cost-ms 时所有后端都换成 fake_embeddings.HashingEmbedder（只验证流程和存储精度的影响，不需要模型）。
+# 用法: python bench_embed_backends.py --products 2000 --threads 4
+#       python bench_embed_backends.py --backends onnx onnx-int8 --storages float32 int8 --k 10
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+QUERIES = [
+    "comfortable cotton hoodie", "black sweatpants", "warm winter jacket", "organic cotton t-shirt",
+    "recycled polyester shorts", "white sweatshirt", "navy cap", "wool blend socks",
+    "grey hoodie size L", "green t-shirt under 30 EUR", "red jacket XL", "cheap socks",
+    "something for everyday wear", "gift for someone who runs", "soft sweatshirt for winter",
+    "有没有纯棉的卫衣", "黑色运动裤", "适合夏天穿的短裤", "保暖的外套", "便宜一点的袜子",
+]
+
+
+def corpus(n_products: int):
+    import fake_medusa
+    from chunker import iter_product_chunks
+    docs = []
+    for prod in fake_medusa.make_catalog(n_products):
+        docs.extend(text for text, _ in iter_product_chunks(prod))
+    return docs
+
+
+def child(args):
+    from bench_load import percentile, peak_rss_mb
+    import embeddings
+
+    t0 = time.perf_counter()
+    if args.fake_cost_ms is not None:
+        from fake_embeddings import HashingEmbedder
+        model = HashingEmbedder(cost_ms_per_text=args.fake_cost_ms, busy=True)
+    else:
+        model = embeddings.load_model(args.child, args.threads)
+    embeddings.set_model(model, name=embeddings.backend_model_name(args.child))
+    embeddings.warmup()
+    load_s = time.perf_counter() - t0
+    rss_after_load = peak_rss_mb()
+
+    with open(args.corpus, "r", encoding="utf-8") as f:
+        docs = json.load(f)
+    t0 = time.perf_counter()
+    doc_emb = embeddings.embed_texts(docs, batch_size=args.batch_size)
+    throughput = len(docs) / (time.perf_counter() - t0)
+
+    latencies, query_emb = [], []
+    for _ in range(args.repeat):
+        for q in QUERIES:
+            t0 = time.perf_counter()
+            query_emb.append(embeddings.embed_texts([q])[0])
+            latencies.append((time.perf_counter() - t0) * 1000)
+    np.savez(args.out, docs=doc_emb, queries=np.stack(query_emb[:len(QUERIES)]))
+    print(json.dumps({"backend": args.child, "load_s": round(load_s, 2), "chunks_per_s": round(throughput, 1),
+                      "p50_ms": round(statistics.median(latencies), 2), "p95_ms": round(percentile(latencies, 95), 2),
+                      "rss_load_mb": round(rss_after_load, 1), "peak_rss_mb": round(peak_rss_mb(), 1)}))
+
+
+def store_bytes(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, f)) for f in ("vectors.npy", "scales.npy")
+               if os.path.exists(os.path.join(path, f)))
+
+
+def search(doc_emb: np.ndarray, query_emb: np.ndarray, storage: str, k: int, path: str):
+    """按给定存储精度建 flat 索引（强制走 faiss 索引，不走 numpy 精确计算），返回每个查询的 top-k 行号和向量占用"""
+    import faiss_store
+    from faiss_store import FaissStore
+    faiss_store.BRUTE_FORCE_MAX = 0
+    store = FaissStore("bench", "flat", path=path, storage=storage)
+    ids = [str(i) for i in range(len(doc_emb))]
+    store.upsert(ids, ids, [{} for _ in ids], doc_emb)
+    store.persist()
+    res = store.query(query_emb, n_results=k)
+    return [[int(i) for i in row] for row in res["ids"]], store_bytes(path)
+
+
+def recall(results, truth):
+    return statistics.mean(len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"],
+                        choices=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--storages", nargs="+", default=["float32", "float16", "int8"],
+                        choices=["float32", "float16", "int8"])
+    parser.add_argument("--threads", type=int, default=0, help="intra-op 线程数，0 = 框架默认")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=5, help="查询集重复几轮测单条延迟")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--fake-cost-ms", type=float, help="用哈希假模型，每条文本空转这么多毫秒")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--corpus", help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args)
+        return
+
+    tmp = tempfile.mkdtemp(prefix="bench_embed_")
+    try:
+        docs = corpus(args.products)
+        corpus_path = os.path.join(tmp, "corpus.json")
+        with open(corpus_path, "w", encoding="utf-8") as f:
+            json.dump(docs, f, ensure_ascii=False)
+        print(f"语料: {args.products} 个商品 -> {len(docs)} 个 chunk, 查询 {len(QUERIES)} 条, "
+              f"threads={args.threads or 'default'}, batch={args.batch_size}")
+        print(f"{'backend':<10} {'load s':>7} {'chunks/s':>9} {'q p50 ms':>9} {'q p95 ms':>9} "
+              f"{'RSS load MB':>12} {'peak RSS MB':>12}")
+
+        env = dict(os.environ, EMBED_CACHE_DIR="")  # 关掉磁盘缓存，测的是真实 encode
+        embedded = {}
+        for backend in args.backends:
+            out = os.path.join(tmp, f"{backend}.npz")
+            cmd = [sys.executable, __file__, "--child", backend, "--corpus", corpus_path, "--out", out,
+                   "--threads", str(args.threads), "--batch-size", str(args.batch_size),
+                   "--repeat", str(args.repeat)]
+            if args.fake_cost_ms is not None:
+                cmd += ["--fake-cost-ms", str(args.fake_cost_ms)]
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"{backend:<10} 失败:\n{proc.stderr[-2000:]}")
+                continue
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{backend:<10} {r['load_s']:>7.2f} {r['chunks_per_s']:>9.1f} {r['p50_ms']:>9.2f} "
+                  f"{r['p95_ms']:>9.2f} {r['rss_load_mb']:>12.1f} {r['peak_rss_mb']:>12.1f}")
+            with np.load(out) as data:
+                embedded[backend] = (data["docs"], data["queries"])
+        if not embedded:
+            return
+
+        base = "torch" if "torch" in embedded else next(iter(embedded))
+        q = embedded[base][1]
+        truth = np.argsort(-(q @ embedded[base][0].T), axis=1)[:, :args.k].tolist()
+        print(f"\nrecall@{args.k}（基线: {base} + float32 精确内积）")
+        print(f"{'backend':<10} {'storage':<8} {'recall':>7} {'vectors MB':>11}")
+        for backend, (doc_emb, query_emb) in embedded.items():
+            for storage in args.storages:
+                res, size = search(doc_emb, query_emb, storage, args.k, os.path.join(tmp, f"{backend}-{storage}"))
+                print(f"{backend:<10} {storage:<8} {recall(res, truth):>7.3f} {size / 2**20:>11.2f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
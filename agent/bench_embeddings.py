@@ -0,0 +1,68 @@
+# embed 吞吐与峰值内存基准：合成 chunk 流式输入，分别测冷缓存（全部 encode）和热缓存（全部命中）
+# 每个规模在独立子进程里跑，峰值 RSS 互不干扰。
+# 用法: python bench_embeddings.py --sizes 10000 100000 1000000 --batch-size 64
+
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+_WORDS = ("cotton soft hoodie sweatshirt shirt black white navy grey comfortable everyday "
+          "organic wool blend relaxed fit zip pocket warm light summer winter size price eur").split()
+
+
+def synthetic_chunks(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    for i in range(n):
+        yield f"product {i} " + " ".join(rng.choice(_WORDS) for _ in range(40))
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux 下单位是 KB
+
+
+def child(n: int, batch_size: int):
+    import embeddings
+    embeddings.get_cache()  # 先加载模型和缓存索引，不算进吞吐
+    result = {"size": n, "batch_size": batch_size, "rss_after_load_mb": round(peak_rss_mb(), 1)}
+    for phase in ("cold", "warm"):
+        t0 = time.perf_counter()
+        rows = 0
+        for block in embeddings.iter_embed(synthetic_chunks(n), batch_size=batch_size):
+            rows += block.shape[0]
+        elapsed = time.perf_counter() - t0
+        result[f"{phase}_chunks_per_s"] = round(rows / elapsed, 1)
+    result["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args.child, args.batch_size)
+        return
+
+    print(f"{'chunks':>9} {'cold chunks/s':>14} {'warm chunks/s':>14} {'peak RSS MB':>12}")
+    for n in args.sizes:
+        with tempfile.TemporaryDirectory() as cache_dir:
+            env = dict(os.environ, EMBED_CACHE_DIR=cache_dir)
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", str(n), "--batch-size", str(args.batch_size)],
+                env=env, capture_output=True, text=True, check=True,
+            )
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{n:>9} {r['cold_chunks_per_s']:>14} {r['warm_chunks_per_s']:>14} {r['peak_rss_mb']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# 检索接地基准：同一组问题分别在 CHAT_GROUNDING=off / first 下各走一遍 /chat（每个问题一个新会话），
+# 比较每个会话平均的 LLM 调用次数、工具调用次数、Medusa 请求数和延迟 p50/p95，报告接地省下的往返。
+# 和 bench_load 一样用假 LLM + 假 Medusa + 哈希 embedding，先 ingest 建好本地索引；
+# 工具侧的 Medusa 缓存和本地目录镜像都关掉，工具调用每次都真的请求 Medusa。
+# 用法: python bench_grounding.py --products 500 --rounds 3 --llm-latency-ms 300 --medusa-latency-ms 20
+
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from bench_load import QUERIES as SEARCH_QUERIES, configure_env, free_port, percentile, serve_in_thread
+
+# 问“有哪些”的接地后可以直接回答；问材质/对比的还要查详情，但省掉搜索那一步
+DETAIL_QUERIES = ["black hoodie 的材质是什么", "对比一下几款 organic cotton t-shirt", "wool blend jacket 的详细信息"]
+QUERIES = SEARCH_QUERIES + DETAIL_QUERIES
+
+
+async def run_mode(client, mode: str, rounds: int, medusa) -> dict:
+    import grounding
+    grounding.CHAT_GROUNDING = mode
+    llm_calls, tool_calls, grounded, latencies, errors = [], [], [], [], 0
+    before = medusa.state.requests
+    for r in range(rounds):
+        for i, q in enumerate(QUERIES):
+            t0 = time.perf_counter()
+            resp = await client.post("/chat", json={"query": q}, headers={"x-client-id": f"bench-{r}-{i}"})
+            if resp.status_code != 200:
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - t0) * 1000)
+            body = resp.json()
+            llm_calls.append(body["llm_calls"])
+            tool_calls.append(body["tool_calls"])
+            grounded.append(body.get("grounded", 0))
+    n = max(len(latencies), 1)
+    return {"mode": mode, "conversations": len(latencies), "errors": errors,
+            "llm_calls": sum(llm_calls) / n, "tool_calls": sum(tool_calls) / n,
+            "medusa_requests": (medusa.state.requests - before) / n, "grounded": sum(grounded) / n,
+            "p50_ms": statistics.median(latencies or [0.0]), "p95_ms": percentile(latencies or [0.0], 95)}
+
+
+async def main_async(args) -> list:
+    import embeddings
+    import fake_llm
+    import fake_medusa
+    import httpx
+    import ingest_medusa
+    from fake_embeddings import HashingEmbedder
+
+    embeddings.set_model(HashingEmbedder(), name="hashing-384")
+    medusa = fake_medusa.make_app(n_products=args.products, latency_ms=args.medusa_latency_ms)
+    llm = fake_llm.make_app(latency_ms=args.llm_latency_ms, token_delay_ms=0)
+    servers = [serve_in_thread(medusa, args.medusa_port), serve_in_thread(llm, args.llm_port)]
+    try:
+        await ingest_medusa.ingest_all()
+        import api
+        import grounding
+        grounding.warmup()
+        async with api.app.router.lifespan_context(api.app):
+            async with httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app), base_url="http://bench",
+                                         timeout=120) as client:
+                return [await run_mode(client, mode, args.rounds, medusa) for mode in ("off", "first")]
+    finally:
+        for s in servers:
+            s.should_exit = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3, help="问题集重复几轮")
+    parser.add_argument("--backend", default="faiss", choices=["faiss", "chroma"])
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=300, help="假 LLM 每次调用的延迟")
+    parser.add_argument("--medusa-latency-ms", type=float, default=20)
+    args = parser.parse_args()
+    args.answer_cache = False  # 答案缓存会把重复的问题直接吃掉，这里只看 agent 循环本身
+    args.medusa_port, args.llm_port = free_port(), free_port()
+
+    workdir = tempfile.mkdtemp(prefix="bench_grounding_")
+    configure_env(workdir, args, f"http://127.0.0.1:{args.medusa_port}", f"http://127.0.0.1:{args.llm_port}")
+    os.environ.update({"MEDUSA_CACHE_TTL": "0", "CATALOG_ENABLED": "0"})  # MCP server 子进程里生效
+    try:
+        rows = asyncio.run(main_async(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"问题 {len(QUERIES)} 条 x {args.rounds} 轮，每个问题一个新会话（每行是每个会话的平均值）")
+    print(f"{'grounding':<10} {'convs':>6} {'err':>4} {'llm calls':>10} {'tool calls':>11} {'medusa req':>11} "
+          f"{'chunks':>7} {'p50 ms':>9} {'p95 ms':>9}")
+    for r in rows:
+        print(f"{r['mode']:<10} {r['conversations']:>6} {r['errors']:>4} {r['llm_calls']:>10.2f} "
+              f"{r['tool_calls']:>11.2f} {r['medusa_requests']:>11.2f} {r['grounded']:>7.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f}")
+    off, first = rows
+    print(f"每个会话省下: LLM 往返 {off['llm_calls'] - first['llm_calls']:.2f} 次, "
+          f"工具调用 {off['tool_calls'] - first['tool_calls']:.2f} 次, "
+          f"Medusa 请求 {off['medusa_requests'] - first['medusa_requests']:.2f} 次, "
+          f"p50 {off['p50_ms'] - first['p50_ms']:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
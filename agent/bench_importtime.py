@@ -0,0 +1,57 @@
+# 冷启动 import 耗时检查：用 `python -X importtime` 逐个模块在全新解释器里 import，
+# 汇总累计耗时并列出最慢的依赖，超过预算时退出码为 1（可以直接放进 CI）。
+# 用法: python bench_importtime.py --budget-ms 500 embeddings indexer_chroma retriever api_rag
+
+import argparse
+import os
+import subprocess
+import sys
+
+DEFAULT_MODULES = ["embeddings", "indexer_chroma", "retriever", "api_rag"]
+# 这些重量级依赖应该只在第一次真正用到时才 import
+HEAVY = ("torch", "sentence_transformers", "transformers", "chromadb", "onnxruntime", "faiss")
+
+
+def import_profile(module: str):
+    """返回 (总累计耗时 ms, [(累计 ms, 模块名)], 是否导入了重量级依赖)"""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True,
+    )
+    if out.returncode != 0:
+        raise RuntimeError(f"import {module} 失败:\n{out.stderr[-2000:]}")
+    rows = []
+    for line in out.stderr.splitlines():
+        # 格式: "import time:   self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, self_us, cum_us, name = [x.strip() for x in line.replace("import time:", "|").split("|")]
+        rows.append((int(cum_us) / 1000, name))
+    total = next((ms for ms, name in rows if name == module), 0.0)
+    heavy = sorted({name.strip().split(".")[0] for _, name in rows} & set(HEAVY))
+    return total, rows, heavy
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", "500")))
+    parser.add_argument("--top", type=int, default=5)
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        total, rows, heavy = import_profile(module)
+        ok = total <= args.budget_ms and not heavy
+        failed |= not ok
+        print(f"{'✅' if ok else '❌'} {module:<16} {total:8.1f} ms (预算 {args.budget_ms:.0f} ms)"
+              + (f"  import 时加载了: {', '.join(heavy)}" if heavy else ""))
+        deps = [(ms, name) for ms, name in rows if name != module]
+        for ms, name in sorted(deps, reverse=True)[:args.top]:
+            print(f"      {ms:8.1f} ms  {name}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+# 多进程入库扩展性基准：同一个假 Medusa 目录，分别用 0（单进程）/1/2/.../N 个 encode 进程全量入库，看 chunks/s
+# 每种配置在独立子进程里跑，向量库 / BM25 / embedding 缓存都是全新的临时目录（冷缓存，全部要 encode）。
+# 默认用真模型（sentence-transformers）；--fake-cost-ms 用 fake_embeddings.HashingEmbedder 空转模拟每条的 CPU 开销，
+# 不需要 torch 也能看出扩展曲线。
+# 用法: python bench_ingest_scaling.py --products 5000 --workers 0 1 2 4 8
+#       python bench_ingest_scaling.py --products 5000 --fake-cost-ms 2
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+def child(args):
+    import functools
+    from bench_load import configure_env, free_port, serve_in_thread
+
+    workdir = tempfile.mkdtemp(prefix="bench_ingest_")
+    port = free_port()
+    configure_env(workdir, argparse.Namespace(backend=args.backend, pool_size=1, answer_cache=False),
+                  f"http://127.0.0.1:{port}", "http://127.0.0.1:9")
+    os.environ["CATALOG_ENABLED"] = "0"  # 只测 chunk -> embed -> 写向量库
+    import embeddings
+    import fake_medusa
+    import ingest_medusa
+
+    factory = name = None
+    if args.fake_cost_ms is not None:
+        from fake_embeddings import HashingEmbedder
+        factory = functools.partial(HashingEmbedder, cost_ms_per_text=args.fake_cost_ms, busy=True)
+        name = "hashing-384"
+        embeddings.set_model(factory(), name=name)
+    serve_in_thread(fake_medusa.make_app(n_products=args.products, latency_ms=0), port)
+
+    try:
+        stats = asyncio.run(ingest_medusa.ingest_all(page_size=args.page_size, batch_size=args.batch_size,
+                                                     workers=args.child, worker_threads=args.threads,
+                                                     model_factory=factory, model_name=name))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps({"workers": args.child, "chunks": stats["chunks"], "seconds": round(stats["seconds"], 2),
+                      "chunks_per_s": round(stats["chunks"] / stats["seconds"], 1)}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 1, 2, 4, os.cpu_count() or 1}))
+    parser.add_argument("--threads", type=int, default=1, help="每个 encode 进程的 torch 线程数")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--backend", default="faiss", choices=["faiss", "chroma"])
+    parser.add_argument("--fake-cost-ms", type=float, help="用哈希假模型，每条文本空转这么多毫秒")
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child is not None:
+        child(args)
+        return
+
+    print(f"CPU 核数: {os.cpu_count()}, 商品数: {args.products}")
+    print(f"{'workers':>8} {'chunks':>8} {'seconds':>9} {'chunks/s':>10} {'speedup':>8}")
+    base = None
+    for w in args.workers:
+        cmd = [sys.executable, __file__, "--child", str(w), "--products", str(args.products),
+               "--threads", str(args.threads), "--page-size", str(args.page_size),
+               "--batch-size", str(args.batch_size), "--backend", args.backend]
+        if args.fake_cost_ms is not None:
+            cmd += ["--fake-cost-ms", str(args.fake_cost_ms)]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{w:>8} 失败:\n{out.stderr[-2000:]}")
+            continue
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        base = base or r["chunks_per_s"]
+        label = "inproc" if w == 0 else w
+        print(f"{label!s:>8} {r['chunks']:>8} {r['seconds']:>9.2f} {r['chunks_per_s']:>10.1f} "
+              f"{r['chunks_per_s'] / base:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
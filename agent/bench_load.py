@@ -0,0 +1,248 @@
+# 离线压测：假 LLM（fake_llm）+ 假 Medusa（fake_medusa）+ 哈希 embedding（fake_embeddings），
+# 不需要 Anthropic key、Medusa 或模型权重，CI 里也能跑。
+# 依次跑 ingest -> retrieve() -> /rag_query -> /chat，报告吞吐、p50/p95/p99、错误数和内存（RSS）。
+# 所有状态（向量库、BM25、目录镜像、embedding 缓存、trace）都写在临时目录里，跑完删除。
+# 用法: python bench_load.py --products 2000 --requests 200 --concurrency 1 8 32
+#       python bench_load.py --json out.json --check baseline.json --tolerance 0.25   # 回归检查，超出容忍度退出码 1
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+SCENARIOS = ("ingest", "retrieve", "rag_query", "chat")
+QUERIES = ["sweatshirt", "black hoodie", "organic cotton t-shirt", "wool blend jacket", "navy cap",
+           "recycled polyester shorts", "grey sweatpants", "red socks"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))]
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_in_thread(app, port: int):
+    """在后台线程里用 uvicorn 跑一个 ASGI app（MCP server 子进程和 ingest 要通过真实 HTTP 访问）"""
+    import uvicorn
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    deadline = time.time() + 10
+    while not server.started:
+        if time.time() > deadline:
+            raise RuntimeError(f"stub server on :{port} did not start")
+        time.sleep(0.01)
+    return server
+
+
+def configure_env(workdir: str, args, medusa_url: str, llm_url: str):
+    # 这些模块级常量在 import 时读取，必须在 import 业务模块之前设置
+    os.environ.update({
+        "MEDUSA_API_URL": medusa_url,
+        "ANTHROPIC_BASE_URL": llm_url,
+        "ANTHROPIC_API_KEY": "fake",
+        "VECTOR_BACKEND": args.backend,
+        "FAISS_INDEX_DIR": os.path.join(workdir, "faiss_index"),
+        "BM25_INDEX_PATH": os.path.join(workdir, "bm25_index.pkl"),
+        "INGEST_STATE_PATH": os.path.join(workdir, "ingest_state.json"),
+        "CATALOG_DB_PATH": os.path.join(workdir, "catalog.sqlite"),
+        "EMBED_CACHE_DIR": os.path.join(workdir, "embed_cache"),
+        "TRACE_EXPORT_PATH": os.path.join(workdir, "traces.jsonl"),
+        "MCP_POOL_SIZE": str(args.pool_size),
+        "ANSWER_CACHE_ENABLED": "1" if args.answer_cache else "0",
+        "LOG_LEVEL": "WARNING",
+        "TRUSTED_PROXIES": "127.0.0.1",  # ASGITransport 的来源地址；基准按 X-Client-Id 模拟多个客户端
+    })
+
+
+async def drive(name: str, one, n: int, concurrency: int) -> dict:
+    """并发度 concurrency 下调用 n 次 one(i)，统计延迟分布"""
+    sem = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def task(i):
+        nonlocal errors
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                await one(i)
+            except Exception:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    rss0 = rss_mb()
+    t0 = time.perf_counter()
+    await asyncio.gather(*(task(i) for i in range(n)))
+    wall = time.perf_counter() - t0
+    lat = latencies or [0.0]
+    return {"scenario": name, "concurrency": concurrency, "requests": n, "errors": errors,
+            "throughput": round(len(latencies) / wall, 2), "p50_ms": round(statistics.median(lat), 2),
+            "p95_ms": round(percentile(lat, 95), 2), "p99_ms": round(percentile(lat, 99), 2),
+            "rss_mb": round(rss_mb(), 1), "rss_delta_mb": round(rss_mb() - rss0, 1)}
+
+
+async def run_ingest(args) -> dict:
+    import ingest_medusa
+    rss0 = rss_mb()
+    stats = await ingest_medusa.ingest_all(page_size=args.page_size)
+    return {"scenario": "ingest", "concurrency": ingest_medusa.FETCH_CONCURRENCY, "requests": stats["products"],
+            "errors": 0, "throughput": round(stats["products"] / stats["seconds"], 2),
+            "chunks_per_s": round(stats["chunks"] / stats["seconds"], 2), "seconds": round(stats["seconds"], 2),
+            "p50_ms": None, "p95_ms": None, "p99_ms": None,
+            "rss_mb": round(rss_mb(), 1), "rss_delta_mb": round(rss_mb() - rss0, 1)}
+
+
+async def run_retrieve(args, concurrency: int) -> dict:
+    import retriever
+    retriever.query_cache.invalidate()
+
+    async def one(i):
+        # 一半请求带序号，避免全被 query 缓存吃掉
+        q = QUERIES[i % len(QUERIES)] + ("" if i % 2 else f" size {i}")
+        await retriever.aretrieve(q, top_k=5)
+
+    return await drive("retrieve", one, args.requests, concurrency)
+
+
+async def run_http(name: str, app, path: str, args, body) -> list:
+    """lifespan 只进一次（MCP 会话池等启动一次），各并发度共用"""
+    import httpx
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            async def one(i):
+                # 每个请求一个客户端 ID，模拟很多用户（否则会撞上 api 的每客户端并发上限）
+                r = await client.post(path, json=body(i), headers={"x-client-id": f"bench-{i}"})
+                r.raise_for_status()
+
+            return [await drive(name, one, args.requests, c) for c in args.concurrency]
+
+
+def print_table(rows):
+    print(f"\n{'scenario':<10} {'conc':>5} {'reqs':>6} {'err':>4} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9} {'rss MB':>8} {'Δrss MB':>8}")
+    for r in rows:
+        fmt = lambda v: f"{v:>9.1f}" if isinstance(v, (int, float)) else f"{'-':>9}"
+        print(f"{r['scenario']:<10} {r['concurrency']:>5} {r['requests']:>6} {r['errors']:>4} {r['throughput']:>9.1f} "
+              f"{fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])} {r['rss_mb']:>8.1f} {r['rss_delta_mb']:>8.1f}")
+    print(f"peak RSS: {peak_rss_mb():.1f} MB")
+
+
+def check_regressions(rows, baseline_path: str, tolerance: float) -> list:
+    """和基线比较：吞吐下降或 p95 上升超过 tolerance 就算回归"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(b["scenario"], b["concurrency"]): b for b in json.load(f)["results"]}
+    problems = []
+    for r in rows:
+        b = baseline.get((r["scenario"], r["concurrency"]))
+        if b is None:
+            continue
+        if r["errors"] > b["errors"]:
+            problems.append(f"{r['scenario']}@{r['concurrency']}: errors {b['errors']} -> {r['errors']}")
+        if b["throughput"] and r["throughput"] < b["throughput"] * (1 - tolerance):
+            problems.append(f"{r['scenario']}@{r['concurrency']}: throughput {b['throughput']} -> {r['throughput']}")
+        if b.get("p95_ms") and r.get("p95_ms") and r["p95_ms"] > b["p95_ms"] * (1 + tolerance):
+            problems.append(f"{r['scenario']}@{r['concurrency']}: p95 {b['p95_ms']}ms -> {r['p95_ms']}ms")
+    return problems
+
+
+async def main_async(args) -> list:
+    import embeddings
+    import fake_llm
+    import fake_medusa
+    from fake_embeddings import HashingEmbedder
+
+    embeddings.set_model(HashingEmbedder(cost_ms_per_text=args.embed_cost_ms), name="hashing-384")
+    medusa = fake_medusa.make_app(n_products=args.products, latency_ms=args.medusa_latency_ms)
+    llm = fake_llm.make_app(latency_ms=args.llm_latency_ms, token_delay_ms=0)
+    servers = [serve_in_thread(medusa, args.medusa_port), serve_in_thread(llm, args.llm_port)]
+
+    rows = []
+    try:
+        if "ingest" in args.scenarios:
+            rows.append(await run_ingest(args))
+        if "retrieve" in args.scenarios:
+            for c in args.concurrency:
+                rows.append(await run_retrieve(args, c))
+        if "rag_query" in args.scenarios:
+            import api_rag
+            rows += await run_http("rag_query", api_rag.app, "/rag_query", args,
+                                   lambda i: {"query": QUERIES[i % len(QUERIES)] + f" #{i}"})
+        if "chat" in args.scenarios:
+            import api
+            rows += await run_http("chat", api.app, "/chat", args,
+                                   lambda i: {"query": QUERIES[i % len(QUERIES)]})
+    finally:
+        for s in servers:
+            s.should_exit = True
+    print(f"fake LLM calls: {llm.state.calls}, fake Medusa requests: {medusa.state.requests}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--backend", default="faiss", choices=["faiss", "chroma"])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--llm-latency-ms", type=float, default=50)
+    parser.add_argument("--medusa-latency-ms", type=float, default=5)
+    parser.add_argument("--embed-cost-ms", type=float, default=0.0, help="每条文本模拟的 encode 开销")
+    parser.add_argument("--answer-cache", action="store_true", help="/chat 打开语义答案缓存（默认关闭，测完整循环）")
+    parser.add_argument("--json", help="结果写到这个 JSON 文件")
+    parser.add_argument("--check", help="和这个基线 JSON 比较，回归时退出码为 1")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+    args.medusa_port, args.llm_port = free_port(), free_port()
+
+    workdir = tempfile.mkdtemp(prefix="bench_load_")
+    configure_env(workdir, args, f"http://127.0.0.1:{args.medusa_port}", f"http://127.0.0.1:{args.llm_port}")
+    try:
+        rows = asyncio.run(main_async(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_table(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k not in ("json", "check")},
+                       "results": rows}, f, ensure_ascii=False, indent=2)
+    if args.check:
+        problems = check_regressions(rows, args.check, args.tolerance)
+        for p in problems:
+            print(f"❌ 回归: {p}")
+        sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
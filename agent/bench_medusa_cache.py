@@ -0,0 +1,57 @@
+# 用本地 Medusa 桩验证 agent_server 的共享连接池 + 响应缓存
+# 用法: python bench_medusa_cache.py --concurrency 100
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+import agent_server
+import fake_medusa
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    stub = fake_medusa.make_app(n_products=200, latency_ms=args.latency_ms)
+    agent_server._http_client = httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=stub), base_url="http://medusa"
+    )
+    cache = agent_server.medusa_cache
+
+    # 1. 并发的相同请求只打到 Medusa 一次（single-flight）
+    t0 = time.perf_counter()
+    outs = await asyncio.gather(*(agent_server.get_product_details("prod_00000000")
+                                  for _ in range(args.concurrency)))
+    cold_ms = (time.perf_counter() - t0) * 1000
+    assert all("Sweatshirt" in o for o in outs), outs[0]
+    assert stub.state.requests == 1, stub.state.requests
+    print(f"{args.concurrency} 个并发详情查询 -> Medusa 请求 {stub.state.requests} 次, 耗时 {cold_ms:.1f}ms")
+
+    # 2. TTL 内的重复请求直接命中缓存
+    t0 = time.perf_counter()
+    for _ in range(args.concurrency):
+        await agent_server.get_product_details("prod_00000000")
+    warm_ms = (time.perf_counter() - t0) * 1000
+    assert stub.state.requests == 1
+    print(f"{args.concurrency} 次串行重复查询 (缓存命中) 耗时 {warm_ms:.1f}ms")
+
+    # 3. 不同参数是不同的 key；失败的响应不缓存
+    await agent_server.search_products("Sweatshirt")
+    await agent_server.search_products("Sweatshirt")
+    await agent_server.get_product_details("prod_missing")
+    await agent_server.get_product_details("prod_missing")
+    assert stub.state.requests == 4, stub.state.requests
+
+    print("缓存统计:", agent_server.medusa_cache_stats())
+    assert cache.hits >= args.concurrency + 1
+    await agent_server._http_client.aclose()
+    print("✅ OK")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
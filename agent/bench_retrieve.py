@@ -0,0 +1,78 @@
+# retrieve() 吞吐/延迟基准：同步逐条 encode vs 异步微批（aretrieve），多个并发度下对比
+# --distinct 时每个请求都是不同的 query（测微批）；否则从少量热门 query 里抽（测 LRU 缓存）。
+# --stages 时额外打印混合检索各阶段（embed / vector / bm25 / fuse / rerank）的平均耗时。
+# 用法: python bench_retrieve.py --concurrency 1 4 16 64 --requests 512 --distinct --stages
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import retriever
+
+POPULAR = ["sweatshirt", "t-shirt", "hoodie", "black hoodie", "cotton sweatpants", "shorts", "cap"]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))]
+
+
+def make_queries(n: int, distinct: bool, seed: int):
+    rng = random.Random(seed)
+    if distinct:
+        return [f"{rng.choice(POPULAR)} size {rng.choice('SMLX')} #{seed}-{i}" for i in range(n)]
+    return [rng.choice(POPULAR) for _ in range(n)]
+
+
+async def run(mode: str, queries, concurrency: int, stages: dict = None):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(q):
+        async with sem:
+            timings = {}
+            t0 = time.perf_counter()
+            if mode == "sync":
+                await asyncio.to_thread(retriever.retrieve, q, 5, None, timings)
+            else:
+                await retriever.aretrieve(q, 5, timings=timings)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if stages is not None:
+                for k, v in timings.items():
+                    stages.setdefault(k, []).append(v)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(q) for q in queries))
+    wall = time.perf_counter() - t0
+    return len(queries) / wall, statistics.median(latencies), percentile(latencies, 99)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--distinct", action="store_true")
+    parser.add_argument("--stages", action="store_true")
+    args = parser.parse_args()
+
+    retriever.embed_query_text("warmup")
+    retriever.get_collection()
+
+    print(f"{'mode':<6} {'conc':>5} {'qps':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for c in args.concurrency:
+        for i, mode in enumerate(("sync", "async")):
+            retriever.query_cache.invalidate()
+            # 两种模式用不同的 seed，避免磁盘向量缓存让第二轮占便宜
+            queries = make_queries(args.requests, args.distinct, seed=c * 10 + i)
+            stages = {} if args.stages else None
+            qps, p50, p99 = await run(mode, queries, c, stages)
+            print(f"{mode:<6} {c:>5} {qps:>9.1f} {p50:>9.1f} {p99:>9.1f}")
+            if stages:
+                print("       " + "  ".join(f"{k}={statistics.mean(v):.2f}ms" for k, v in stages.items()))
+    print("batcher:", retriever.batcher.stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
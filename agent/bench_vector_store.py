@@ -0,0 +1,128 @@
+# 向量库 recall@k 与延迟基准：同一份语料分别写入 Chroma 和 FAISS（flat / hnsw / ivfpq），
+# 以 numpy 精确内积的结果为真值，比较 recall@k、单条查询 p50/p99 和加载耗时。
+# 语料默认是合成的聚类向量；--from-chroma 时直接用现有 Chroma collection 里的向量。
+# 用法: python bench_vector_store.py --size 100000 --queries 200 --k 10
+
+import argparse
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+import faiss_store
+from faiss_store import FaissStore
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[max(0, min(len(values) - 1, int(round(p / 100 * (len(values) - 1)))))]
+
+
+def synthetic_corpus(n: int, dim: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(8, n // 500), dim)).astype(np.float32)
+    labels = rng.integers(0, len(centers), n)
+    x = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype(np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    ids = [f"prod_{i // 3:08d}:{i % 3}:bench" for i in range(n)]
+    metas = [{"product_id": f"prod_{i // 3:08d}", "category": f"pcol_{labels[i] % 8}", "source": "bench"}
+             for i in range(n)]
+    docs = [f"synthetic chunk {i}" for i in range(n)]
+    return ids, docs, metas, x
+
+
+def chroma_corpus(limit: int):
+    from vector_store import get_store
+    col = get_store(backend="chroma")
+    got = col.get(include=["metadatas", "documents", "embeddings"], limit=limit)
+    x = np.asarray(got["embeddings"], dtype=np.float32)
+    return got["ids"], got["documents"], got["metadatas"], x
+
+
+def run_queries(store, queries: np.ndarray, k: int, where):
+    latencies, results = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        res = store.query(query_embeddings=[q.tolist()], n_results=k, where=where)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        results.append(res["ids"][0])
+    return latencies, results
+
+
+def recall(results, truth):
+    return statistics.mean(len(set(r) & set(t)) / max(len(t), 1) for r, t in zip(results, truth))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100_000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--where", action="store_true", help="查询时带 category 过滤")
+    parser.add_argument("--from-chroma", action="store_true")
+    parser.add_argument("--skip-chroma", action="store_true")
+    args = parser.parse_args()
+
+    if args.from_chroma:
+        ids, docs, metas, x = chroma_corpus(args.size)
+    else:
+        ids, docs, metas, x = synthetic_corpus(args.size, args.dim)
+    rng = np.random.default_rng(1)
+    queries = x[rng.integers(0, len(x), args.queries)] + 0.05 * rng.standard_normal((args.queries, x.shape[1]))
+    queries = (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+    where = {"category": "pcol_1"} if args.where else None
+
+    # 真值：在满足过滤条件的行里精确计算
+    allowed = np.array([where is None or m["category"] == where["category"] for m in metas])
+    rows = np.flatnonzero(allowed)
+    top = np.argsort(-(queries @ x[rows].T), axis=1)[:, :args.k]
+    truth = [[ids[rows[j]] for j in row] for row in top]
+
+    print(f"语料 {len(ids)} 条, dim={x.shape[1]}, k={args.k}, 过滤={where}")
+    print(f"{'backend':<14} {'build s':>8} {'load ms':>8} {'recall@k':>9} {'p50 ms':>8} {'p99 ms':>8}")
+
+    tmp = tempfile.mkdtemp()
+    try:
+        for index_type in ("flat", "hnsw", "ivfpq"):
+            path = f"{tmp}/{index_type}"
+            t0 = time.perf_counter()
+            store = FaissStore("bench", index_type, path=path)
+            for i in range(0, len(ids), 10_000):
+                store.upsert(ids[i:i + 10_000], docs[i:i + 10_000], metas[i:i + 10_000], x[i:i + 10_000])
+            store.persist()
+            build = time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            store = FaissStore.open("bench", index_type, path=path)  # mmap 零拷贝加载
+            load_ms = (time.perf_counter() - t0) * 1000
+            faiss_store.BRUTE_FORCE_MAX = 0  # 基准里强制走索引，才能体现不同索引类型的差异
+            lat, res = run_queries(store, queries, args.k, where)
+            print(f"{'faiss-' + index_type:<14} {build:>8.1f} {load_ms:>8.1f} {recall(res, truth):>9.3f} "
+                  f"{statistics.median(lat):>8.2f} {percentile(lat, 99):>8.2f}")
+
+        if not args.skip_chroma and not args.from_chroma:
+            from indexer_chroma import get_client
+            client = get_client()
+            try:
+                client.delete_collection("bench_vectors")
+            except Exception:
+                pass
+            t0 = time.perf_counter()
+            col = client.get_or_create_collection("bench_vectors")
+            for i in range(0, len(ids), 5_000):
+                col.upsert(ids=ids[i:i + 5_000], documents=docs[i:i + 5_000],
+                           metadatas=metas[i:i + 5_000], embeddings=x[i:i + 5_000].tolist())
+            build = time.perf_counter() - t0
+            lat, res = run_queries(col, queries, args.k, where)
+            print(f"{'chroma':<14} {build:>8.1f} {'-':>8} {recall(res, truth):>9.3f} "
+                  f"{statistics.median(lat):>8.2f} {percentile(lat, 99):>8.2f}")
+            client.delete_collection("bench_vectors")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
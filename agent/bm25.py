@@ -0,0 +1,166 @@
+# 内存里的 BM25 倒排索引，和向量一起在入库时维护，给 retriever 做词法召回
+
+"""
+商品名、SKU、handle、prod_01H... 这类精确字符串，向量检索经常排不上来，BM25 正好补上。
+- 英文/数字按 [a-z0-9_-]+ 切词（prod_01H...、t-shirt 保持完整，同时拆出子词）
+- 中文没有空格，按单字 + 相邻双字切
+- chunk 的 product_id / handle / title 也算进可检索文本
+索引 pickle 到 BM25_INDEX_PATH，第一次用到时才加载；文件被入库进程更新后，服务进程下次用到时自动重新加载。
+"""
+import math
+import os
+import pickle
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from vector_store import match_where
+
+BM25_INDEX_PATH = os.getenv("BM25_INDEX_PATH", "./bm25_index.pkl")
+K1 = 1.2
+B = 0.75
+
+_WORD = re.compile(r"[a-z0-9][a-z0-9_\-]*")
+_CJK = re.compile(r"[一-鿿]+")
+
+
+def tokenize(text: str) -> List[str]:
+    text = (text or "").lower()
+    tokens = []
+    for w in _WORD.findall(text):
+        tokens.append(w)
+        if "-" in w or "_" in w:
+            tokens.extend(p for p in re.split(r"[\-_]", w) if p)
+    for run in _CJK.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _searchable(doc: str, meta: dict) -> str:
+    return " ".join(str(x) for x in (doc, meta.get("product_id"), meta.get("handle"), meta.get("title")) if x)
+
+
+class BM25Index:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # term -> {chunk id: tf}
+        self._lengths: Dict[str, int] = {}
+        self._terms: Dict[str, List[str]] = {}  # chunk id -> 去重后的 term，删除时用
+        self.docs: Dict[str, str] = {}
+        self.metas: Dict[str, dict] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def upsert(self, ids: List[str], docs: List[str], metas: List[dict]):
+        with self._lock:
+            self.delete(ids)
+            for _id, doc, meta in zip(ids, docs, metas):
+                tf = Counter(tokenize(_searchable(doc, meta)))
+                for term, n in tf.items():
+                    self._postings[term][_id] = n
+                length = sum(tf.values())
+                self._lengths[_id] = length
+                self._terms[_id] = list(tf)
+                self._total_len += length
+                self.docs[_id] = doc
+                self.metas[_id] = dict(meta)
+
+    def delete(self, ids: Optional[List[str]] = None, product_ids: Optional[List[str]] = None):
+        with self._lock:
+            targets = list(ids or [])
+            if product_ids:
+                wanted = set(product_ids)
+                targets += [i for i, m in self.metas.items() if m.get("product_id") in wanted]
+            for _id in targets:
+                if _id not in self._lengths:
+                    continue
+                for term in self._terms.pop(_id):
+                    posting = self._postings.get(term)
+                    if posting is not None:
+                        posting.pop(_id, None)
+                        if not posting:
+                            del self._postings[term]
+                self._total_len -= self._lengths.pop(_id)
+                self.docs.pop(_id, None)
+                self.metas.pop(_id, None)
+
+    def ids_for_products(self, product_ids: List[str]) -> List[str]:
+        wanted = set(product_ids)
+        return [i for i, m in self.metas.items() if m.get("product_id") in wanted]
+
+    def search(self, query: str, k: int = 10, where: Optional[dict] = None) -> List[Tuple[str, float]]:
+        with self._lock:
+            n = len(self._lengths)
+            if n == 0:
+                return []
+            avgdl = self._total_len / n
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                posting = self._postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+                for _id, tf in posting.items():
+                    dl = self._lengths[_id]
+                    scores[_id] += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * dl / avgdl))
+            ranked = sorted(scores.items(), key=lambda x: -x[1])
+            if where:
+                ranked = [(i, s) for i, s in ranked if match_where(self.metas[i], where)]
+            return ranked[:k]
+
+    def save(self, path: str = BM25_INDEX_PATH):
+        global _index_mtime
+        with self._lock:
+            state = {"postings": dict(self._postings), "lengths": self._lengths, "terms": self._terms,
+                     "docs": self.docs, "metas": self.metas, "total_len": self._total_len}
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        if self is _index and path == BM25_INDEX_PATH:
+            _index_mtime = _mtime(path)  # 自己写的文件不需要再重新加载
+
+    @classmethod
+    def load(cls, path: str = BM25_INDEX_PATH) -> "BM25Index":
+        index = cls()
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            index._postings = defaultdict(dict, state["postings"])
+            index._lengths = state["lengths"]
+            index._terms = state["terms"]
+            index.docs = state["docs"]
+            index.metas = state["metas"]
+            index._total_len = state["total_len"]
+        return index
+
+
+_index: Optional[BM25Index] = None
+_index_mtime: Optional[float] = None
+_index_lock = threading.Lock()
+
+
+def _mtime(path: str) -> Optional[float]:
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def _stale(mtime: Optional[float]) -> bool:
+    return _index is None or (mtime is not None and (_index_mtime is None or mtime > _index_mtime))
+
+
+def get_index() -> BM25Index:
+    global _index, _index_mtime
+    mtime = _mtime(BM25_INDEX_PATH)
+    if _stale(mtime):
+        with _index_lock:
+            if _stale(mtime):
+                _index = BM25Index.load()
+                _index_mtime = mtime
+    return _index
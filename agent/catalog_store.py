@@ -0,0 +1,190 @@
+# 本地商品目录镜像：ingest 拉到的完整商品 JSON 顺手写进 SQLite，agent_server 的工具优先从这里读
+
+"""
+search_products / get_product_details 原来每次都要走一趟 Medusa HTTP。ingest_medusa 本来就会拉全量商品，
+把 payload 存一份到本地 SQLite 之后，详情查询就是一次主键读，搜索走 FTS5。
+- products 表按 id 主键，handle / collection_id 建索引
+- products_fts 是 FTS5 全文索引（title / description / handle）；sqlite 没编译 FTS5 时退化成 LIKE
+- meta 表记录上次完整同步的时间，调用方按 CATALOG_MAX_AGE 判断是否过期，过期就回退到线上 API
+- changes 表是商品变更流水：ingest 写入内容变化/下架的商品 id，api 进程的答案缓存按 seq 增量拉取做失效
+ingest 进程写、MCP server 进程读，开 WAL 模式，读写互不阻塞。
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+CATALOG_DB_PATH = os.getenv("CATALOG_DB_PATH", "./chroma_db/catalog.sqlite")
+CATALOG_ENABLED = os.getenv("CATALOG_ENABLED", "1") == "1"
+CATALOG_MAX_AGE = float(os.getenv("CATALOG_MAX_AGE", "3600"))  # 秒，超过这个时间没同步就不信任本地数据
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    handle TEXT,
+    title TEXT,
+    collection_id TEXT,
+    updated_at TEXT,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_handle ON products(handle);
+CREATE INDEX IF NOT EXISTS idx_products_collection ON products(collection_id);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, product_id TEXT NOT NULL, changed_at REAL);
+"""
+_FTS_SCHEMA = "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(id UNINDEXED, title, description, handle)"
+_TERM = re.compile(r"\w+", re.UNICODE)
+CHANGES_KEEP = 100_000  # 变更流水只保留最近这么多条
+
+
+class CatalogStore:
+    def __init__(self, path: str = CATALOG_DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.fallbacks = 0
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            try:
+                self._conn.execute(_FTS_SCHEMA)
+                self.fts = True
+            except sqlite3.OperationalError:
+                self.fts = False
+
+    def close(self):
+        self._conn.close()
+
+    # ---------- 写（ingest 进程） ----------
+    def upsert_products(self, products: List[dict]):
+        rows = [(p["id"], p.get("handle"), p.get("title"), p.get("collection_id") or p.get("category_id"),
+                 p.get("updated_at"), json.dumps(p, ensure_ascii=False)) for p in products if p.get("id")]
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO products(id, handle, title, collection_id, updated_at, payload) VALUES (?,?,?,?,?,?) "
+                "ON CONFLICT(id) DO UPDATE SET handle=excluded.handle, title=excluded.title, "
+                "collection_id=excluded.collection_id, updated_at=excluded.updated_at, payload=excluded.payload",
+                rows)
+            if self.fts:
+                ids = [(r[0],) for r in rows]
+                self._conn.executemany("DELETE FROM products_fts WHERE id = ?", ids)
+                self._conn.executemany(
+                    "INSERT INTO products_fts(id, title, description, handle) VALUES (?,?,?,?)",
+                    [(p["id"], p.get("title") or "", p.get("description") or "", p.get("handle") or "")
+                     for p in products if p.get("id")])
+
+    def delete_products(self, product_ids: List[str]):
+        if not product_ids:
+            return
+        ids = [(i,) for i in product_ids]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM products WHERE id = ?", ids)
+            if self.fts:
+                self._conn.executemany("DELETE FROM products_fts WHERE id = ?", ids)
+
+    def record_changes(self, product_ids: List[str]):
+        if not product_ids:
+            return
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO changes(product_id, changed_at) VALUES (?, ?)",
+                                   [(pid, now) for pid in product_ids])
+            self._conn.execute("DELETE FROM changes WHERE seq <= (SELECT MAX(seq) FROM changes) - ?",
+                               (CHANGES_KEEP,))
+
+    def mark_synced(self, ts: Optional[float] = None):
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta(key, value) VALUES ('synced_at', ?)",
+                               (str(ts if ts is not None else time.time()),))
+
+    # ---------- 读（MCP server 进程） ----------
+    def synced_at(self) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'synced_at'").fetchone()
+        return float(row["value"]) if row else None
+
+    def is_fresh(self, max_age: float = CATALOG_MAX_AGE) -> bool:
+        ts = self.synced_at()
+        return ts is not None and time.time() - ts <= max_age
+
+    def changes_since(self, seq: int) -> Tuple[int, List[str]]:
+        """返回 (最新 seq, seq 之后变化过的商品 id)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, product_id FROM changes WHERE seq > ? ORDER BY seq",
+                                      (seq,)).fetchall()
+        if not rows:
+            return seq, []
+        return rows[-1]["seq"], list(dict.fromkeys(r["product_id"] for r in rows))
+
+    def latest_change(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+
+    def get(self, product_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT payload FROM products WHERE id = ?", (product_id,)).fetchone()
+        return json.loads(row["payload"]) if row else None
+
+    def get_many(self, product_ids: List[str]) -> Dict[str, dict]:
+        if not product_ids:
+            return {}
+        marks = ",".join("?" * len(product_ids))
+        with self._lock:
+            rows = self._conn.execute(f"SELECT id, payload FROM products WHERE id IN ({marks})",
+                                      list(product_ids)).fetchall()
+        return {r["id"]: json.loads(r["payload"]) for r in rows}
+
+    def search(self, query: str, limit: int = 5) -> List[dict]:
+        terms = _TERM.findall(query or "")
+        if not terms:
+            return []
+        with self._lock:
+            if self.fts:
+                # 每个词都做前缀匹配，所有词都要命中；按 bm25 排序
+                match = " AND ".join('"%s"*' % t.replace('"', '""') for t in terms)
+                rows = self._conn.execute(
+                    "SELECT p.payload FROM products_fts f JOIN products p ON p.id = f.id "
+                    "WHERE products_fts MATCH ? ORDER BY bm25(products_fts) LIMIT ?",
+                    (match, limit)).fetchall()
+            else:
+                rows = []
+            if not rows:
+                # FTS5 对没有空格的中文按整段切词，这里再用子串匹配兜底一次
+                like = "%" + query.strip() + "%"
+                rows = self._conn.execute(
+                    "SELECT payload FROM products WHERE title LIKE ? OR handle LIKE ? LIMIT ?",
+                    (like, like, limit)).fetchall()
+        return [json.loads(r["payload"]) for r in rows]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def stats(self) -> dict:
+        return {"products": self.count(), "synced_at": self.synced_at(), "fresh": self.is_fresh(),
+                "local_hits": self.local_hits, "fallbacks": self.fallbacks, "fts5": self.fts}
+
+
+_catalog: Optional[CatalogStore] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> Optional[CatalogStore]:
+    """CATALOG_ENABLED=0 时返回 None，调用方直接走线上 API"""
+    global _catalog
+    if not CATALOG_ENABLED:
+        return None
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = CatalogStore()
+    return _catalog
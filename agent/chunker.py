@@ -0,0 +1,239 @@
+# 按 token 和商品字段分块：不超过 embedding 模型的最大序列长度，中文也能正确切分
+
+"""
+旧的 chunk_text 按空格切 200 词一块：
+- all-MiniLM-L6-v2 只看前 256 个 token，英文 200 词经常超过，超出部分被模型静默截掉
+- 中文没有空格，整段描述就是一个“词”，根本不切
+这里改成按 token 计数（有 HF tokenizer 就用 tokenizer 的 offset，没有就用一个偏保守的正则近似：
+CJK 每个字一个 token，字母/数字按最多 8 / 4 个字符一段），切块时只在 token 边界上截取原文。
+
+product_to_chunks 用 iter_product_chunks：
+- 按字段分段：标题、描述（按句子）、材质、规格选项、变体、价格；每个 chunk 都以标题开头，单独召回也知道是哪件商品
+- 段落按顺序装箱，尽量填满 CHUNK_MAX_TOKENS，所以 chunk 更少、更接近模型能看的长度
+- 变体标题如果只是规格选项的组合（"S / Black"）就不再逐个列出，价格去重后按价格分组
+- 同一商品里完全相同的 chunk 只出一次；生成器按需产出，不先拼出整件商品的全部文本
+"""
+import os
+import re
+import threading
+from typing import Iterator, List, Optional, Tuple
+
+import embeddings
+
+# 模型能看的最大 token 数（all-MiniLM-L6-v2 的 max_seq_length 是 256），再减掉 [CLS] / [SEP]
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "256"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "32"))  # 只有超长的单句/单段被硬切时才重叠
+_SPECIAL_TOKENS = 2
+
+_CJK = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"  # 假名、汉字、韩文
+_APPROX_TOKEN = re.compile(rf"[{_CJK}]|[A-Za-z]{{1,8}}|\d{{1,4}}|[^\s{_CJK}A-Za-z\d]")
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;])\s*|(?<=\.)\s+|\n+")
+
+_tokenizer = None
+_tokenizer_lock = threading.Lock()
+
+
+def get_tokenizer():
+    """
+    优先用已经加载的模型自带的 fast tokenizer（sentence-transformers 或 ONNX 后端的 tokenizers.Tokenizer）；
+    模型没加载（比如 encode 在 worker 进程里）就只加载 tokenizer；都不行返回 None，走正则近似。
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        with _tokenizer_lock:
+            if _tokenizer is None:
+                _tokenizer = _load_tokenizer() or False
+    return _tokenizer or None
+
+
+def _load_tokenizer():
+    model = embeddings._model
+    tok = getattr(model, "tokenizer", None) if model is not None else None
+    if tok is not None and (getattr(tok, "is_fast", False) or hasattr(tok, "encode_batch")):
+        return tok
+    if not embeddings._model_name.startswith(embeddings.MODEL_NAME):
+        return None  # 换成了别的模型（比如离线基准的哈希模型），没有对应的 tokenizer
+    try:
+        if embeddings.EMBED_BACKEND != "torch":
+            from onnx_embedder import load_tokenizer
+            return load_tokenizer(embeddings.MODEL_NAME)
+        from transformers import AutoTokenizer
+        return AutoTokenizer.from_pretrained(embeddings.MODEL_NAME)
+    except Exception:
+        return None
+
+
+def max_tokens() -> int:
+    """单个 chunk 的 token 预算（不含特殊 token）"""
+    limit = CHUNK_MAX_TOKENS
+    model = embeddings._model
+    seq = getattr(model, "max_seq_length", None) if model is not None else None
+    if isinstance(seq, int) and seq > 0:
+        limit = min(limit, seq)
+    return limit - _SPECIAL_TOKENS
+
+
+def token_spans(text: str) -> List[Tuple[int, int]]:
+    """每个 token 在原文里的 (start, end)"""
+    tok = get_tokenizer()
+    if tok is not None:
+        if hasattr(tok, "encode_batch"):  # tokenizers.Tokenizer（ONNX 后端）
+            offsets = tok.encode(text, add_special_tokens=False).offsets
+        else:
+            offsets = tok(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        return [(s, e) for s, e in offsets if e > s]
+    return [m.span() for m in _APPROX_TOKEN.finditer(text)]
+
+
+def count_tokens(text: str) -> int:
+    return len(token_spans(text))
+
+
+def split_text(text: str, budget: Optional[int] = None, overlap: int = CHUNK_OVERLAP_TOKENS) -> Iterator[str]:
+    """
+    把一段文本切成每块不超过 budget 个 token：优先在句子边界切，单句超长才在 token 边界硬切（带 overlap）。
+    """
+    budget = budget or max_tokens()
+    text = (text or "").strip()
+    if not text:
+        return
+    buf, used = [], 0
+    for sentence in _SENTENCE_END.split(text):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        n = count_tokens(sentence)
+        if n > budget:
+            if buf:
+                yield _join(buf)
+                buf, used = [], 0
+            yield from _hard_split(sentence, budget, overlap)
+            continue
+        if used + n > budget and buf:
+            yield _join(buf)
+            buf, used = [], 0
+        buf.append(sentence)
+        used += n
+    if buf:
+        yield _join(buf)
+
+
+def _hard_split(text: str, budget: int, overlap: int) -> Iterator[str]:
+    spans = token_spans(text)
+    step = max(1, budget - min(overlap, budget // 2))
+    for i in range(0, len(spans), step):
+        window = spans[i:i + budget]
+        yield text[window[0][0]:window[-1][1]]
+        if i + budget >= len(spans):
+            return
+
+
+def _join(parts: List[str]) -> str:
+    # 中文句子之间不加空格，其他语言用空格连接
+    out = parts[0]
+    for p in parts[1:]:
+        out += ("" if re.match(rf"[{_CJK}]", p) or re.search(rf"[{_CJK}。！？；]$", out) else " ") + p
+    return out
+
+
+def _option_values(prod: dict) -> set:
+    return {str(v.get("value", "")).strip().lower()
+            for opt in prod.get("options") or [] for v in opt.get("values") or []}
+
+
+def _price(p: dict) -> Optional[str]:
+    amount = p.get("amount")
+    if amount is None:
+        return None
+    return f"{amount / 100} {p.get('currency_code', '').upper()}".strip()
+
+
+def product_sections(prod: dict) -> Iterator[Tuple[str, str]]:
+    """按字段产出 (字段名, 文本)，已经去掉重复和纯冗余的信息"""
+    description = (prod.get("description") or "").strip()
+    if description:
+        yield "description", description
+    if prod.get("material"):
+        yield "material", f"材质: {prod['material']}"
+
+    options = []
+    for opt in prod.get("options") or []:
+        values = list(dict.fromkeys(str(v.get("value", "")) for v in opt.get("values") or []))
+        if values:
+            options.append(f"{opt.get('title', '')}: {', '.join(values)}")
+    if options:
+        yield "options", "可选规格: " + " | ".join(options)
+
+    known = _option_values(prod)
+    variants, prices = [], {}
+    for v in prod.get("variants") or []:
+        title = (v.get("title") or "").strip()
+        # "S / Black" 这种只是规格选项组合的变体标题，上面的可选规格已经覆盖了
+        parts = [x.strip().lower() for x in re.split(r"[/|,]", title) if x.strip()]
+        if title and not (parts and all(x in known for x in parts)):
+            variants.append(title)
+        for p in (v.get("prices") or [])[:1]:
+            price = _price(p)
+            if price:
+                prices.setdefault(price, []).append(title)
+    variants = list(dict.fromkeys(variants))
+    if variants:
+        yield "variants", "变体: " + ", ".join(variants)
+    if len(prices) == 1:
+        yield "price", f"价格: {next(iter(prices))}"
+    elif prices:
+        yield "price", "价格: " + "; ".join(f"{price} ({', '.join(dict.fromkeys(t for t in titles if t))})"
+                                             for price, titles in prices.items())
+
+
+def iter_product_chunks(prod: dict) -> Iterator[Tuple[str, dict]]:
+    """
+    逐个产出 (chunk 文本, metadata)。每个 chunk = 标题 + 尽量多的完整字段段落，不超过 token 预算。
+    metadata 的 fields 记录这个 chunk 里有哪些字段（"description+price"）。
+    """
+    title = (prod.get("title") or "").strip()
+    head = title
+    budget = max_tokens()
+    head_tokens = count_tokens(head) + 1 if head else 0
+    room = max(budget - head_tokens, budget // 2)
+
+    seen = set()
+    index = 0
+    buf: List[str] = []
+    fields: List[str] = []
+    used = 0
+
+    def emit():
+        nonlocal index
+        body = "\n".join(buf)
+        text = f"{head}\n{body}" if head and body else (head or body)
+        if text in seen:
+            return None
+        seen.add(text)
+        meta = {
+            "product_id": prod.get("id"),
+            "chunk_index": index,
+            "title": title,
+            "handle": prod.get("handle"),
+            "category": prod.get("collection_id") or prod.get("category_id"),
+            "fields": "+".join(dict.fromkeys(fields)) or "title",
+            "source": "medusa",
+        }
+        index += 1
+        return text, meta
+
+    for field, text in product_sections(prod):
+        for piece in split_text(text, room):
+            n = count_tokens(piece)
+            if buf and used + n + 1 > room:
+                out = emit()
+                if out:
+                    yield out
+                buf, fields, used = [], [], 0
+            buf.append(piece)
+            fields.append(field)
+            used += n + 1
+    if buf or (head and index == 0):
+        out = emit()
+        if out:
+            yield out
@@ -0,0 +1,93 @@
+# 熔断器：上游（Medusa）连续失败后短时间内直接拒绝，不让每个工具调用都卡满超时
+
+"""
+closed    正常放行，连续 failure_threshold 次失败 -> open
+open      reset_timeout 秒内所有调用直接抛 CircuitOpen（不发请求）
+half_open 冷却结束后放一个探测请求过去：成功 -> closed，失败 -> 重新 open
+失败 = 抛异常（连接失败、超时）或者 is_failure(结果) 为真（比如 5xx）；4xx 不算上游故障。
+"""
+import os
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from metrics import registry
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+T = TypeVar("T")
+
+breaker_rejected = registry.counter("circuit_rejected_total", "熔断打开期间被直接拒绝的调用数")
+breaker_opened = registry.counter("circuit_opened_total", "熔断器打开的次数")
+
+_STATE_VALUE = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitOpen(Exception):
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} 熔断中，{retry_after:.0f}s 后重试")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def _before(self):
+        if self.state == "open":
+            waited = time.monotonic() - self.opened_at
+            if waited < self.reset_timeout:
+                breaker_rejected.inc(circuit=self.name)
+                raise CircuitOpen(self.name, self.reset_timeout - waited)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._probing:  # 已经有一个探测请求在路上
+                breaker_rejected.inc(circuit=self.name)
+                raise CircuitOpen(self.name, 1)
+            self._probing = True
+
+    def _on_success(self):
+        self.failures = 0
+        self.state = "closed"
+        self._probing = False
+
+    def _on_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                breaker_opened.inc(circuit=self.name)
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    async def call(self, fn: Callable[[], Awaitable[T]],
+                   is_failure: Optional[Callable[[T], bool]] = None) -> T:
+        self._before()
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                self._on_failure()
+            else:
+                self._probing = False  # 被取消不算上游故障
+            raise
+        if is_failure is not None and is_failure(result):
+            self._on_failure()
+        else:
+            self._on_success()
+        return result
+
+    def stats(self) -> dict:
+        return {"name": self.name, "state": self.state, "failures": self.failures}
+
+    def collect(self):
+        return [("circuit_state", "gauge", "熔断器状态：0=closed 1=half_open 2=open", {"circuit": self.name},
+                 _STATE_VALUE[self.state])]
@@ -0,0 +1,152 @@
+# 服务端会话：按 session_id 保存多轮对话历史，控制每次发给 LLM 的上下文大小
+
+"""
+原来每个 /chat 请求都是一次性的 messages 列表，原始工具输出原样塞进去，每一步都整包重发。
+- ConversationStore 按 session_id 保存 Conversation（TTL + LRU，复用 ttl_cache.TTLCache）
+- 每轮结束后 compact()：只保留最近 MAX_HISTORY_TURNS 轮；早于最近 KEEP_FULL_TOOL_TURNS 轮的
+  tool_result 截断到 TOOL_RESULT_MAX_CHARS 个字，LLM 已经基于它回答过了，没必要每次都带全文；
+  检索接地（grounding.py）放在提问前面的参考资料块（以 CONTEXT_TAG 开头）同理直接删掉
+- 同一个会话的请求串行执行（asyncio.Lock），一轮中途失败就回滚到这一轮开始前，历史里不会留下
+  没有 tool_result 配对的 tool_use
+- build_request_messages() 在最后一条消息上打 prompt caching 断点（工具定义和 system 的断点见 agent_loop）
+"""
+import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from typing import List, Optional
+
+from ttl_cache import TTLCache
+
+SESSION_TTL = float(os.getenv("SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "10000"))
+MAX_HISTORY_TURNS = int(os.getenv("MAX_HISTORY_TURNS", "6"))
+KEEP_FULL_TOOL_TURNS = int(os.getenv("KEEP_FULL_TOOL_TURNS", "1"))
+TOOL_RESULT_MAX_CHARS = int(os.getenv("TOOL_RESULT_MAX_CHARS", "300"))
+
+CACHE_CONTROL = {"type": "ephemeral"}
+CONTEXT_TAG = "<retrieved_products>"
+
+
+def _is_turn_start(message: dict) -> bool:
+    # 用户的提问（字符串或 text 块）开启一轮；装 tool_result 的 user 消息不算
+    if message["role"] != "user":
+        return False
+    content = message["content"]
+    return isinstance(content, str) or not any(b.get("type") == "tool_result" for b in content)
+
+
+def _truncate(text: str, limit: int) -> str:
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}…（已截断，原文 {len(text)} 字）"
+
+
+def compact(messages: List[dict], max_turns: int = MAX_HISTORY_TURNS,
+            keep_full_turns: int = KEEP_FULL_TOOL_TURNS, max_chars: int = TOOL_RESULT_MAX_CHARS) -> List[dict]:
+    """原地裁剪历史，返回同一个列表；max_turns=0 表示不保留历史"""
+    if max_turns <= 0:
+        messages.clear()  # starts[-0] 是 starts[0]，不能走下面的切片
+        return messages
+    starts = [i for i, m in enumerate(messages) if _is_turn_start(m)]
+    if len(starts) > max_turns:
+        del messages[:starts[-max_turns]]
+        starts = [i for i, m in enumerate(messages) if _is_turn_start(m)]
+    cutoff = starts[-keep_full_turns] if keep_full_turns and len(starts) >= keep_full_turns else len(messages)
+    for m in messages[:cutoff]:
+        if m["role"] != "user" or isinstance(m["content"], str):
+            continue
+        if _is_turn_start(m):
+            m["content"] = [b for b in m["content"]
+                            if not (b.get("type") == "text" and b.get("text", "").startswith(CONTEXT_TAG))]
+            continue
+        for block in m["content"]:
+            if block.get("type") == "tool_result" and isinstance(block.get("content"), str):
+                block["content"] = _truncate(block["content"], max_chars)
+    return messages
+
+
+def build_request_messages(messages: List[dict]) -> List[dict]:
+    """复制一份，在最后一条消息的最后一个块上加 cache_control；同一轮后续步骤的请求都以它为前缀"""
+    if not messages:
+        return messages
+    out = list(messages)
+    last = dict(out[-1])
+    content = last["content"]
+    if isinstance(content, str):
+        content = [{"type": "text", "text": content}]
+    else:
+        content = [dict(b) if isinstance(b, dict) else b for b in content]
+    if content and isinstance(content[-1], dict):
+        content[-1] = dict(content[-1], cache_control=CACHE_CONTROL)
+    last["content"] = content
+    out[-1] = last
+    return out
+
+
+class Conversation:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.messages: List[dict] = []
+        self.turns = 0
+        self.created_at = time.time()
+        self.last_usage: Optional[dict] = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def is_new(self) -> bool:
+        return not self.messages
+
+    @asynccontextmanager
+    async def turn(self):
+        """一轮对话：串行、失败回滚、成功后裁剪"""
+        async with self._lock:
+            mark = len(self.messages)
+            try:
+                yield self.messages
+            except BaseException:
+                del self.messages[mark:]
+                raise
+            if len(self.messages) > mark:
+                self.turns += 1
+                compact(self.messages)
+
+    def record(self, user_query: str, reply: str):
+        """直接记一问一答（答案缓存命中时用，后续追问仍然有上下文）"""
+        self.messages.append({"role": "user", "content": user_query})
+        self.messages.append({"role": "assistant", "content": [{"type": "text", "text": reply}]})
+        self.turns += 1
+        compact(self.messages)
+
+    def stats(self) -> dict:
+        return {"session_id": self.session_id, "turns": self.turns, "messages": len(self.messages),
+                "last_usage": self.last_usage}
+
+
+class ConversationStore:
+    def __init__(self, maxsize: int = MAX_SESSIONS, ttl: float = SESSION_TTL):
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_or_create(self, session_id: Optional[str] = None) -> Optional[Conversation]:
+        """
+        不传 session_id 就新开一个会话，ID 只由服务端生成；传了但不存在（不是这里发的、已过期或已删除）
+        返回 None，不按客户端给的 ID 建会话（防 session fixation）
+        """
+        if session_id:
+            conversation = self._cache.get(session_id)
+            if conversation is None:
+                return None
+        else:
+            conversation = Conversation(uuid.uuid4().hex)
+        self._cache.set(conversation.session_id, conversation)  # 每次用到都续期
+        return conversation
+
+    def get(self, session_id: str) -> Optional[Conversation]:
+        return self._cache.get(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        return self._cache.invalidate(lambda k: k == session_id) > 0
+
+    def __len__(self):
+        return len(self._cache._data)
@@ -1,33 +1,304 @@
-# 处理文本分块并生成 embeddings（使用 sentence-transformers）
+# 处理文本分块并生成 embeddings（sentence-transformers / ONNX Runtime）
 
-from sentence_transformers import SentenceTransformer
-from typing import List
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from tracing import span
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock：多个进程不要共用同一个 EMBED_CACHE_DIR
+    fcntl = None
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
 
 # model: 小而快的 embedding 模型，适合 CPU（如果有GPU可以换 bigger model）
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
-model = SentenceTransformer(MODEL_NAME)
+
+# 推理后端：torch = sentence-transformers（PyTorch）；onnx / onnx-int8 = ONNX Runtime（见 onnx_embedder.py），不加载 torch
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+# 推理的 intra-op 线程数，0 = 框架默认（用满所有核）；多进程入库时 ingest_workers 按进程分配
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+# 按内容 hash 缓存向量，相同的 chunk / query 不重复 encode；设为空字符串关闭磁盘缓存
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", "./embed_cache")
+
+# 模型在第一次用到时才加载（import 本模块不再付出加载模型的代价），多线程下只加载一次
+_model: Optional["SentenceTransformer"] = None
+
+def backend_model_name(backend: str) -> str:
+    # 不同后端（尤其是 int8）算出的向量有细微差别，磁盘缓存按后端分目录
+    return MODEL_NAME if backend == "torch" else f"{MODEL_NAME}@{backend}"
+
+_model_name = backend_model_name(EMBED_BACKEND)
+_model_lock = threading.Lock()
+_dimension: Optional[int] = None
+
+def load_model(backend: Optional[str] = None, threads: Optional[int] = None):
+    """按后端加载一个新模型（不缓存）；get_model() 用它加载进程内的单例，基准里用它逐个比较后端"""
+    backend = backend or EMBED_BACKEND
+    threads = EMBED_THREADS if threads is None else threads
+    if backend == "torch":
+        # sentence_transformers 会连带 import torch，也推迟到这里
+        from sentence_transformers import SentenceTransformer
+        if threads > 0:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(MODEL_NAME)
+    if backend in ("onnx", "onnx-int8"):
+        from onnx_embedder import OnnxEmbedder
+        return OnnxEmbedder(MODEL_NAME, quantize=backend == "onnx-int8", threads=threads)
+    raise ValueError(f"未知的 EMBED_BACKEND: {backend}，可选 {', '.join(EMBED_BACKENDS)}")
+
+def get_model() -> "SentenceTransformer":
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = load_model()
+    return _model
+
+def set_model(model, name: Optional[str] = None):
+    """
+    换掉进程内的 embedding 模型（基准/CI 里用 fake_embeddings.HashingEmbedder 离线跑）。
+    name 决定磁盘向量缓存的子目录，不同模型的向量不会混在一起。
+    """
+    global _model, _model_name, _cache, _dimension
+    with _model_lock:
+        _model = model
+        _model_name = name or type(model).__name__
+        _dimension = None
+    with _cache_lock:
+        _cache = None
+
+def set_dimension(dim: int, name: Optional[str] = None):
+    """
+    encode 放在别的进程里做（ingest_workers），本进程不加载模型时用：告诉它向量维度和模型名，
+    磁盘缓存照常在本进程里读写。
+    """
+    global _model_name, _cache, _dimension
+    with _model_lock:
+        _dimension = dim
+        if name:
+            _model_name = name
+    with _cache_lock:
+        _cache = None
+
+def get_dimension() -> int:
+    global _dimension
+    if _dimension is None:
+        _dimension = get_model().get_sentence_embedding_dimension()
+    return _dimension
+
+def warmup():
+    """加载模型并跑一次 encode，供 FastAPI lifespan 在接流量前调用"""
+    get_model().encode(["warmup"], show_progress_bar=False)
+    get_cache()
+
+def __getattr__(name):
+    # 兼容旧写法 `from embeddings import model`
+    if name == "model":
+        return get_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def chunk_text(text: str, chunk_size_words: int = 200, overlap_words: int = 40) -> List[str]:
     """
-    简单按单词分块（近似 token）。建议 chunk_size_words 设在 200-600 范围。
+    兼容旧接口：现在按 token 切（见 chunker.split_text），不超过模型的最大序列长度，中文也能切开。
+    chunk_size_words / overlap_words 按 token 数理解，超过模型上限时以模型上限为准。
+    """
+    import chunker  # chunker 依赖本模块，延迟 import 避免循环
+    budget = min(chunk_size_words, chunker.max_tokens())
+    return list(chunker.split_text(text, budget, min(overlap_words, budget // 2)))
+
+def text_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """
+    磁盘上的向量缓存，每个模型一个目录：
+    - vectors.f32: 所有向量按行追加的 float32 原始数据，读取时 np.memmap，不整体载入内存
+    - keys.txt:    每行一个内容 hash，行号就是向量所在的行
+    先写向量再写 key，进程中途退出也不会出现 key 指向不存在的向量。
+    api / api_rag / ingest 默认共用同一个目录：追加时持有 lock 文件上的 flock，行号按文件里实际的
+    行数算；别的进程追加的 key 在下次 lookup / add 时读进来。
     """
-    if not text:
-        return []
-    words = text.split()
-    chunks = []
-    i = 0
-    while i < len(words):
-        chunk = " ".join(words[i:i+chunk_size_words])
-        chunks.append(chunk)
-        i += chunk_size_words - overlap_words
-    return chunks
 
-def embed_texts(texts: List[str]):
+    def __init__(self, cache_dir: str, dim: int):
+        self.dir = cache_dir
+        self.dim = dim
+        self._vec_path = os.path.join(cache_dir, "vectors.f32")
+        self._key_path = os.path.join(cache_dir, "keys.txt")
+        self._lock_path = os.path.join(cache_dir, "lock")
+        self._row_bytes = dim * 4
+        self._lock = threading.Lock()
+        self._index: Dict[str, int] = {}
+        self._rows = 0  # 已经读进来的 key 行数（= 向量行数）
+        self._key_offset = 0  # keys.txt 读到的字节位置
+        self._mmap: Optional[np.memmap] = None
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load()
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _load(self):
+        with self._file_lock():
+            self._sync()
+            if os.path.exists(self._vec_path) and os.path.getsize(self._vec_path) > self._rows * self._row_bytes:
+                # 上次写完向量但没来得及写 key 就退出了，截掉多余的行，保证行号和 key 对齐
+                with open(self._vec_path, "r+b") as f:
+                    f.truncate(self._rows * self._row_bytes)
+
+    def _sync(self):
+        """读进 keys.txt 里新追加的行（包括别的进程写的），只读到最后一个完整的行"""
+        try:
+            size = os.path.getsize(self._key_path)
+        except OSError:
+            return
+        if size <= self._key_offset:
+            return
+        with open(self._key_path, "rb") as f:
+            f.seek(self._key_offset)
+            data = f.read(size - self._key_offset)
+        end = data.rfind(b"\n") + 1
+        self._key_offset += end
+        for line in data[:end].decode("ascii").splitlines():
+            self._index.setdefault(line.strip(), self._rows)  # 两个进程同时算了同一个 key，用先写的那行
+            self._rows += 1
+
+    def _vectors(self) -> np.memmap:
+        n = self._rows
+        if self._mmap is None or self._mmap.shape[0] < n:
+            self._mmap = np.memmap(self._vec_path, dtype=np.float32, mode="r", shape=(n, self.dim))
+        return self._mmap
+
+    def __len__(self):
+        return len(self._index)
+
+    def lookup(self, keys: List[str]) -> Dict[int, np.ndarray]:
+        """返回 {keys 中的位置: 向量}，只包含命中的"""
+        with self._lock:
+            if any(k not in self._index for k in keys):
+                self._sync()
+            hits = {i: self._index[k] for i, k in enumerate(keys) if k in self._index}
+            if not hits:
+                return {}
+            vectors = self._vectors()
+            return {i: np.array(vectors[row]) for i, row in hits.items()}
+
+    def add(self, keys: List[str], vectors: np.ndarray):
+        with self._lock, self._file_lock():
+            self._sync()
+            fresh = [(k, v) for k, v in zip(keys, vectors) if k not in self._index]
+            # 同一批里的重复 key 只写一次
+            seen = set()
+            fresh = [(k, v) for k, v in fresh if not (k in seen or seen.add(k))]
+            if not fresh:
+                return
+            block = np.ascontiguousarray(np.stack([v for _, v in fresh]), dtype=np.float32)
+            with open(self._vec_path, "ab") as f:
+                if f.tell() != self._rows * self._row_bytes:
+                    f.truncate(self._rows * self._row_bytes)  # 别的进程写了向量没写 key 就退出了
+                f.write(block.tobytes())
+            with open(self._key_path, "a", encoding="ascii") as f:
+                f.write("".join(k + "\n" for k, _ in fresh))
+            self._sync()  # 持有文件锁，新读到的正好是刚写的这些行
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> Optional[EmbeddingCache]:
+    global _cache
+    if _cache is None and EMBED_CACHE_DIR:
+        with _cache_lock:
+            if _cache is None:
+                sub = _model_name.replace("/", "__")
+                _cache = EmbeddingCache(os.path.join(EMBED_CACHE_DIR, sub), get_dimension())
+    return _cache
+
+def _encode(texts: List[str]) -> np.ndarray:
+    with span("embed.encode", rows=len(texts)):
+        return np.asarray(
+            get_model().encode(texts, batch_size=len(texts), show_progress_bar=False, normalize_embeddings=True),
+            dtype=np.float32,
+        )
+
+def lookup_cached(texts: List[str]) -> Tuple[np.ndarray, List[str]]:
+    """
+    返回 (out, todo)：out 是 (n, dim) 数组，缓存命中的行已经填好；
+    todo 是还需要 encode 的文本（去重后，同一批里相同的文本只 encode 一次）。
+    """
+    out = np.empty((len(texts), get_dimension()), dtype=np.float32)
+    cache = get_cache()
+    hits = cache.lookup([text_hash(t) for t in texts]) if cache is not None else {}
+    for i, v in hits.items():
+        out[i] = v
+    todo = list(dict.fromkeys(t for i, t in enumerate(texts) if i not in hits))
+    return out, todo
+
+def fill_encoded(texts: List[str], out: np.ndarray, todo: List[str], encoded: np.ndarray):
+    """把 todo 的 encode 结果填进 out 的对应行，并写入磁盘缓存"""
+    if not todo:
+        return
+    by_text = dict(zip(todo, encoded))
+    for i, t in enumerate(texts):
+        v = by_text.get(t)
+        if v is not None:
+            out[i] = v
+    cache = get_cache()
+    if cache is not None:
+        cache.add([text_hash(t) for t in todo], encoded)
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    if get_cache() is None:
+        return _encode(texts)
+    out, todo = lookup_cached(texts)
+    if todo:
+        fill_encoded(texts, out, todo, _encode(todo))
+    return out
+
+def iter_embed(texts: Iterable[str], batch_size: int = EMBED_BATCH_SIZE) -> Iterator[np.ndarray]:
+    """
+    流式 embed：输入可以是任意可迭代对象（包括生成器），每凑满 batch_size 条就 yield 一个
+    (batch, dim) 的 float32 数组，内存只和 batch_size 有关。
+    """
+    it = iter(texts)
+    while True:
+        batch = list(islice(it, batch_size))
+        if not batch:
+            return
+        yield _embed_batch(batch)
+
+def embed_queries(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    查询向量：直接 encode，不读写磁盘缓存。磁盘缓存是给 ingest 的 chunk 用的（不淘汰、写入要拿文件锁），
+    用户 query 各不相同，只放 retriever 里的内存 TTL/LRU。
+    """
+    if not texts:
+        return np.empty((0, get_dimension()), dtype=np.float32)
+    return np.concatenate([_encode(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)], axis=0)
+
+def embed_texts(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
     """
-    返回向量（list of lists）。在 CPU 上可能较慢，批量化会快一点。
+    返回 (n, dim) 的 float32 numpy 数组（已归一化）。需要 list 的地方（比如 Chroma）在边界处再 .tolist()。
     """
     if not texts:
-        return []
-    # model.encode 返回 numpy array
-    embs = model.encode(texts, show_progress_bar=True, normalize_embeddings=True)
-    return embs.tolist()
\ No newline at end of file
+        return np.empty((0, get_dimension()), dtype=np.float32)
+    return np.concatenate(list(iter_embed(texts, batch_size)), axis=0)
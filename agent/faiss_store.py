@@ -0,0 +1,416 @@
+# 进程内 FAISS 向量库：整个商品目录放得进内存时，比走 Chroma 少一层数据库开销
+
+"""
+FaissStore 实现了 vector_store.VectorStore（也就是 Chroma collection 用到的那几个方法），
+可以直接替换 Chroma collection 传给 indexer_chroma.upsert_documents / retriever。
+
+- 索引类型: flat（精确）/ hnsw / ivfpq，由 FAISS_INDEX_TYPE 选择
+- FAISS 内部 id 就是行号，只追加不删除；删除/覆盖只打墓碑，查询时用 IDSelectorBitmap 过滤掉，
+  墓碑超过一定比例时整体压缩重建
+- where 过滤与 Chroma 语义一致（vector_store.match_where），过滤后候选很少时直接精确计算
+- 近似索引（hnsw / ivfpq）多取几倍候选，再用存储的原始向量精确重排
+- 向量存储精度由 FAISS_STORAGE=float32|float16|int8 决定：float16 内存减半；int8 每行对称量化
+  （int8 + 一个 float32 缩放系数），约为 float32 的 1/4。flat / hnsw 索引相应换成 IndexScalarQuantizer / IndexHNSWSQ，
+  精确计算和重排时按行解压成 float32。换了精度后打开旧索引会自动转换并重建
+- persist() 写到 FAISS_INDEX_DIR/<name>/，启动时向量和索引都以 mmap 方式只读加载（零拷贝），
+  第一次写入时才转成可写的内存副本
+"""
+import json
+import math
+import os
+import threading
+from typing import Dict, List, Optional
+
+import faiss
+import numpy as np
+
+from vector_store import match_where
+
+FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "./faiss_index")
+FAISS_INDEX_TYPE = os.getenv("FAISS_INDEX_TYPE", "flat")
+HNSW_M = int(os.getenv("FAISS_HNSW_M", "32"))
+HNSW_EF_SEARCH = int(os.getenv("FAISS_HNSW_EF_SEARCH", "64"))
+IVF_NLIST = int(os.getenv("FAISS_IVF_NLIST", "0"))  # 0 = 按数据量自动选
+IVF_NPROBE = int(os.getenv("FAISS_IVF_NPROBE", "16"))
+PQ_M = int(os.getenv("FAISS_PQ_M", "16"))
+# 过滤后的候选行数不超过这个值时，直接对原始向量做精确内积，不走近似索引
+BRUTE_FORCE_MAX = int(os.getenv("FAISS_BRUTE_FORCE_MAX", "2048"))
+# 过滤条件只留下不到这个比例的行时也改走精确计算：图/倒排索引在强过滤下召回率会掉得很厉害
+FILTER_EXACT_RATIO = float(os.getenv("FAISS_FILTER_EXACT_RATIO", "0.2"))
+# 近似索引多取 REFINE_FACTOR 倍候选，再用原始向量精确重排（过滤越严格取得越多）
+REFINE_FACTOR = int(os.getenv("FAISS_REFINE_FACTOR", "4"))
+# 向量存储精度：float32 / float16 / int8
+FAISS_STORAGE = os.getenv("FAISS_STORAGE", "float32")
+MAX_FETCH = 4096
+COMPACT_DEAD_RATIO = 0.3
+PQ_MIN_TRAIN = 256  # 8 bit PQ 每个子空间需要 256 个训练点
+SQ_MAX_TRAIN = 65536  # 8 bit SQ 只需要每一维的取值范围，抽样训练就够了
+
+_STORAGE_DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+_SQ_TYPES = {"float16": faiss.ScalarQuantizer.QT_fp16, "int8": faiss.ScalarQuantizer.QT_8bit}
+
+
+def _quantize(vecs: np.ndarray, storage: str):
+    """float32 -> (按 storage 存储的数组, int8 时每行的缩放系数，其他为 None)"""
+    if storage == "int8":
+        scales = np.abs(vecs).max(axis=1) / 127
+        scales[scales == 0] = 1
+        return np.round(vecs / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+    return vecs.astype(_STORAGE_DTYPES[storage]), None
+
+
+def _mmap_flags(index_type: str) -> int:
+    # IVF 的倒排表用 IO_FLAG_MMAP；flat/hnsw 的向量存储用 IO_FLAG_MMAP_IFC（较新的 faiss 才有）。两者不能同时传
+    if index_type == "ivfpq" or not hasattr(faiss, "IO_FLAG_MMAP_IFC"):
+        return faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+    return faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+
+
+class FaissStore:
+    def __init__(self, name: str, index_type: str = FAISS_INDEX_TYPE, path: Optional[str] = None,
+                 storage: str = FAISS_STORAGE):
+        if index_type not in ("flat", "hnsw", "ivfpq"):
+            raise ValueError(f"未知的 FAISS_INDEX_TYPE: {index_type}")
+        if storage not in _STORAGE_DTYPES:
+            raise ValueError(f"未知的 FAISS_STORAGE: {storage}")
+        self.name = name
+        self.index_type = index_type
+        self.storage = storage
+        self.dir = path or os.path.join(FAISS_INDEX_DIR, name)
+        self.dim: Optional[int] = None
+        self._vectors = np.zeros((0, 0), dtype=_STORAGE_DTYPES[storage])  # 原始向量，容量可能大于 _n
+        self._scales: Optional[np.ndarray] = None  # int8 存储时每行的缩放系数
+        self._n = 0
+        self._ids: List[str] = []
+        self._docs: List[str] = []
+        self._metas: List[dict] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_of: Dict[str, int] = {}
+        self._index = None
+        self._indexed = 0  # 已经加进 faiss 索引的行数
+        self._readonly = False  # mmap 加载后为 True，第一次写入前转成可写副本
+        self._lock = threading.RLock()
+        self._version = 0
+        self._mask_cache: Dict[str, tuple] = {}
+
+    # ---------- 加载 / 持久化 ----------
+
+    @property
+    def _paths(self):
+        return (os.path.join(self.dir, "store.json"),
+                os.path.join(self.dir, "vectors.npy"),
+                os.path.join(self.dir, "index.faiss"))
+
+    @property
+    def _scales_path(self):
+        return os.path.join(self.dir, "scales.npy")
+
+    @classmethod
+    def open(cls, name: str, index_type: str = FAISS_INDEX_TYPE, path: Optional[str] = None,
+             storage: str = FAISS_STORAGE) -> "FaissStore":
+        store = cls(name, index_type, path, storage)
+        meta_path, vec_path, index_path = store._paths
+        if not os.path.exists(meta_path):
+            return store
+        with open(meta_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        store.dim = state["dim"]
+        store._ids = state["ids"]
+        store._docs = state["documents"]
+        store._metas = state["metadatas"]
+        store._n = len(store._ids)
+        store._alive = np.array(state["alive"], dtype=bool)
+        store._row_of = {_id: i for i, _id in enumerate(store._ids) if store._alive[i]}
+        saved = state.get("storage", "float32")
+        store._vectors = np.load(vec_path, mmap_mode="r")  # 零拷贝
+        store._scales = np.load(store._scales_path, mmap_mode="r") if saved == "int8" else None
+        store._readonly = True
+        if saved != storage:
+            # 换了存储精度：解压后按新精度重新存一份，索引下次用到时重建
+            print(f"🔄 FAISS 向量存储 {saved} -> {storage}，重建索引")
+            store._vectors, store._scales = _quantize(store._dense(slice(0, store._n)), storage)
+            store._readonly = False
+        elif state.get("index_type") == index_type and os.path.exists(index_path):
+            store._index = faiss.read_index(index_path, _mmap_flags(index_type))
+            store._indexed = store._index.ntotal
+        return store
+
+    def persist(self):
+        with self._lock:
+            self._maybe_compact()
+            self._sync_index()
+            os.makedirs(self.dir, exist_ok=True)
+            meta_path, vec_path, index_path = self._paths
+            np.save(vec_path + ".tmp.npy", np.ascontiguousarray(self._vectors[:self._n]))
+            os.replace(vec_path + ".tmp.npy", vec_path)
+            if self._scales is not None:
+                np.save(self._scales_path + ".tmp.npy", np.ascontiguousarray(self._scales[:self._n]))
+                os.replace(self._scales_path + ".tmp.npy", self._scales_path)
+            if self._index is not None:
+                faiss.write_index(self._index, index_path + ".tmp")
+                os.replace(index_path + ".tmp", index_path)
+            state = {
+                "dim": self.dim,
+                "index_type": self.index_type,
+                "storage": self.storage,
+                "ids": self._ids,
+                "documents": self._docs,
+                "metadatas": self._metas,
+                "alive": self._alive[:self._n].tolist(),
+            }
+            with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(meta_path + ".tmp", meta_path)
+
+    def _ensure_writable(self):
+        if not self._readonly:
+            return
+        self._vectors = np.array(self._vectors)
+        if self._scales is not None:
+            self._scales = np.array(self._scales)
+        if self._index is not None:
+            # mmap 出来的索引不能追加，重新完整读入一份（ivfpq 不用重新训练）
+            self._index = faiss.read_index(self._paths[2])
+        self._readonly = False
+
+    # ---------- 索引维护 ----------
+
+    def _dense(self, rows) -> np.ndarray:
+        """按行（切片或行号数组）取出 float32 向量，压缩存储时在这里解压"""
+        vecs = np.asarray(self._vectors[rows], dtype=np.float32)
+        if self._scales is not None:
+            vecs = vecs * np.asarray(self._scales[rows])[:, None]
+        return np.ascontiguousarray(vecs)
+
+    def _new_index(self):
+        qtype = _SQ_TYPES.get(self.storage)
+        if self.index_type == "hnsw":
+            if qtype is None:
+                index = faiss.IndexHNSWFlat(self.dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexHNSWSQ(self.dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = HNSW_EF_SEARCH
+        elif self.index_type == "ivfpq" and self._n >= PQ_MIN_TRAIN:
+            nlist = IVF_NLIST or max(1, min(int(4 * math.sqrt(self._n)), self._n // 39))
+            m = PQ_M if self.dim % PQ_M == 0 else 8 if self.dim % 8 == 0 else 1
+            self._quantizer = faiss.IndexFlatIP(self.dim)
+            index = faiss.IndexIVFPQ(self._quantizer, self.dim, nlist, m, 8, faiss.METRIC_INNER_PRODUCT)
+            index.train(self._dense(slice(0, self._n)))
+            index.nprobe = IVF_NPROBE
+            return index
+        elif qtype is not None:
+            # flat，或者数据量还不够训练 ivfpq 时先用 flat 顶上；压缩存储时索引里也存压缩后的向量
+            index = faiss.IndexScalarQuantizer(self.dim, qtype, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexFlatIP(self.dim)
+        if not index.is_trained:
+            step = max(1, self._n // SQ_MAX_TRAIN)
+            index.train(self._dense(slice(0, self._n, step)))
+        return index
+
+    def _sync_index(self):
+        """把还没进索引的新行追加进去（索引延迟到查询/持久化时才构建）"""
+        if self.dim is None:
+            return
+        wanted_ivfpq = self.index_type == "ivfpq" and self._n >= PQ_MIN_TRAIN
+        if self._index is not None and wanted_ivfpq and not isinstance(self._index, faiss.IndexIVFPQ):
+            self._index, self._indexed = None, 0  # 数据够了，从临时的 flat 换成 ivfpq
+        if self._index is None:
+            self._index = self._new_index()
+            self._indexed = 0
+        if self._indexed < self._n:
+            self._ensure_writable()
+            self._index.add(self._dense(slice(self._indexed, self._n)))
+            self._indexed = self._n
+
+    def _maybe_compact(self):
+        dead = self._n - int(self._alive[:self._n].sum())
+        if self._n < 1000 or dead / max(self._n, 1) < COMPACT_DEAD_RATIO:
+            return
+        keep = np.flatnonzero(self._alive[:self._n])
+        self._vectors = np.array(self._vectors[keep])
+        if self._scales is not None:
+            self._scales = np.array(self._scales[keep])
+        self._ids = [self._ids[i] for i in keep]
+        self._docs = [self._docs[i] for i in keep]
+        self._metas = [self._metas[i] for i in keep]
+        self._n = len(keep)
+        self._alive = np.ones(self._n, dtype=bool)
+        self._row_of = {_id: i for i, _id in enumerate(self._ids)}
+        self._index, self._indexed = None, 0
+        self._readonly = False
+        self._version += 1
+
+    def _append(self, vecs: np.ndarray):
+        self._ensure_writable()
+        codes, scales = _quantize(vecs, self.storage)
+        need = self._n + len(vecs)
+        if self._vectors.shape[0] < need or self._vectors.shape[1] != self.dim:
+            cap = max(need, 2 * self._vectors.shape[0], 1024)
+            grown = np.empty((cap, self.dim), dtype=codes.dtype)
+            if self._n:
+                grown[:self._n] = self._vectors[:self._n]
+            self._vectors = grown
+            if scales is not None:
+                grown_scales = np.ones(cap, dtype=np.float32)
+                if self._n:
+                    grown_scales[:self._n] = self._scales[:self._n]
+                self._scales = grown_scales
+            alive = np.zeros(cap, dtype=bool)
+            alive[:self._n] = self._alive[:self._n]
+            self._alive = alive
+        self._vectors[self._n:need] = codes
+        if scales is not None:
+            self._scales[self._n:need] = scales
+        self._alive[self._n:need] = True
+        self._n = need
+
+    def _rows(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> List[int]:
+        if ids is not None:
+            rows = [self._row_of[i] for i in ids if i in self._row_of]
+        else:
+            rows = np.flatnonzero(self._alive[:self._n]).tolist()
+        if where:
+            rows = [r for r in rows if match_where(self._metas[r], where)]
+        return rows
+
+    def _mask(self, where: Optional[dict]) -> np.ndarray:
+        alive = self._alive[:self._n]
+        if not where:
+            return alive
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        cached = self._mask_cache.get(key)
+        if cached is not None and cached[0] == self._version:
+            return cached[1]
+        mask = alive.copy()
+        for r in np.flatnonzero(mask):
+            if not match_where(self._metas[r], where):
+                mask[r] = False
+        if len(self._mask_cache) > 256:
+            self._mask_cache.clear()
+        self._mask_cache[key] = (self._version, mask)
+        return mask
+
+    # ---------- VectorStore 接口 ----------
+
+    def count(self) -> int:
+        return len(self._row_of)
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[dict], embeddings):
+        vecs = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vecs.shape[1]
+            for _id in ids:
+                old = self._row_of.get(_id)
+                if old is not None:
+                    self._alive[old] = False
+            start = self._n
+            self._append(vecs)
+            for offset, (_id, doc, meta) in enumerate(zip(ids, documents, metadatas)):
+                self._ids.append(_id)
+                self._docs.append(doc)
+                self._metas.append(dict(meta))
+                self._row_of[_id] = start + offset
+            self._version += 1
+
+    def update(self, ids: List[str], metadatas: List[dict]):
+        with self._lock:
+            for _id, meta in zip(ids, metadatas):
+                row = self._row_of.get(_id)
+                if row is not None:
+                    self._metas[row] = dict(meta)
+            self._version += 1
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None):
+        with self._lock:
+            for r in self._rows(ids, where):
+                self._alive[r] = False
+                self._row_of.pop(self._ids[r], None)
+            self._version += 1
+            self._maybe_compact()
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict:
+        include = ["metadatas", "documents"] if include is None else include
+        with self._lock:
+            rows = self._rows(ids, where)
+            out = {"ids": [self._ids[r] for r in rows]}
+            if "metadatas" in include:
+                out["metadatas"] = [self._metas[r] for r in rows]
+            if "documents" in include:
+                out["documents"] = [self._docs[r] for r in rows]
+            if "embeddings" in include:
+                out["embeddings"] = list(self._dense(rows)) if rows else []
+            return out
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None,
+              include: Optional[List[str]] = None) -> dict:
+        q = np.asarray(query_embeddings, dtype=np.float32)
+        n_queries = 1 if q.ndim == 1 else len(q)  # 空库还不知道维度，不能先 reshape
+        empty = {"ids": [[] for _ in range(n_queries)], "documents": [[] for _ in range(n_queries)],
+                 "metadatas": [[] for _ in range(n_queries)], "distances": [[] for _ in range(n_queries)]}
+        with self._lock:
+            if self.dim is None or self._n == 0:
+                return empty
+            q = np.ascontiguousarray(q.reshape(-1, self.dim))
+            mask = self._mask(where)
+            candidates = int(mask.sum())
+            if candidates == 0:
+                return empty
+            k = min(n_results, candidates)
+            if candidates <= BRUTE_FORCE_MAX or candidates < FILTER_EXACT_RATIO * self._n:
+                rows = np.flatnonzero(mask)
+                scores = q @ self._dense(rows).T
+                top = np.argsort(-scores, axis=1)[:, :k]
+                I = rows[top]
+                S = np.take_along_axis(scores, top, axis=1)
+            else:
+                self._sync_index()
+                selectivity = candidates / max(self._indexed, 1)
+                fetch = min(candidates, MAX_FETCH, max(k, int(k * REFINE_FACTOR / selectivity)))
+                _, I0 = self._index.search(q, fetch, params=self._search_params(mask, fetch, selectivity))
+                S, I = self._rerank(q, I0, k)
+
+            # 行号只在持有锁时有效：并发的 upsert / delete 会移动行，结果要在锁里取出来
+            out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+            for srow, irow in zip(S, I):
+                hits = [(int(i), float(s)) for i, s in zip(irow, srow) if i >= 0]
+                out["ids"].append([self._ids[i] for i, _ in hits])
+                out["documents"].append([self._docs[i] for i, _ in hits])
+                out["metadatas"].append([self._metas[i] for i, _ in hits])
+                # 单位向量的平方 L2 距离 = 2 - 2·cos，和 Chroma 默认的 l2 距离同一量纲
+                out["distances"].append([2.0 - 2.0 * s for _, s in hits])
+        return out
+
+    def _rerank(self, q: np.ndarray, cand: np.ndarray, k: int):
+        """用存储的原始向量（解压成 float32）对近似索引给出的候选精确打分，取前 k"""
+        S = np.full((len(q), k), -np.inf, dtype=np.float32)
+        I = np.full((len(q), k), -1, dtype=np.int64)
+        for qi, rows in enumerate(cand):
+            rows = rows[rows >= 0]
+            if len(rows) == 0:
+                continue
+            scores = self._dense(rows) @ q[qi]
+            order = np.argsort(-scores)[:k]
+            S[qi, :len(order)] = scores[order]
+            I[qi, :len(order)] = rows[order]
+        return S, I
+
+    def _search_params(self, mask: np.ndarray, fetch: int, selectivity: float):
+        sel = None
+        if not mask.all():
+            self._bitmap = np.packbits(mask[:self._indexed], bitorder="little")  # 查询期间要保持引用
+            sel = faiss.IDSelectorBitmap(self._indexed, faiss.swig_ptr(self._bitmap))
+        if isinstance(self._index, faiss.IndexHNSW):
+            params = faiss.SearchParametersHNSW()
+            params.efSearch = max(HNSW_EF_SEARCH, fetch)
+        elif isinstance(self._index, faiss.IndexIVFPQ):
+            params = faiss.SearchParametersIVF()
+            # 过滤后候选变少，相应多探查几个倒排桶
+            params.nprobe = min(self._index.nlist, int(math.ceil(IVF_NPROBE / max(selectivity, 1e-3))))
+        else:
+            params = faiss.SearchParameters()
+        if sel is not None:
+            params.sel = sel
+        return params
@@ -0,0 +1,61 @@
+# 离线用的确定性 embedding 模型：特征哈希，不需要 torch / sentence-transformers，也不用下载权重
+# 用法: embeddings.set_model(HashingEmbedder(), name="hashing-384")
+
+"""
+接口和 SentenceTransformer 用到的部分一致（encode / get_sentence_embedding_dimension），
+所以 ingest、retriever、答案缓存都能原样跑。向量由词和字符 trigram 哈希到固定维度再归一化，
+词面相近的文本余弦相似度也高，检索结果有意义，基准和 CI 里可以代替真模型。
+cost_ms_per_text 可以模拟真模型的开销（默认 0）：默认 sleep（像 torch 一样不占 GIL），
+busy=True 时空转占满 CPU，多进程扩展性基准（bench_ingest_scaling.py）里用它才测得出核数的影响。
+"""
+import hashlib
+import re
+import time
+from typing import List
+
+import numpy as np
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    def __init__(self, dim: int = 384, cost_ms_per_text: float = 0.0, busy: bool = False):
+        self.dim = dim
+        self.cost_ms_per_text = cost_ms_per_text
+        self.busy = busy
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def _features(self, text: str) -> List[str]:
+        words = _WORD.findall(text.lower())
+        grams = []
+        for w in words:
+            padded = f"#{w}#"
+            grams.extend(padded[i:i + 3] for i in range(max(1, len(padded) - 2)))
+        return words + grams
+
+    def _vector(self, text: str) -> np.ndarray:
+        v = np.zeros(self.dim, dtype=np.float32)
+        for f in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "little")
+            v[h % self.dim] += 1.0 if (h >> 63) == 0 else -1.0
+        return v
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        if self.cost_ms_per_text:
+            cost = self.cost_ms_per_text * len(texts) / 1000
+            if self.busy:
+                end = time.perf_counter() + cost
+                while time.perf_counter() < end:
+                    pass
+            else:
+                time.sleep(cost)
+        out = np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out = out / np.where(norms == 0, 1, norms)
+        return out
@@ -0,0 +1,225 @@
+# 本地假 LLM 服务：实现 Anthropic Messages API 的最小子集（含 SSE 流式），用于离线测试和基准
+# 用法: uvicorn fake_llm:app --port 8100
+#       然后 ANTHROPIC_BASE_URL=http://127.0.0.1:8100 ANTHROPIC_API_KEY=fake python api.py
+
+"""
+回复由“剧本” script(messages, tools) -> (content_blocks, stop_reason) 决定，默认剧本：
+- 本轮问题前面附了检索接地的参考资料（<retrieved_products>）且还没有 tool_result 时：问材质/详情/对比的
+  直接拿参考资料里的商品 ID 调 get_product_details / get_products_details，其余问题直接根据参考资料回答
+- 本轮对话（最后一个用户问题之后）还没有 tool_result 且有 search_products 工具时，调用 search_products(query=用户原话)
+- 否则 end_turn，把最近一次工具结果的开头复述出来
+每次调用的延迟由 FAKE_LLM_LATENCY_MS 控制，流式时每个文本片段之间再等 FAKE_LLM_TOKEN_DELAY_MS。
+usage 按字符数估算 token，并按 cache_control 断点模拟 prompt caching 的读写量。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import uuid
+from typing import Callable, List, Optional, Tuple
+
+from anthropic import AsyncAnthropic
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", "50"))
+TOKEN_DELAY_MS = float(os.getenv("FAKE_LLM_TOKEN_DELAY_MS", "5"))
+
+CONTEXT_TAG = "<retrieved_products>"  # 和 conversation.CONTEXT_TAG 一致
+DETAIL_WORDS = ("材质", "详细", "详情", "对比", "比较", "material", "detail", "compare")
+
+Script = Callable[[List[dict], List[dict]], Tuple[List[dict], str]]
+
+
+def _is_question(m: dict) -> bool:
+    content = m["content"]
+    return m["role"] == "user" and (isinstance(content, str)
+                                    or not any(b.get("type") == "tool_result" for b in content))
+
+
+def _current_turn(messages: List[dict]) -> List[dict]:
+    # 多轮会话里只看最后一个用户问题之后的消息
+    starts = [i for i, m in enumerate(messages) if _is_question(m)]
+    return messages[starts[-1]:] if starts else messages
+
+
+def _tool_results(messages: List[dict]) -> List[dict]:
+    out = []
+    for m in _current_turn(messages):
+        if m["role"] == "user" and isinstance(m["content"], list):
+            out.extend(b for b in m["content"] if b.get("type") == "tool_result")
+    return out
+
+
+def _user_text(messages: List[dict]) -> str:
+    content = _current_turn(messages)[0]["content"]
+    if isinstance(content, str):
+        return content
+    return " ".join(b.get("text", "") for b in content
+                    if b.get("type") == "text" and not b.get("text", "").startswith(CONTEXT_TAG))
+
+
+def _context(messages: List[dict]) -> str:
+    content = _current_turn(messages)[0]["content"]
+    if isinstance(content, str):
+        return ""
+    return "".join(b.get("text", "") for b in content
+                   if b.get("type") == "text" and b.get("text", "").startswith(CONTEXT_TAG))
+
+
+def _tool_use(name: str, tool_input: dict) -> dict:
+    return {"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}", "name": name, "input": tool_input}
+
+
+def _result_text(block: dict) -> str:
+    content = block.get("content", "")
+    if isinstance(content, list):
+        return " ".join(c.get("text", "") for c in content if c.get("type") == "text")
+    return str(content)
+
+
+def default_script(messages: List[dict], tools: List[dict]) -> Tuple[List[dict], str]:
+    tool_names = {t["name"] for t in tools}
+    results = _tool_results(messages)
+    context = _context(messages)
+    ids = list(dict.fromkeys(re.findall(r"^\[\d+\] \((\S+?)\)", context, re.M)))
+    if not results and ids:
+        question = _user_text(messages).lower()
+        if not any(w in question for w in DETAIL_WORDS):
+            return [{"type": "text", "text": f"根据检索结果：{context[len(CONTEXT_TAG):][:200]}"}], "end_turn"
+        if len(ids) > 1 and "get_products_details" in tool_names:
+            return [{"type": "text", "text": "我查一下这几个商品的详情。"},
+                    _tool_use("get_products_details", {"product_ids": ids[:3]})], "tool_use"
+        if "get_product_details" in tool_names:
+            return [{"type": "text", "text": "我查一下商品详情。"},
+                    _tool_use("get_product_details", {"product_id": ids[0]})], "tool_use"
+    if not results and "search_products" in tool_names:
+        return [
+            {"type": "text", "text": "我先帮你搜索一下。"},
+            _tool_use("search_products", {"query": _user_text(messages)}),
+        ], "tool_use"
+    summary = _result_text(results[-1])[:200] if results else "你好，有什么可以帮你？"
+    return [{"type": "text", "text": f"根据查询结果：{summary}"}], "end_turn"
+
+
+def _segments(messages: List[dict], tools: List[dict], system) -> List[dict]:
+    # 按 API 的前缀顺序展开：tools -> system -> 每条消息的每个块
+    segs = list(tools)
+    if isinstance(system, str):
+        segs.append({"type": "text", "text": system})
+    elif system:
+        segs.extend(system)
+    for m in messages:
+        content = m["content"]
+        blocks = [{"type": "text", "text": content}] if isinstance(content, str) else content
+        segs.extend(dict(b, _role=m["role"]) for b in blocks)
+    return segs
+
+
+def _usage(messages: List[dict], tools: List[dict], system=None, prefix_cache: Optional[set] = None) -> dict:
+    """
+    粗略估算：4 个字符约 1 token，够基准对比用。
+    传入 prefix_cache 时模拟 prompt caching：在 cache_control 断点处对前缀取 hash 写入缓存；
+    之前写过的最长前缀（不要求落在这次的断点上）算 cache_read，这次新写入的算 cache_creation，其余才是 input_tokens。
+    """
+    segs = _segments(messages, tools, system)
+    digest, total = hashlib.sha1(), 0
+    read = written = 0
+    for seg in segs:
+        clean = {k: v for k, v in seg.items() if k != "cache_control"}
+        text = json.dumps(clean, ensure_ascii=False, sort_keys=True)
+        total += len(text) // 4
+        digest.update(text.encode("utf-8"))
+        if prefix_cache is None:
+            continue
+        key = digest.hexdigest()
+        if key in prefix_cache:
+            read = total
+        elif "cache_control" in seg:
+            prefix_cache.add(key)
+            written = total
+    written = max(written - read, 0)
+    return {"input_tokens": total - read - written, "output_tokens": 0,
+            "cache_read_input_tokens": read, "cache_creation_input_tokens": written}
+
+
+def _split_tokens(text: str, size: int = 4) -> List[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)] or [""]
+
+
+def make_app(script: Optional[Script] = None, latency_ms: float = LATENCY_MS,
+             token_delay_ms: float = TOKEN_DELAY_MS) -> FastAPI:
+    script = script or default_script
+    fake = FastAPI()
+    fake.state.calls = 0
+    fake.state.prefix_cache = set()
+
+    @fake.post("/v1/messages")
+    async def messages(request: Request):
+        body = await request.json()
+        fake.state.calls += 1
+        msgs, tools = body.get("messages", []), body.get("tools", [])
+        blocks, stop_reason = script(msgs, tools)
+        usage = _usage(msgs, tools, body.get("system"), fake.state.prefix_cache)
+        usage["output_tokens"] = sum(len(json.dumps(b, ensure_ascii=False)) for b in blocks) // 4
+        message = {
+            "id": f"msg_{uuid.uuid4().hex[:16]}",
+            "type": "message",
+            "role": "assistant",
+            "model": body.get("model", "fake"),
+            "content": blocks,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": usage,
+        }
+        await asyncio.sleep(latency_ms / 1000)
+
+        if not body.get("stream"):
+            return JSONResponse(message)
+
+        async def sse():
+            def ev(name, data):
+                return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+            start = dict(message, content=[], stop_reason=None,
+                         usage=dict(usage, output_tokens=0))
+            yield ev("message_start", {"type": "message_start", "message": start})
+            for i, block in enumerate(blocks):
+                if block["type"] == "text":
+                    yield ev("content_block_start", {"type": "content_block_start", "index": i,
+                                                     "content_block": {"type": "text", "text": ""}})
+                    for piece in _split_tokens(block["text"]):
+                        await asyncio.sleep(token_delay_ms / 1000)
+                        yield ev("content_block_delta", {"type": "content_block_delta", "index": i,
+                                                         "delta": {"type": "text_delta", "text": piece}})
+                else:
+                    yield ev("content_block_start", {"type": "content_block_start", "index": i,
+                                                     "content_block": dict(block, input={})})
+                    yield ev("content_block_delta", {"type": "content_block_delta", "index": i,
+                                                     "delta": {"type": "input_json_delta",
+                                                               "partial_json": json.dumps(block["input"],
+                                                                                          ensure_ascii=False)}})
+                yield ev("content_block_stop", {"type": "content_block_stop", "index": i})
+            yield ev("message_delta", {"type": "message_delta",
+                                       "delta": {"stop_reason": stop_reason, "stop_sequence": None},
+                                       "usage": {"output_tokens": usage["output_tokens"]}})
+            yield ev("message_stop", {"type": "message_stop"})
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+    return fake
+
+
+app = make_app()
+
+
+def make_client(fake_app: Optional[FastAPI] = None) -> AsyncAnthropic:
+    """
+    在后台线程里把假 LLM 跑在本机随机端口上，返回指向它的 AsyncAnthropic。
+    不用 ASGITransport 直连：新版 SDK 底层换成了 httpx2，只认它自己的 http_client / transport 类型
+    """
+    from bench_load import free_port, serve_in_thread
+    port = free_port()
+    serve_in_thread(fake_app or app, port)
+    return AsyncAnthropic(api_key="fake", base_url=f"http://127.0.0.1:{port}")
@@ -0,0 +1,119 @@
+# 本地 Medusa store API 桩：生成指定规模的合成商品目录，用于离线测试和基准
+# 用法: FAKE_MEDUSA_PRODUCTS=5000 uvicorn fake_medusa:app --port 9100
+#       然后 MEDUSA_API_URL=http://127.0.0.1:9100
+
+"""
+只实现 agent 用到的两个接口：
+- GET /store/products?q=&limit=&offset=&id=&fields=    列表/搜索/按 id 过滤，返回 {products, count, offset, limit}
+- GET /store/products/{id}?fields=                     返回 {product}
+fields 按 Medusa 的写法（"id,title,*variants,*variants.prices"）只保留选到的顶层字段，不传返回全部。
+stub.state.fail_status 设成比如 503 时所有请求都返回这个状态码，用来模拟 Medusa 故障。
+目录是按 seed 确定性生成的，第 0 个商品固定是 Sweatshirt。
+"""
+import asyncio
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from fastapi import FastAPI, HTTPException, Query
+
+N_PRODUCTS = int(os.getenv("FAKE_MEDUSA_PRODUCTS", "200"))
+LATENCY_MS = float(os.getenv("FAKE_MEDUSA_LATENCY_MS", "5"))
+
+_KINDS = ["Sweatshirt", "T-Shirt", "Hoodie", "Sweatpants", "Shorts", "Jacket", "Cap", "Socks"]
+_COLORS = ["Black", "White", "Grey", "Navy", "Green", "Red"]
+_MATERIALS = ["100% cotton", "cotton / polyester", "organic cotton", "wool blend", "recycled polyester"]
+_SIZES = ["S", "M", "L", "XL"]
+
+
+def make_product(i: int, rng: random.Random) -> dict:
+    kind = _KINDS[0] if i == 0 else rng.choice(_KINDS)
+    title = kind if i == 0 else f"{rng.choice(_COLORS)} {kind} {i}"
+    product_id = f"prod_{i:08d}"
+    colors = rng.sample(_COLORS, 2)
+    amount = rng.randrange(900, 12000, 50)
+    updated = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=i)
+    return {
+        "id": product_id,
+        "title": title,
+        "handle": title.lower().replace(" ", "-"),
+        "description": f"A comfortable {kind.lower()} made of {rng.choice(_MATERIALS)}. "
+                       f"Perfect for everyday wear, available in {', '.join(colors)}.",
+        "material": rng.choice(_MATERIALS),
+        "collection_id": f"pcol_{kind.lower()}",
+        "updated_at": updated.isoformat(),
+        "options": [
+            {"title": "Size", "values": [{"value": s} for s in _SIZES]},
+            {"title": "Color", "values": [{"value": c} for c in colors]},
+        ],
+        "variants": [
+            {
+                "id": f"variant_{i:08d}_{s}_{c}",
+                "title": f"{s} / {c}",
+                "prices": [{"amount": amount, "currency_code": "eur"}],
+            }
+            for s in _SIZES for c in colors
+        ],
+    }
+
+
+def make_catalog(n: int = N_PRODUCTS, seed: int = 42) -> List[dict]:
+    rng = random.Random(seed)
+    return [make_product(i, rng) for i in range(n)]
+
+
+def make_app(n_products: int = N_PRODUCTS, latency_ms: float = LATENCY_MS,
+             catalog: Optional[List[dict]] = None) -> FastAPI:
+    stub = FastAPI()
+    stub.state.catalog = catalog if catalog is not None else make_catalog(n_products)
+    stub.state.requests = 0
+    stub.state.fail_status = None
+
+    def maybe_fail():
+        if stub.state.fail_status:
+            raise HTTPException(status_code=stub.state.fail_status, detail="injected failure")
+
+    def by_id():
+        return {p["id"]: p for p in stub.state.catalog}
+
+    def select(product: dict, fields: Optional[str]) -> dict:
+        if not fields:
+            return product
+        keys = {"id"} | {f.strip().lstrip("+*").split(".")[0] for f in fields.split(",") if f.strip()}
+        return {k: v for k, v in product.items() if k in keys}
+
+    @stub.get("/store/products")
+    async def list_products(q: Optional[str] = None, limit: int = 50, offset: int = 0,
+                            id: Optional[List[str]] = Query(None),
+                            id_list: Optional[List[str]] = Query(None, alias="id[]"),
+                            fields: Optional[str] = None):
+        stub.state.requests += 1
+        await asyncio.sleep(latency_ms / 1000)
+        maybe_fail()
+        products = stub.state.catalog
+        ids = (id or []) + (id_list or [])
+        if ids:
+            index = by_id()
+            products = [index[i] for i in ids if i in index]
+        if q:
+            needle = q.lower()
+            products = [p for p in products
+                        if needle in p["title"].lower() or needle in p["description"].lower()]
+        page = products[offset:offset + limit]
+        return {"products": [select(p, fields) for p in page], "count": len(products), "offset": offset, "limit": limit}
+
+    @stub.get("/store/products/{product_id}")
+    async def get_product(product_id: str, fields: Optional[str] = None):
+        stub.state.requests += 1
+        await asyncio.sleep(latency_ms / 1000)
+        maybe_fail()
+        product = by_id().get(product_id)
+        if product is None:
+            raise HTTPException(status_code=404, detail="Product not found")
+        return {"product": select(product, fields)}
+
+    return stub
+
+
+app = make_app()
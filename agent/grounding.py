@@ -0,0 +1,99 @@
+# 检索接地：/chat 第一次调用 LLM 之前先查本地商品索引，把相关 chunk（带商品 ID）放进本轮的用户消息
+
+"""
+几乎每个会话都是 LLM 先调一次 search_products（MCP -> Medusa）才能开始回答，多一次 LLM 往返 + 一次工具调用。
+ingest_medusa 建好的本地索引（向量 + BM25，retriever.aretrieve）本来就能回答“有哪些 xx”：
+- CHAT_GROUNDING=first：只有会话的第一轮接地；all：每轮都接地；off（默认）：不接地，行为和原来一样
+- prefetch() 在拿会话锁、借 MCP 会话、查答案缓存的同时就开始检索（query 编码和答案缓存共用
+  retriever.batcher，同一个 query 只 encode 一次）；context() 最多等 GROUNDING_TIMEOUT 秒，
+  检索慢了或失败了就不带参考资料，照常跑 agent 循环
+- 参考资料是本轮用户消息里问题前面的一个 text 块（格式同 rag_prompt.format_documents），
+  conversation.compact 会在之后的轮次里把它删掉，不会在历史里越积越多
+- 索引可能比 Medusa 旧，提示里说明价格/库存等以工具查询为准；LLM 可以直接回答，
+  也可以拿着商品 ID 直接调 get_product_details / get_products_details，省掉搜索那一步
+"""
+import asyncio
+import os
+import time
+from typing import List, Optional, Tuple
+
+from conversation import CONTEXT_TAG
+from metrics import registry
+from rag_prompt import format_documents
+from tracing import span
+
+CHAT_GROUNDING = os.getenv("CHAT_GROUNDING", "off")  # off | first | all
+GROUNDING_TOP_K = int(os.getenv("GROUNDING_TOP_K", "5"))
+GROUNDING_TIMEOUT = float(os.getenv("GROUNDING_TIMEOUT", "1.0"))  # 检索最多等多久（秒）
+GROUNDING_MAX_CHARS = int(os.getenv("GROUNDING_MAX_CHARS", "400"))  # 每个 chunk 最多放多少字
+
+grounding_total = registry.counter("chat_grounding_total", "/chat 检索接地的次数，outcome=hit/empty/timeout/error")
+
+
+def enabled_for(conversation) -> bool:
+    if CHAT_GROUNDING == "all":
+        return True
+    return CHAT_GROUNDING == "first" and conversation.is_new
+
+
+def warmup():
+    """加载 embedding 模型、向量库和 BM25 索引，供 api 的 lifespan 在接流量前调用"""
+    import bm25
+    import embeddings
+    import retriever
+    embeddings.warmup()
+    retriever.get_collection()
+    bm25.get_index()
+
+
+async def _retrieve(query: str) -> List[dict]:
+    from retriever import aretrieve  # 只有打开接地才加载检索相关的模块
+    return await aretrieve(query, top_k=GROUNDING_TOP_K)
+
+
+def prefetch(query: str, conversation) -> Optional[asyncio.Future]:
+    """没打开接地时返回 None；否则立刻在后台开始检索"""
+    if not enabled_for(conversation):
+        return None
+    fut = asyncio.ensure_future(_retrieve(query))
+    fut.started = time.monotonic()
+    return fut
+
+
+def cancel(fut: Optional[asyncio.Future]):
+    """答案缓存命中等用不上检索结果的时候调用"""
+    if fut is not None and not fut.done():
+        fut.cancel()
+
+
+def format_context(hits: List[dict]) -> str:
+    return (f"{CONTEXT_TAG}\n"
+            "以下是按这个问题在商品索引里检索到的内容（可能不完整或略旧，价格、库存、材质等以工具查询为准）。"
+            "够用就直接回答；需要更多信息时可以直接用这里的商品 ID 查询详情。\n"
+            f"{format_documents(hits, GROUNDING_MAX_CHARS)}"
+            f"{CONTEXT_TAG.replace('<', '</', 1)}")
+
+
+async def context(fut: Optional[asyncio.Future]) -> Tuple[Optional[str], List[dict]]:
+    """
+    等 prefetch 的结果，返回 (放进用户消息的参考资料, 检索到的 hits)；
+    超时 / 出错 / 没结果都返回 (None, [])。超时时间从 prefetch 开始算。
+    """
+    if fut is None:
+        return None, []
+    with span("chat.grounding", top_k=GROUNDING_TOP_K) as sp:
+        try:
+            left = max(0.0, GROUNDING_TIMEOUT - (time.monotonic() - fut.started))
+            hits = await asyncio.wait_for(fut, timeout=left)
+        except asyncio.TimeoutError:
+            grounding_total.inc(outcome="timeout")
+            sp.set(outcome="timeout")
+            return None, []
+        except Exception as e:
+            grounding_total.inc(outcome="error")
+            sp.set(outcome="error", error=str(e))
+            return None, []
+        outcome = "hit" if hits else "empty"
+        grounding_total.inc(outcome=outcome)
+        sp.set(outcome=outcome, hits=len(hits))
+    return (format_context(hits), hits) if hits else (None, [])
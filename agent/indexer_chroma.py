@@ -1,24 +1,133 @@
 #把数据写入 Chroma向量数据库
 
-import chromadb
-from chromadb.config import Settings
-from typing import List, Dict
-import uuid
+from typing import List, Dict, NamedTuple
+import hashlib
+import threading
 from embeddings import embed_texts
+from vector_store import persist
+import bm25
 
-# 本地持久化 Chroma（duckdb + parquet）
-client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory="./chroma_db"))
+# 本地持久化 Chroma（duckdb + parquet）。客户端在第一次用到时才打开，import 本模块不再打开数据库
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import chromadb
+                from chromadb.config import Settings
+                _client = chromadb.Client(Settings(chroma_db_impl="duckdb+parquet", persist_directory="./chroma_db"))
+    return _client
+
+def __getattr__(name):
+    # 兼容旧写法 `from indexer_chroma import client`
+    if name == "client":
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_or_create_collection(name: str = "smartshopper"):
-    return client.get_or_create_collection(name)
+    return get_client().get_or_create_collection(name)
+
+def content_hash(doc: str) -> str:
+    return hashlib.sha1(doc.encode("utf-8")).hexdigest()[:16]
+
+def chunk_id(product_id: str, chunk_index: int, doc: str) -> str:
+    """
+    确定性的 chunk ID：(product_id, chunk 序号, 内容 hash)。
+    同样的内容重复入库得到同样的 ID，所以不会再产生重复 chunk。
+    """
+    return f"{product_id}:{chunk_index}:{content_hash(doc)}"
+
+def product_filter(product_ids: List[str]) -> Dict:
+    """
+    where 条件：这些商品的全部 chunk。get_client 用的是老版本 Chroma（duckdb+parquet 客户端），
+    它的 where 不认 $in，只能写成 $or + $eq
+    """
+    clauses = [{"product_id": {"$eq": pid}} for pid in dict.fromkeys(product_ids)]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
 
-def upsert_documents(collection, docs: List[str], metadatas: List[Dict]):
+class UpsertPlan(NamedTuple):
+    ids: List[str]
+    new_rows: List[int]      # 向量库里还没有的 chunk，需要 embed
+    changed_meta: List[int]  # 内容没变、只有 metadata 变了的 chunk
+    product_ids: List[str]
+
+def plan_upsert(collection, docs: List[str], metadatas: List[Dict]) -> UpsertPlan:
+    """只读向量库，算出哪些 chunk 需要 embed / 更新 metadata"""
+    ids = []
+    seq: Dict[str, int] = {}
+    for doc, meta in zip(docs, metadatas):
+        pid = meta.get("product_id") or ""
+        # product_to_chunks 会给出 chunk_index；没有的话按本次调用内的顺序编号
+        idx = meta.get("chunk_index", seq.get(pid, 0))
+        seq[pid] = idx + 1
+        ids.append(chunk_id(pid, idx, doc))
+
+    existing = collection.get(ids=ids, include=["metadatas"])
+    existing_meta = dict(zip(existing["ids"], existing["metadatas"]))
+
+    new_rows = [i for i, _id in enumerate(ids) if _id not in existing_meta]
+    changed_meta = [i for i, _id in enumerate(ids)
+                    if _id in existing_meta and existing_meta[_id] != metadatas[i]]
+    return UpsertPlan(ids, new_rows, changed_meta, [pid for pid in seq if pid])
+
+def apply_upsert(collection, docs: List[str], metadatas: List[Dict], plan: UpsertPlan, embeddings):
+    """按 plan 写向量库和 BM25；embeddings 和 plan.new_rows 一一对应"""
+    ids = plan.ids
+    if plan.new_rows:
+        collection.upsert(
+            ids=[ids[i] for i in plan.new_rows],
+            documents=[docs[i] for i in plan.new_rows],
+            metadatas=[metadatas[i] for i in plan.new_rows],
+            embeddings=embeddings.tolist(),  # Chroma 这一侧才转成 list
+        )
+    if plan.changed_meta:
+        collection.update(ids=[ids[i] for i in plan.changed_meta],
+                          metadatas=[metadatas[i] for i in plan.changed_meta])
+    touched = plan.new_rows + plan.changed_meta
+    if touched:
+        bm25.get_index().upsert([ids[i] for i in touched], [docs[i] for i in touched],
+                                [metadatas[i] for i in touched])
+
+    # 删除这些商品已经不存在的旧 chunk（内容变化后 hash 不同，旧 ID 会残留）
+    if plan.product_ids:
+        stored = collection.get(where=product_filter(plan.product_ids), include=[])
+        keep = set(ids)
+        stale = [_id for _id in stored["ids"] if _id not in keep]
+        if stale:
+            collection.delete(ids=stale)
+            bm25.get_index().delete(stale)
+
+def upsert_documents(collection, docs: List[str], metadatas: List[Dict], persist_now: bool = True):
     """
     docs: list of strings (chunks)
     metadatas: list of dicts (must be same length as docs)
+
+    - ID 已存在（内容没变）的 chunk 不再 embed，只在 metadata 变化时更新 metadata
+    - 新 chunk 才 embed 并 upsert；BM25 词法索引同步更新
+    - 本次出现的商品里不再存在的旧 chunk 会被删除，所以同一商品的全部 chunk 要在同一次调用里传入
+    - 批量入库时可以传 persist_now=False，全部写完再调用 persist_index 一次
+    - 多进程入库（ingest_workers）把 plan_upsert / embed / apply_upsert 拆开流水线执行
     """
-    ids = [str(uuid.uuid4()) for _ in docs]
-    embeddings = embed_texts(docs)
-    collection.add(documents=docs, metadatas=metadatas, ids=ids, embeddings=embeddings)
-    # 持久化
-    client.persist()
\ No newline at end of file
+    if not docs:
+        return
+    plan = plan_upsert(collection, docs, metadatas)
+    embeddings = embed_texts([docs[i] for i in plan.new_rows]) if plan.new_rows else None
+    apply_upsert(collection, docs, metadatas, plan, embeddings)
+    if persist_now:
+        persist_index(collection)
+
+def persist_index(collection):
+    # 持久化（collection 也可以是 vector_store 里的其他后端，比如 FaissStore），BM25 索引一起落盘
+    persist(collection)
+    bm25.get_index().save()
+
+def delete_products(collection, product_ids: List[str]):
+    """删除这些商品的全部 chunk（商品下架时用）"""
+    if not product_ids:
+        return
+    collection.delete(where=product_filter(list(product_ids)))
+    bm25.get_index().delete(product_ids=list(product_ids))
+    persist_index(collection)
@@ -1,11 +1,24 @@
 """
-从 Medusa 拉取产品数据，chunk & embed 并写入 Chroma。
+从 Medusa 拉取产品数据，chunk & embed 并写入 Chroma；完整商品 JSON 同时写进本地目录镜像（catalog_store）。
 运行前请确认 MEDUSA_API_URL 与 API_KEY（如果需要）设置正确。
+
+流水线: 分页并发拉取 -> product_to_chunks -> 攒批 embed -> upsert，内存只和批大小有关，不随目录规模增长。
+chunk ID 是确定性的，重复入库是幂等的；Medusa 里已经不存在的商品每次都会被删除（只在拉到的商品数不少于 count 时删，避免漏页误删）。
+--incremental 模式下按商品内容 hash 跳过没变化的商品，连 chunk 都不用重新生成。
+--workers N（或 INGEST_WORKERS=N）时 encode 分到 N 个进程，向量库仍由本进程单独写入，见 ingest_workers.py。
 """
+import asyncio
+import hashlib
+import json
 import os
+import time
 import httpx
-from indexer_chroma import get_or_create_collection, upsert_documents
-from embeddings import chunk_text
+from typing import AsyncIterator, Dict, List, Optional
+from indexer_chroma import upsert_documents, delete_products, persist_index
+from vector_store import get_store
+from chunker import iter_product_chunks
+from catalog_store import get_catalog
+from ingest_workers import EncoderPool, ParallelWriter, INGEST_WORKERS, INGEST_WORKER_THREADS
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,71 +26,208 @@ load_dotenv()
 MEDUSA_API_URL = os.getenv("MEDUSA_API_URL", "http://localhost:9000")
 API_KEY = os.getenv("MEDUSA_PUBLISHABLE_KEY", "")  # optional
 
+PAGE_SIZE = int(os.getenv("INGEST_PAGE_SIZE", "100"))
+FETCH_CONCURRENCY = int(os.getenv("INGEST_FETCH_CONCURRENCY", "4"))
+EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "256"))  # 攒够这么多 chunk 才 embed + 写一次
+# 记录每个商品上次入库时的内容 hash，增量模式靠它判断哪些商品变了
+STATE_PATH = os.getenv("INGEST_STATE_PATH", "./chroma_db/ingest_state.json")
+
 def get_headers():
     h = {}
     if API_KEY and "pk_" in API_KEY:
         h["x-publishable-api-key"] = API_KEY
     return h
 
-async def fetch_products():
+async def _fetch_page(client: httpx.AsyncClient, offset: int, limit: int) -> dict:
+    resp = await client.get(f"{MEDUSA_API_URL}/store/products", headers=get_headers(),
+                            params={"limit": limit, "offset": offset})
+    resp.raise_for_status()
+    return resp.json()
+
+async def iter_product_pages(page_size: int = PAGE_SIZE, concurrency: int = FETCH_CONCURRENCY,
+                             info: Optional[dict] = None) -> AsyncIterator[List[dict]]:
+    """
+    分页拉取全部商品，每次 yield 一页。
+    第一页拿到 count 之后，其余 offset 页在 concurrency 限制下并发拉取，哪页先回来先 yield 哪页。
+    offset 的步长是第一页实际返回的条数：Medusa 可能把 limit 压到比 page_size 小，按 page_size 走会整段漏掉。
+    传入 info 时把接口返回的 count 写进 info["count"]（没返回就是 None），调用方据此判断是否拉全了。
+    """
     async with httpx.AsyncClient(timeout=20) as client:
-        resp = await client.get(f"{MEDUSA_API_URL}/store/products", headers=get_headers(), params={"limit": 250})
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("products", [])
+        first = await _fetch_page(client, 0, page_size)
+        products = first.get("products", [])
+        count = first.get("count")
+        if info is not None:
+            info["count"] = count
+        yield products
+        step = len(products)
+        if not step:
+            return
+
+        if count is None:
+            # 接口没返回 count 时只能一页一页往后翻，直到拿到空页（短页不一定是最后一页，可能只是 limit 被压小了）
+            offset = step
+            while products:
+                products = (await _fetch_page(client, offset, page_size)).get("products", [])
+                if products:
+                    yield products
+                offset += len(products)
+            return
+
+        sem = asyncio.Semaphore(concurrency)
+
+        async def fetch(offset):
+            async with sem:
+                return (await _fetch_page(client, offset, step)).get("products", [])
+
+        tasks = [asyncio.create_task(fetch(o)) for o in range(step, count, step)]
+        try:
+            for fut in asyncio.as_completed(tasks):
+                yield await fut
+        finally:
+            for t in tasks:
+                t.cancel()
+
+async def fetch_products():
+    products = []
+    async for page in iter_product_pages():
+        products.extend(page)
+    return products
+
+def product_hash(prod: dict) -> str:
+    return hashlib.sha1(json.dumps(prod, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def load_state(path: str = STATE_PATH) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_state(state: Dict[str, dict], path: str = STATE_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
 
 def product_to_chunks(prod: dict):
     """
     将单个 product 转为若干 chunk，并返回 chunks 与其对应的 metadata 列表
-    metadata 包含 product_id, title, category, handle 等，便于后续过滤
+    metadata 包含 product_id, title, category, handle, fields 等，便于后续过滤；分块规则见 chunker.py
     """
-    title = prod.get("title", "")
-    description = prod.get("description", "") or ""
-    extras = []
-    # include variant titles, options, tags if any
-    variants = prod.get("variants", [])
-    variant_texts = []
-    for v in variants:
-        variant_texts.append(v.get("title", ""))
-        # sometimes variant has region specific prices, include price meta in chunk text
-        prices = v.get("prices", [])
-        if prices:
-            # include first price as readable
-            p = prices[0]
-            amount = p.get("amount")
-            currency = p.get("currency_code", "")
-            if amount is not None:
-                extras.append(f"价格: {amount/100} {currency}".strip())
-
-    text = " ".join([title, description, " ".join(variant_texts), " ".join(extras)])
-    chunks = chunk_text(text, chunk_size_words=200, overlap_words=40)
-    metadatas = []
-    for ch in chunks:
-        meta = {
-            "product_id": prod.get("id"),
-            "title": title,
-            "handle": prod.get("handle"),
-            "category": prod.get("collection_id") or prod.get("category_id"),
-            "source": "medusa",
-        }
+    chunks, metadatas = [], []
+    for text, meta in iter_product_chunks(prod):
+        chunks.append(text)
         metadatas.append(meta)
     return chunks, metadatas
 
-async def ingest_all():
-    col = get_or_create_collection()
-    products = await fetch_products()
-    all_docs = []
-    all_metas = []
-    for p in products:
-        docs, metas = product_to_chunks(p)
-        all_docs.extend(docs)
-        all_metas.extend(metas)
-    if all_docs:
-        upsert_documents(col, all_docs, all_metas)
-        print(f"Ingested {len(all_docs)} chunks from {len(products)} products.")
+async def ingest_all(incremental: bool = False, page_size: int = PAGE_SIZE,
+                     concurrency: int = FETCH_CONCURRENCY, batch_size: int = EMBED_BATCH_SIZE,
+                     workers: int = INGEST_WORKERS, worker_threads: int = INGEST_WORKER_THREADS,
+                     model_factory=None, model_name: str = None):
+    """
+    workers > 0 时 encode 在 worker 进程池里做（model_factory / model_name 传给 worker，基准里换成离线模型），
+    返回值里的 seconds 不含 worker 启动和模型加载时间。
+    """
+    pool = None
+    if workers > 0:
+        pool = EncoderPool(workers, worker_threads, model_factory, model_name)
+        await pool.start()
+    try:
+        return await _ingest(incremental, page_size, concurrency, batch_size, pool)
+    finally:
+        if pool is not None:
+            pool.close()
+
+async def _ingest(incremental: bool, page_size: int, concurrency: int, batch_size: int, pool):
+    col = get_store()
+    catalog = get_catalog()
+    old_state = load_state()
+    new_state: Dict[str, dict] = {}
+    docs_buf: List[str] = []
+    metas_buf: List[dict] = []
+    changed_ids: List[str] = []  # 内容真正变了的商品，写进目录的变更流水，api 进程据此让答案缓存失效
+    n_products = n_changed = n_chunks = 0
+    writer = ParallelWriter(col, pool) if pool is not None else None
+    if writer is not None:
+        writer.start()
+    t0 = time.perf_counter()
+
+    async def flush():
+        nonlocal docs_buf, metas_buf, n_chunks
+        if not docs_buf:
+            return
+        docs, metas = docs_buf, metas_buf
+        docs_buf, metas_buf = [], []
+        if writer is not None:
+            # 交给 worker 进程 encode，队列满时在这里等（背压）
+            await writer.submit(docs, metas)
+        else:
+            # embed 是 CPU 密集的同步调用，放到线程里，拉取下一页的请求可以同时进行
+            await asyncio.to_thread(upsert_documents, col, docs, metas, False)
+        n_chunks += len(docs)
+
+    info: dict = {}
+    async for page in iter_product_pages(page_size, concurrency, info):
+        if catalog is not None:
+            catalog.upsert_products(page)  # 整页一条事务，几毫秒
+        for p in page:
+            n_products += 1
+            pid = p.get("id")
+            fingerprint = {"hash": product_hash(p), "updated_at": p.get("updated_at")}
+            new_state[pid] = fingerprint
+            if old_state.get(pid) != fingerprint:
+                changed_ids.append(pid)
+            if incremental and old_state.get(pid) == fingerprint:
+                continue  # 没变化，不用重新 embed
+            n_changed += 1
+            for doc, meta in iter_product_chunks(p):
+                docs_buf.append(doc)
+                metas_buf.append(meta)
+        # 按页攒批：同一商品的 chunk 总在同一批里，upsert_documents 才能正确清理旧 chunk
+        if len(docs_buf) >= batch_size:
+            await flush()
+    await flush()
+    if writer is not None:
+        await writer.close()  # 等在途的批全部写完，再删除下架商品、落盘
+
+    complete = info.get("count") is None or len(new_state) >= info["count"]
+    if complete:
+        removed = [pid for pid in old_state if pid not in new_state]
     else:
-        print("No docs to ingest.")
+        # 没拉全（分页期间目录变了、接口限流截断等）：没拉到的商品不能当成已下架，保留旧状态，下次拉全了再删
+        print(f"⚠️ 只拉到 {len(new_state)}/{info['count']} 个商品，跳过下架商品的删除")
+        removed = []
+        new_state = {**{pid: fp for pid, fp in old_state.items() if pid not in new_state}, **new_state}
+    if removed:
+        delete_products(col, removed)
+        if catalog is not None:
+            catalog.delete_products(removed)
+    persist_index(col)
+    save_state(new_state)
+    if catalog is not None:
+        catalog.record_changes(changed_ids + removed)
+        if complete:
+            catalog.mark_synced()  # 拉全并且全部写完才更新同步时间，否则工具会继续按旧时间判断是否过期
+
+    elapsed = max(time.perf_counter() - t0, 1e-9)
+    mode = "增量" if incremental else "全量"
+    print(f"{mode}入库完成: {n_products} 个商品, 重建 {n_changed} 个, 删除 {len(removed)} 个, "
+          f"写入 {n_chunks} 个 chunks, 用时 {elapsed:.1f}s")
+    print(f"吞吐: {n_products / elapsed:.1f} products/s, {n_chunks / elapsed:.1f} chunks/s"
+          + (f" ({pool.workers} 个 encode 进程)" if pool is not None else ""))
+    return {"products": n_products, "changed": n_changed, "removed": len(removed),
+            "chunks": n_chunks, "seconds": elapsed}
 
 if __name__ == "__main__":
-    import asyncio
-    asyncio.run(ingest_all())
\ No newline at end of file
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true", help="只重建内容有变化的商品")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--concurrency", type=int, default=FETCH_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS, help="encode 进程数，0 = 单进程")
+    parser.add_argument("--worker-threads", type=int, default=INGEST_WORKER_THREADS,
+                        help="每个 encode 进程的推理线程数（torch 或 onnxruntime），0 = 平均分配 CPU 核")
+    args = parser.parse_args()
+    asyncio.run(ingest_all(args.incremental, args.page_size, args.concurrency, args.batch_size,
+                           args.workers, args.worker_threads))
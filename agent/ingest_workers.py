@@ -0,0 +1,150 @@
+# 多进程入库：embed 分到多个 worker 进程（每个进程只加载一次模型），写向量库只有主进程一个 writer
+
+"""
+单进程入库时 model.encode 只能吃满一个核（torch 的 intra-op 线程对小 batch 帮助有限）。
+INGEST_WORKERS=N 时 ingest_medusa.ingest_all 走这里的流水线：
+
+    拉取/分块（主进程） -> plan：查向量库 + 磁盘缓存，只留真正要 encode 的文本
+        -> 有界队列 -> EncoderPool（N 个进程，每个 INGEST_WORKER_THREADS 个推理线程，按批 encode）
+        -> writer（主进程，唯一写者）：填回向量、写磁盘缓存、apply_upsert 写向量库和 BM25
+
+- 分片的单位是“一批商品的新 chunk”：同一商品的 chunk 总在同一批里，按批轮流交给空闲 worker
+- 队列有界（INGEST_QUEUE_SIZE 批在途），encode 跟不上时拉取和分块会停下来等，内存不随目录规模增长
+- 向量库、BM25 和 embedding 磁盘缓存都只在主进程里写，不存在多进程并发写同一个文件
+- worker 用 spawn 启动（fork 一个已经起了 torch 线程池的进程容易卡死）；
+  model_factory 可以换成 fake_embeddings.HashingEmbedder 这类可 pickle 的工厂，基准里离线跑
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Callable, List, Optional
+
+import numpy as np
+
+import embeddings
+from indexer_chroma import plan_upsert, apply_upsert
+from tracing import span
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))  # 0 = 单进程（旧行为）
+# 每个 worker 的推理 intra-op 线程数（torch 或 onnxruntime）；默认把核平均分给各个 worker
+INGEST_WORKER_THREADS = int(os.getenv("INGEST_WORKER_THREADS", "0"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "0"))  # 在途批数上限，默认 2 * workers
+
+
+def default_threads(workers: int) -> int:
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(threads: int, model_factory: Optional[Callable], model_name: Optional[str]):
+    # 在 import torch 之前限制线程数，避免 N 个进程 x 每个进程默认占满所有核
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    embeddings.EMBED_THREADS = threads  # torch / onnxruntime 的 intra-op 线程都按它设置
+    if model_factory is not None:
+        embeddings.set_model(model_factory(), name=model_name)
+    embeddings.get_model()  # 每个进程只加载一次
+
+
+def _worker_dimension() -> int:
+    return embeddings.get_dimension()
+
+
+def _worker_encode(texts: List[str]) -> np.ndarray:
+    return embeddings._encode(texts)
+
+
+class EncoderPool:
+    """N 个 encode 进程；encode() 是异步的，调用方用有界队列控制在途批数"""
+
+    def __init__(self, workers: int, threads: int = 0, model_factory: Optional[Callable] = None,
+                 model_name: Optional[str] = None):
+        self.workers = max(1, workers)
+        self.threads = threads or default_threads(self.workers)
+        self.model_factory = model_factory
+        self.model_name = model_name
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    async def start(self):
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=get_context("spawn"),
+            initializer=_init_worker, initargs=(self.threads, self.model_factory, self.model_name),
+        )
+        loop = asyncio.get_running_loop()
+        # 每个 worker 都先跑一个任务，把模型加载的时间放在计时之外，也顺便拿到向量维度
+        dims = await asyncio.gather(*(loop.run_in_executor(self._pool, _worker_dimension)
+                                      for _ in range(self.workers)))
+        # 主进程不加载模型，只需要知道维度（磁盘缓存和向量库要用）
+        embeddings.set_dimension(dims[0], name=self.model_name)
+        print(f"🧵 encode worker 已就绪: {self.workers} 个进程 x {self.threads} 线程")
+
+    async def encode(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, _worker_encode, texts)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+
+class ParallelWriter:
+    """
+    submit(docs, metas) 按批进入流水线：plan -> worker encode -> 唯一的 writer 写入。
+    submit 在队列满时会等待（背压）；close() 等全部写完。
+    """
+
+    def __init__(self, collection, pool: EncoderPool, queue_size: int = INGEST_QUEUE_SIZE):
+        self.collection = collection
+        self.pool = pool
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size or 2 * pool.workers)
+        self._writer: Optional[asyncio.Task] = None
+        self._error: Optional[BaseException] = None
+        self.chunks = 0
+        self.encoded = 0
+
+    def start(self):
+        self._writer = asyncio.ensure_future(self._write_loop())
+
+    async def submit(self, docs: List[str], metas: List[dict]):
+        if not docs:
+            return
+        if self._error is not None:
+            raise self._error  # writer 出错了，不再往里塞
+        plan = await asyncio.to_thread(plan_upsert, self.collection, docs, metas)
+        new_docs = [docs[i] for i in plan.new_rows]
+        out, todo = await asyncio.to_thread(embeddings.lookup_cached, new_docs) if new_docs else (None, [])
+        encoding = asyncio.ensure_future(self.pool.encode(todo)) if todo else None
+        await self._queue.put((docs, metas, plan, new_docs, out, todo, encoding))
+
+    def _apply(self, docs, metas, plan, new_docs, out, todo, encoded):
+        if encoded is not None:
+            embeddings.fill_encoded(new_docs, out, todo, encoded)
+        apply_upsert(self.collection, docs, metas, plan, out)
+
+    async def _write_loop(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            docs, metas, plan, new_docs, out, todo, encoding = item
+            if self._error is not None:
+                if encoding is not None:
+                    encoding.cancel()
+                continue  # 出错之后只把队列排空，让 submit 不会卡在满队列上
+            try:
+                with span("ingest.write", chunks=len(docs), encoded=len(todo)):
+                    encoded = await encoding if encoding is not None else None
+                    await asyncio.to_thread(self._apply, docs, metas, plan, new_docs, out, todo, encoded)
+            except Exception as e:
+                self._error = e
+                continue
+            self.chunks += len(docs)
+            self.encoded += len(todo)
+
+    async def close(self):
+        """等在途的批全部写完；中途出过错就抛出来"""
+        await self._queue.put(None)
+        await self._writer
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,50 @@
+# 进程内共享的异步 Claude 客户端
+
+"""
+AsyncAnthropic 在整个进程里只创建一次，底层 httpx 连接池复用 TCP/TLS 连接，
+不再在每个请求里 new 一个同步 Anthropic() 阻塞事件循环。
+设置 ANTHROPIC_BASE_URL 可以指向本地的假 LLM 服务（见 fake_llm.py）。
+"""
+import os
+from typing import Optional
+
+import httpx
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+
+MODEL_NAME = os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20241022")
+MAX_TOKENS = int(os.getenv("ANTHROPIC_MAX_TOKENS", "1024"))
+# 连接池大小决定了一个 worker 能同时进行多少个 LLM 请求
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+
+_client: Optional[AsyncAnthropic] = None
+
+
+def get_llm_client() -> AsyncAnthropic:
+    global _client
+    if _client is None:
+        _client = AsyncAnthropic(
+            api_key=os.getenv("ANTHROPIC_API_KEY"),
+            base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+            timeout=LLM_TIMEOUT,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=LLM_MAX_CONNECTIONS,
+                    max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                ),
+            ),
+        )
+    return _client
+
+
+def set_llm_client(client: AsyncAnthropic):
+    """替换共享客户端（基准测试里用来接入进程内的假 LLM）"""
+    global _client
+    _client = client
+
+
+async def close_llm_client():
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
@@ -0,0 +1,220 @@
+# 常驻的 MCP 会话池：避免每个 /chat 请求都重新启动 agent_server.py 子进程
+
+"""
+MCPSessionPool 在 FastAPI lifespan 中启动 N 个 agent_server.py 子进程并完成 initialize 握手，
+请求到来时 checkout 一个已就绪的 ClientSession，用完再 checkin 归还。
+- 工具列表 list_tools() 只在第一个会话就绪时拉取一次并缓存
+- checkout 时对闲置过久的会话做 ping 健康检查，子进程崩溃或调用出错的会话会被自动重启
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import List, Optional
+
+from mcp import ClientSession, StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+log = logging.getLogger("mcp_pool")
+
+POOL_SIZE = int(os.getenv("MCP_POOL_SIZE", "4"))
+# 会话闲置超过这个秒数，checkout 前先 ping 一次确认子进程还活着
+HEALTH_CHECK_INTERVAL = float(os.getenv("MCP_HEALTH_CHECK_INTERVAL", "30"))
+PING_TIMEOUT = float(os.getenv("MCP_PING_TIMEOUT", "5"))
+
+
+def default_server_params(script_path: str) -> StdioServerParameters:
+    return StdioServerParameters(
+        command=sys.executable,  # 用当前解释器启动，避免 PATH 里的 python 不是同一个环境
+        args=[script_path],
+        # 默认 stdio_client 只给子进程传 PATH/HOME 等少数变量；这里把完整环境传下去，
+        # MEDUSA_*、CATALOG_*、TRACE_* 这些配置在 api 和 MCP server 两边保持一致
+        env=dict(os.environ)
+    )
+
+
+class _PooledSession:
+    """
+    池里的一个槽位。子进程和 ClientSession 由专属的后台 task 持有：
+    stdio_client 内部用 anyio task group，必须在同一个 task 里进入和退出。
+    """
+
+    def __init__(self, server_params: StdioServerParameters, index: int):
+        self.server_params = server_params
+        self.index = index
+        self.session: Optional[ClientSession] = None
+        self.last_used = 0.0
+        self.broken = False
+        self.restarts = 0
+        self._task: Optional[asyncio.Task] = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error: Optional[BaseException] = None
+
+    async def start(self):
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._error = None
+        self.broken = False
+        self._task = asyncio.create_task(self._run())
+        await self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        self.last_used = time.monotonic()
+
+    async def _run(self):
+        try:
+            async with AsyncExitStack() as stack:
+                read, write = await stack.enter_async_context(stdio_client(self.server_params))
+                session = await stack.enter_async_context(ClientSession(read, write))
+                await session.initialize()
+                self.session = session
+                self._ready.set()
+                await self._stop.wait()  # 挂起直到 stop()，期间会话由池子借出使用
+        except Exception as e:
+            self._error = e
+            what = "启动失败" if not self._ready.is_set() else "异常退出"
+            log.error(f"❌ MCP 会话 #{self.index} {what}: {e}")
+        finally:
+            self.session = None
+            self.broken = True
+            self._ready.set()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout=PING_TIMEOUT)
+            except (asyncio.TimeoutError, Exception):
+                self._task.cancel()
+            self._task = None
+
+    async def restart(self):
+        await self.stop()
+        self.restarts += 1
+        log.warning(f"♻️ 重启 MCP 会话 #{self.index} (第 {self.restarts} 次)")
+        await self.start()
+
+    @property
+    def alive(self) -> bool:
+        return (
+            self.session is not None
+            and not self.broken
+            and self._task is not None
+            and not self._task.done()
+        )
+
+    async def healthy(self) -> bool:
+        if not self.alive:
+            return False
+        if time.monotonic() - self.last_used < HEALTH_CHECK_INTERVAL:
+            return True
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=PING_TIMEOUT)
+            return True
+        except Exception as e:
+            log.warning(f"⚠️ MCP 会话 #{self.index} 健康检查失败: {e!r}")
+            return False
+
+
+class MCPSessionPool:
+    def __init__(self, server_params: StdioServerParameters, size: int = POOL_SIZE):
+        self.server_params = server_params
+        self.size = max(1, size)
+        self.tools: List[dict] = []  # Claude 格式的工具定义，整个池子只拉一次
+        self._slots: List[_PooledSession] = []
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._closed = False
+
+    async def start(self):
+        # close() 之后可以再 start()（比如测试里每次进出一遍 lifespan），空闲队列按新的事件循环重建
+        self._closed = False
+        self._idle = asyncio.Queue()
+        self._slots = [_PooledSession(self.server_params, i) for i in range(self.size)]
+        # 并发拉起所有子进程，启动耗时约等于单个子进程的冷启动
+        await asyncio.gather(*(s.start() for s in self._slots))
+        tools_result = await self._slots[0].session.list_tools()
+        self.tools = [{
+            "name": t.name,
+            "description": t.description,
+            "input_schema": t.inputSchema
+        } for t in tools_result.tools]
+        for s in self._slots:
+            self._idle.put_nowait(s)
+        log.info(f"🏊 MCP 会话池已就绪: {self.size} 个会话, 工具: {[t['name'] for t in self.tools]}")
+
+    async def close(self):
+        self._closed = True
+        await asyncio.gather(*(s.stop() for s in self._slots), return_exceptions=True)
+        self._slots = []
+
+    async def _checkout(self) -> _PooledSession:
+        slot = await self._idle.get()
+        if not await slot.healthy():
+            try:
+                await slot.restart()
+            except Exception as e:
+                log.error(f"❌ MCP 会话 #{slot.index} 重启失败: {e}")
+                # 重启失败也要把槽位还回去，否则池子会越用越小
+                self._idle.put_nowait(slot)
+                raise
+        return slot
+
+    async def _recycle(self, slot: _PooledSession):
+        try:
+            await slot.restart()
+        except Exception as e:
+            log.error(f"❌ MCP 会话 #{slot.index} 重启失败: {e}")
+        finally:
+            self._idle.put_nowait(slot)
+
+    def _checkin(self, slot: _PooledSession, failed: bool):
+        slot.last_used = time.monotonic()
+        if self._closed:
+            return
+        if not slot.alive:
+            # 子进程已经退出，在后台重启，不拖慢当前请求返回
+            asyncio.create_task(self._recycle(slot))
+            return
+        if failed:
+            # 出错不一定是会话的问题（也可能是 LLM 调用失败），下次 checkout 时强制 ping 一次
+            slot.last_used = 0.0
+        self._idle.put_nowait(slot)
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        用法: async with pool.session() as session: await session.call_tool(...)
+        代码块内抛出异常时该会话下次借出前会先做健康检查，子进程已退出的会话归还后会被重启。
+        """
+        slot = await self._checkout()
+        failed = False
+        try:
+            yield slot.session
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            self._checkin(slot, failed)
+
+    async def read_resource_all(self, uri: str, timeout: float = PING_TIMEOUT) -> List[str]:
+        """
+        从每个活着的会话读同一个 resource（比如各子进程的指标快照）。
+        MCP 会话本身支持并发请求，被借出的会话也可以读，不用等它归还。
+        """
+        async def read(slot: _PooledSession):
+            result = await asyncio.wait_for(slot.session.read_resource(uri), timeout=timeout)
+            return "".join(getattr(c, "text", "") for c in result.contents)
+
+        slots = [s for s in self._slots if s.alive]
+        results = await asyncio.gather(*(read(s) for s in slots), return_exceptions=True)
+        return [r for r in results if isinstance(r, str)]
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "idle": self._idle.qsize(),
+            "restarts": sum(s.restarts for s in self._slots),
+        }
@@ -0,0 +1,183 @@
+# 进程内指标注册表 + Prometheus 文本格式输出，不依赖 prometheus_client，也不需要外部 collector
+
+"""
+- Counter / Histogram 按 label 组合分别计数，线程安全
+- register_collector(fn)：抓取时才调用 fn() 取当前值，缓存命中率这类“现成的计数”用它导出
+- snapshot() 导出成可 JSON 序列化的结构，MCP server 子进程通过 resource 把自己的指标交给 api 进程，
+  merge 之后统一在 /metrics 里 render
+"""
+import math
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+PREFIX = "smartshopper_"
+# 秒；从 1ms 到 60s，覆盖本地 SQLite 读到多步 LLM 调用
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _key(labels: Optional[dict]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in (labels or {}).items()))
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = PREFIX + name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> List[tuple]:
+        with self._lock:
+            return [(self.name, dict(k), v) for k, v in self._values.items()]
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[LabelKey, list] = {}  # key -> [每个桶的计数..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        with self._lock:
+            v = self._values.get(key)
+            if v is None:
+                v = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+                    break
+            v[-2] += value
+            v[-1] += 1
+
+    def samples(self) -> List[tuple]:
+        out = []
+        with self._lock:
+            items = [(k, list(v)) for k, v in self._values.items()]
+        for key, v in items:
+            labels = dict(key)
+            cumulative = 0
+            for b, n in zip(self.buckets, v):
+                cumulative += n
+                out.append((self.name + "_bucket", dict(labels, le=_fmt(b)), cumulative))
+            out.append((self.name + "_bucket", dict(labels, le="+Inf"), v[-1]))
+            out.append((self.name + "_sum", labels, v[-2]))
+            out.append((self.name + "_count", labels, v[-1]))
+        return out
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name: str, help: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            return metric
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self._get(Counter, name, help)
+
+    def histogram(self, name: str, help: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def register_collector(self, fn: Callable[[], Iterable[tuple]]):
+        """fn() 返回 (name, type, help, labels, value) 的列表，name 不带前缀"""
+        self._collectors.append(fn)
+
+    def snapshot(self, extra_labels: Optional[dict] = None) -> List[dict]:
+        families: Dict[str, dict] = {}
+        for metric in list(self._metrics.values()):
+            fam = families.setdefault(metric.name, {"name": metric.name, "type": metric.type,
+                                                    "help": metric.help, "samples": []})
+            fam["samples"].extend(metric.samples())
+        for fn in list(self._collectors):
+            try:
+                rows = list(fn())
+            except Exception:
+                continue
+            for name, type_, help, labels, value in rows:
+                fam = families.setdefault(PREFIX + name, {"name": PREFIX + name, "type": type_,
+                                                          "help": help, "samples": []})
+                fam["samples"].append((PREFIX + name, labels, value))
+        if extra_labels:
+            for fam in families.values():
+                fam["samples"] = [(n, dict(labels, **extra_labels), v) for n, labels, v in fam["samples"]]
+        return list(families.values())
+
+
+def merge(*snapshots: List[dict]) -> List[dict]:
+    """把多个进程的 snapshot 按指标名合并，同名指标只输出一次 HELP/TYPE"""
+    families: Dict[str, dict] = {}
+    for snap in snapshots:
+        for fam in snap:
+            target = families.setdefault(fam["name"], {"name": fam["name"], "type": fam["type"],
+                                                       "help": fam["help"], "samples": []})
+            target["samples"].extend(tuple(s) for s in fam["samples"])
+    return list(families.values())
+
+
+def render(families: List[dict]) -> str:
+    lines = []
+    for fam in families:
+        if not fam["samples"]:
+            continue
+        lines.append(f"# HELP {fam['name']} {fam['help']}")
+        lines.append(f"# TYPE {fam['name']} {fam['type']}")
+        for name, labels, value in fam["samples"]:
+            if labels:
+                body = ",".join(f'{k}="{_escape(v)}"' for k, v in sorted(labels.items()))
+                lines.append(f"{name}{{{body}}} {_fmt(value)}")
+            else:
+                lines.append(f"{name} {_fmt(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def _fmt(v) -> str:
+    if isinstance(v, float):
+        if math.isinf(v):
+            return "+Inf" if v > 0 else "-Inf"
+        return repr(v)
+    return str(v)
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def cache_collector(cache_name: str, stats: Callable[[], dict]) -> Callable[[], List[tuple]]:
+    """把各个缓存 stats() 里的 hits/misses/hit_rate 转成指标行"""
+    def collect():
+        s = stats()
+        rows = [("cache_hits", "gauge", "缓存命中次数（进程启动以来）", {"cache": cache_name}, s.get("hits", 0)),
+                ("cache_misses", "gauge", "缓存未命中次数（进程启动以来）", {"cache": cache_name}, s.get("misses", 0)),
+                ("cache_hit_ratio", "gauge", "缓存命中率", {"cache": cache_name}, s.get("hit_rate", 0.0))]
+        if "size" in s:
+            rows.append(("cache_entries", "gauge", "缓存当前条目数", {"cache": cache_name}, s["size"]))
+        return rows
+    return collect
+
+
+registry = Registry()
+
+# 各模块共用的指标
+span_seconds = registry.histogram("span_duration_seconds", "各阶段耗时（按 span 名称），见 tracing.py")
+llm_tokens = registry.counter("llm_tokens_total", "LLM token 用量，type=input/output/cache_read/cache_write")
+span_errors = registry.counter("span_errors_total", "以异常结束的 span 数")
@@ -0,0 +1,117 @@
+# ONNX Runtime 推理的 sentence embedding：不 import torch，CPU 上更快、常驻内存小得多
+
+"""
+EMBED_BACKEND=onnx / onnx-int8 时 embeddings.get_model() 返回 OnnxEmbedder，接口和 SentenceTransformer
+被用到的部分一致（encode / get_sentence_embedding_dimension / tokenizer / max_seq_length）：
+- 模型文件在 ONNX_MODEL_DIR/<模型名>/；没有就从 HF Hub 下载模型仓库里现成导出的 onnx/model.onnx 和 tokenizer.json
+- onnx-int8：用 onnxruntime.quantization.quantize_dynamic 把 fp32 模型动态量化（权重 int8，激活运行时量化），
+  结果存成 model_int8.onnx，只做一次
+- tokenizer 用 `tokenizers`（HF 的 Rust 实现），截断到 max_seq_length，按批内最长的补齐
+- 池化和 sentence-transformers 一致：按 attention_mask 做 mean pooling，再 L2 归一化
+- intra-op 线程数由 threads 决定（0 = onnxruntime 默认，用满物理核）；inter-op 固定 1，模型是顺序图
+"""
+import logging
+import os
+import shutil
+from typing import List, Optional
+
+import numpy as np
+
+log = logging.getLogger("onnx_embedder")
+
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./onnx_models")
+MAX_SEQ_LENGTH = 256  # all-MiniLM-L6-v2 的 sentence_bert_config.json
+
+
+def model_dir(model_name: str) -> str:
+    return os.path.join(ONNX_MODEL_DIR, model_name.replace("/", "__"))
+
+
+def _ensure_files(model_name: str) -> str:
+    path = model_dir(model_name)
+    for remote, local in (("onnx/model.onnx", "model.onnx"), ("tokenizer.json", "tokenizer.json")):
+        target = os.path.join(path, local)
+        if os.path.exists(target):
+            continue
+        from huggingface_hub import hf_hub_download
+        os.makedirs(path, exist_ok=True)
+        tmp = f"{target}.{os.getpid()}.tmp"
+        shutil.copyfile(hf_hub_download(model_name, remote), tmp)
+        os.replace(tmp, target)  # 多个 worker 进程同时下载也不会读到写了一半的文件
+    return path
+
+
+def _quantized(path: str) -> str:
+    out = os.path.join(path, "model_int8.onnx")
+    if not os.path.exists(out):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        log.info(f"🔧 量化 ONNX 模型 -> {out}")
+        tmp = f"{out}.{os.getpid()}.tmp.onnx"
+        quantize_dynamic(os.path.join(path, "model.onnx"), tmp, weight_type=QuantType.QInt8)
+        os.replace(tmp, out)
+    return out
+
+
+def load_tokenizer(model_name: str, max_length: Optional[int] = None):
+    """不截断、不补齐的 tokenizers.Tokenizer（chunker 用它数 token）；给了 max_length 就截断并按批补齐"""
+    from tokenizers import Tokenizer
+    tok = Tokenizer.from_file(os.path.join(_ensure_files(model_name), "tokenizer.json"))
+    tok.no_truncation()
+    tok.no_padding()
+    if max_length:
+        tok.enable_truncation(max_length)
+        pad_id = tok.token_to_id("[PAD]")
+        tok.enable_padding(pad_id=pad_id or 0, pad_token="[PAD]" if pad_id is not None else "<pad>")
+    return tok
+
+
+class OnnxEmbedder:
+    def __init__(self, model_name: str, quantize: bool = False, threads: int = 0,
+                 max_seq_length: int = MAX_SEQ_LENGTH):
+        import onnxruntime as ort
+
+        path = _ensure_files(model_name)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        opts.inter_op_num_threads = 1
+        if threads > 0:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(_quantized(path) if quantize else os.path.join(path, "model.onnx"),
+                                            opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+        outputs = self.session.get_outputs()
+        self._output = next((o.name for o in outputs if o.name == "last_hidden_state"), outputs[0].name)
+        dim = outputs[0].shape[-1]
+        self._dim = dim if isinstance(dim, int) else None
+        self.max_seq_length = max_seq_length
+        self.tokenizer = load_tokenizer(model_name)
+        self._batch_tokenizer = load_tokenizer(model_name, max_seq_length)
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self.encode(["dimension"]).shape[1])
+        return self._dim
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               normalize_embeddings: bool = False, **_) -> np.ndarray:
+        if isinstance(texts, str):
+            return self.encode([texts], batch_size, show_progress_bar, normalize_embeddings)[0]
+        blocks = [self._encode_batch(texts[i:i + batch_size], normalize_embeddings)
+                  for i in range(0, len(texts), max(1, batch_size))]
+        if not blocks:
+            return np.empty((0, self.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.concatenate(blocks, axis=0)
+
+    def _encode_batch(self, texts: List[str], normalize: bool) -> np.ndarray:
+        encs = self._batch_tokenizer.encode_batch(list(texts))
+        ids = np.array([e.ids for e in encs], dtype=np.int64)
+        mask = np.array([e.attention_mask for e in encs], dtype=np.int64)
+        feeds = {"input_ids": ids, "attention_mask": mask}
+        if "token_type_ids" in self._inputs:
+            feeds["token_type_ids"] = np.zeros_like(ids)
+        hidden = self.session.run([self._output], feeds)[0]  # (batch, seq, dim)
+        weights = mask[..., None].astype(np.float32)
+        emb = (hidden * weights).sum(axis=1) / np.clip(weights.sum(axis=1), 1e-9, None)
+        if normalize:
+            emb /= np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+        return emb.astype(np.float32, copy=False)
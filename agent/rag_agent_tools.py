@@ -2,8 +2,7 @@
 
 import os
 import json
-from retriever import embed_query, retrieve
-from indexer_chroma import create_collection
+from retriever import retrieve
 from pydantic import BaseModel, ValidationError
 
 # 一个用于校验 LLM 返回结构的 pydantic schema
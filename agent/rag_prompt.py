@@ -2,9 +2,17 @@
 把检索到的 top_k 文档注入到 prompt 中，并返回一个 "instructional" prompt。
 同时演示如何要求 LLM 返回 JSON 用于 function-calling。
 """
-from typing import List, Dict
+from typing import List, Dict, Optional
 import json
 
+def format_documents(docs: List[Dict], max_chars: Optional[int] = None) -> str:
+    """每个文档一行 "[序号] (商品 ID) 正文"；/chat 的检索接地（grounding.py）也用这个格式"""
+    lines = []
+    for i, d in enumerate(docs):
+        text = d['doc'] if max_chars is None or len(d['doc']) <= max_chars else d['doc'][:max_chars] + "…"
+        lines.append(f"[{i}] ({d['metadata'].get('product_id')}) {text}")
+    return "".join(line + "\n" for line in lines)
+
 def build_rag_prompt(user_query: str, docs: List[Dict], schema_example: dict = None):
     header = (
         "You are a factual shopping assistant. Use ONLY the provided DOCUMENTS to answer factual questions.\n"
@@ -12,9 +20,7 @@ def build_rag_prompt(user_query: str, docs: List[Dict], schema_example: dict = N
         "{\"action\": <tool_name>, \"params\": { ... }}\n"
         "Return ONLY valid JSON when requesting a tool call. Do not add additional text.\n\n"
     )
-    docs_text = "\n\n--- DOCUMENTS ---\n"
-    for i, d in enumerate(docs):
-        docs_text += f"[{i}] ({d['metadata'].get('product_id')}) {d['doc']}\n"
+    docs_text = "\n\n--- DOCUMENTS ---\n" + format_documents(docs)
     schema_txt = ""
     if schema_example:
         schema_txt = "\n\nExample tool call JSON:\n" + json.dumps(schema_example, ensure_ascii=False, indent=2) + "\n"
@@ -1,30 +1,294 @@
-#通过 Chroma 检索并做简单重排
+#通过 Chroma 检索并做混合召回 + 重排
 
 """
 简单的 Retriever 封装：给一个文本 query，返回 top_k 文档和 metadata。
+- query 归一化后做 LRU 缓存，热门 query（"sweatshirt"、"t-shirt"）不重复 encode；query 不写 ingest 的磁盘向量缓存
+- collection 句柄只取一次
+- aretrieve() 走 QueryBatcher：几毫秒内到达的并发 query 合并成一个 batch 一次 encode
+- 混合召回：向量 top-N 和 BM25 top-N 用 RRF 融合（RETRIEVER_MODE=dense 时只走向量）
+- RERANK=1 时用 CPU cross-encoder 对融合后的前 RERANK_TOP_N 条重排
+- retrieve_many() / aretrieve_many() 给批量接口用：所有 query 一次 encode、一次多 query 的 col.query
+- 每个阶段都是一个 tracing span；传入 timings dict 会填上各阶段耗时（ms）：embed / vector / bm25 / fuse / rerank
 """
-from indexer_chroma import get_or_create_collection
-from embeddings import model
+import asyncio
+import os
+import re
+import threading
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from vector_store import get_store
+from embeddings import embed_queries
+from ttl_cache import TTLCache
+import bm25
 import numpy as np
+from tracing import span
+
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "4096"))
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "3600"))
+BATCH_MAX_WAIT_MS = float(os.getenv("QUERY_BATCH_MAX_WAIT_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "64"))
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid")  # hybrid | dense
+CANDIDATES = int(os.getenv("RETRIEVER_CANDIDATES", "20"))  # 每一路至少召回这么多条再融合
+RRF_K = int(os.getenv("RRF_K", "60"))
+RERANK = os.getenv("RERANK", "0") == "1"
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "20"))
+
+query_cache = TTLCache(maxsize=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+_collection = None
+
+def get_collection():
+    global _collection
+    if _collection is None:
+        _collection = get_store()  # Chroma 或 FAISS，由 VECTOR_BACKEND 决定
+    return _collection
 
-def embed_query_text(q: str):
-    # reuse sentence-transformers model from embeddings.py
-    emb = model.encode([q], normalize_embeddings=True).tolist()[0]
+def normalize_query(q: str) -> str:
+    return re.sub(r"\s+", " ", q.strip().lower())
+
+def embed_query_text(q: str) -> np.ndarray:
+    # 和 ingest 共用 embeddings.py 的模型，但不走磁盘向量缓存，只用这里的内存 query_cache
+    key = normalize_query(q)
+    emb = query_cache.get(key)
+    if emb is not None:
+        query_cache.hits += 1
+        return emb
+    query_cache.misses += 1
+    emb = embed_queries([key])[0]
+    query_cache.set(key, emb)
     return emb
 
-def retrieve(query: str, top_k: int = 5, filter: dict = None):
-    col = get_or_create_collection()
-    q_emb = embed_query_text(query)
-    # chroma supports where filter dict for metadata
+def embed_query_texts(queries: List[str]) -> List[np.ndarray]:
+    """批量版 embed_query_text：缓存里没有的 query 合成一次 model.encode（去重后）"""
+    keys = [normalize_query(q) for q in queries]
+    by_key: Dict[str, np.ndarray] = {}
+    missing = []
+    for k in dict.fromkeys(keys):
+        emb = query_cache.get(k)
+        if emb is not None:
+            query_cache.hits += 1
+            by_key[k] = emb
+        else:
+            query_cache.misses += 1
+            missing.append(k)
+    if missing:
+        for k, emb in zip(missing, embed_queries(missing)):
+            query_cache.set(k, emb)
+            by_key[k] = emb
+    return [by_key[k] for k in keys]
+
+class QueryBatcher:
+    """
+    把并发到达的 query 攒成一批再 encode：第一个 query 到达后最多等 max_wait_ms，
+    或者攒满 max_batch 条立即发车。encode 放在线程里执行，不阻塞事件循环。
+    """
+
+    def __init__(self, max_wait_ms: float = BATCH_MAX_WAIT_MS, max_batch: int = BATCH_MAX_SIZE):
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch = max_batch
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.batches = 0
+        self.batched_queries = 0
+
+    async def embed(self, q: str) -> np.ndarray:
+        key = normalize_query(q)
+        emb = query_cache.get(key)
+        if emb is not None:
+            query_cache.hits += 1
+            return emb
+        query_cache.misses += 1
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._pending.append((key, fut))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await fut
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            asyncio.ensure_future(self._run(pending))
+
+    async def _run(self, pending: List[Tuple[str, asyncio.Future]]):
+        keys = list(dict.fromkeys(k for k, _ in pending))  # 同一批里的重复 query 只算一次
+        try:
+            embs = await asyncio.to_thread(embed_queries, keys)
+        except Exception as e:
+            for _, fut in pending:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        self.batches += 1
+        self.batched_queries += len(pending)
+        by_key = dict(zip(keys, embs))
+        for k, emb in by_key.items():
+            query_cache.set(k, emb)
+        for k, fut in pending:
+            if not fut.done():
+                fut.set_result(by_key[k])
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "avg_batch_size": round(self.batched_queries / self.batches, 2) if self.batches else 0.0,
+            "query_cache": query_cache.stats(),
+        }
+
+batcher = QueryBatcher()
+
+_reranker = None
+_reranker_lock = threading.Lock()
+
+def get_reranker():
+    # cross-encoder 也是第一次用到才加载，只在 RERANK=1 时才会走到这里
+    global _reranker
+    if _reranker is None:
+        with _reranker_lock:
+            if _reranker is None:
+                from sentence_transformers import CrossEncoder
+                _reranker = CrossEncoder(RERANKER_MODEL, device="cpu")
+    return _reranker
+
+def _query_collection(q_emb: np.ndarray, top_k: int, filter: dict = None):
+    return _query_collection_many([q_emb], top_k, filter)[0]
+
+def _query_collection_many(q_embs: List[np.ndarray], top_k: int, filter: dict = None) -> List[List[dict]]:
+    # 多个 query 一次 col.query，Chroma / FaissStore 都按 query 顺序返回一组结果
+    col = get_collection()
+    q = np.asarray(q_embs, dtype=np.float32).tolist()
+    # chroma (and FaissStore) supports where filter dict for metadata
     if filter:
-        res = col.query(query_embeddings=[q_emb], n_results=top_k, where=filter)
+        res = col.query(query_embeddings=q, n_results=top_k, where=filter)
     else:
-        res = col.query(query_embeddings=[q_emb], n_results=top_k)
-    # res contains documents, metadatas, distances
-    docs = res.get("documents", [[]])[0]
-    metadatas = res.get("metadatas", [[]])[0]
-    distances = res.get("distances", [[]])[0]
+        res = col.query(query_embeddings=q, n_results=top_k)
+    # res contains documents, metadatas, distances（每个 query 一个列表）
+    n = len(q_embs)
     out = []
-    for d, m, dist in zip(docs, metadatas, distances):
-        out.append({"doc": d, "metadata": m, "distance": dist})
-    return out
\ No newline at end of file
+    for ids, docs, metadatas, distances in zip(res.get("ids") or [[]] * n, res.get("documents") or [[]] * n,
+                                               res.get("metadatas") or [[]] * n, res.get("distances") or [[]] * n):
+        out.append([{"id": _id, "doc": d, "metadata": m, "distance": dist}
+                    for _id, d, m, dist in zip(ids, docs, metadatas, distances)])
+    return out
+
+def _fuse(ranked_lists: List[List[str]]) -> List[Tuple[str, float]]:
+    # reciprocal-rank fusion：只看名次，不用管 BM25 分数和余弦距离量纲不同
+    scores: Dict[str, float] = {}
+    for ranked in ranked_lists:
+        for rank, _id in enumerate(ranked):
+            scores[_id] = scores.get(_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    return sorted(scores.items(), key=lambda x: -x[1])
+
+def _rerank(query: str, hits: List[dict]) -> List[dict]:
+    head, tail = hits[:RERANK_TOP_N], hits[RERANK_TOP_N:]
+    if len(head) < 2:
+        return hits
+    scores = get_reranker().predict([(query, h["doc"]) for h in head])
+    for h, sc in zip(head, scores):
+        h["rerank_score"] = float(sc)
+    head.sort(key=lambda h: -h["rerank_score"])
+    return head + tail
+
+def _stage(timings: dict, name: str, sp):
+    timings[name] = sp.duration * 1000
+
+def _n_candidates(top_k: int) -> int:
+    """向量检索要召回的条数：hybrid 模式多召回一些再和 BM25 融合"""
+    return max(top_k * 4, CANDIDATES) if RETRIEVER_MODE == "hybrid" else top_k
+
+def _search(query: str, q_emb: np.ndarray, top_k: int, filter: dict, timings: Optional[dict],
+            dense: Optional[List[dict]] = None) -> List[dict]:
+    """dense 是已经查好的向量召回结果（批量接口一次 col.query 查完所有 query），传了就不再查向量库"""
+    timings = timings if timings is not None else {}
+    n = _n_candidates(top_k)
+    if dense is None:
+        with span("retrieve.vector", n=n) as sp:
+            dense = _query_collection(q_emb, n, filter)
+        _stage(timings, "vector", sp)
+    if RETRIEVER_MODE != "hybrid":
+        return dense
+
+    with span("retrieve.bm25", n=n) as sp:
+        index = bm25.get_index()
+        lexical = index.search(query, n, where=filter)
+    _stage(timings, "bm25", sp)
+    with span("retrieve.fuse") as sp:
+        by_id = {h["id"]: h for h in dense}
+        fused = []
+        for _id, score in _fuse([[h["id"] for h in dense], [i for i, _ in lexical]]):
+            hit = by_id.get(_id)
+            if hit is None:
+                if _id not in index.docs:  # 两次读之间被入库进程删掉了
+                    continue
+                hit = {"id": _id, "doc": index.docs[_id], "metadata": index.metas[_id], "distance": None}
+            hit["score"] = score
+            fused.append(hit)
+    _stage(timings, "fuse", sp)
+    if RERANK:
+        with span("retrieve.rerank", n=min(len(fused), RERANK_TOP_N)) as sp:
+            fused = _rerank(query, fused)
+        _stage(timings, "rerank", sp)
+    return fused[:top_k]
+
+def retrieve(query: str, top_k: int = 5, filter: dict = None, timings: dict = None):
+    timings = timings if timings is not None else {}
+    with span("retrieve", mode=RETRIEVER_MODE, top_k=top_k):
+        with span("retrieve.embed") as sp:
+            q_emb = embed_query_text(query)
+        _stage(timings, "embed", sp)
+        return _search(query, q_emb, top_k, filter, timings)
+
+async def aretrieve(query: str, top_k: int = 5, filter: dict = None, timings: dict = None):
+    """异步版本：query embedding 走微批，检索/融合/重排放到线程里"""
+    timings = timings if timings is not None else {}
+    with span("retrieve", mode=RETRIEVER_MODE, top_k=top_k):
+        with span("retrieve.embed") as sp:
+            q_emb = await batcher.embed(query)
+        _stage(timings, "embed", sp)
+        return await asyncio.to_thread(_search, query, q_emb, top_k, filter, timings)
+
+def retrieve_many(queries: List[str], top_k: int = 5, filter: dict = None) -> List[List[dict]]:
+    """批量检索：所有 query 一次 encode、一次多 query 向量检索，之后逐条做 BM25/融合/重排"""
+    with span("retrieve.batch", mode=RETRIEVER_MODE, top_k=top_k, n=len(queries)):
+        with span("retrieve.embed", n=len(queries)):
+            embs = embed_query_texts(queries)
+        with span("retrieve.vector", n=_n_candidates(top_k), queries=len(queries)):
+            dense = _query_collection_many(embs, _n_candidates(top_k), filter) if queries else []
+        return [_search(q, e, top_k, filter, None, d) for q, e, d in zip(queries, embs, dense)]
+
+async def aretrieve_many(queries: List[str], top_k: int = 5, filter: dict = None) -> AsyncIterator[tuple]:
+    """
+    异步批量版本，按完成顺序 yield (序号, hits 或异常)：encode 和向量检索各一次（在线程里），
+    每条 query 的 BM25/融合/重排再分别放进线程池，先好的先交给调用方（比如 NDJSON 流式返回）。
+    """
+    if not queries:
+        return
+    with span("retrieve.batch", mode=RETRIEVER_MODE, top_k=top_k, n=len(queries)) as sp:
+        with span("retrieve.embed", n=len(queries)):
+            embs = await asyncio.to_thread(embed_query_texts, queries)
+        n = _n_candidates(top_k)
+        with span("retrieve.vector", n=n, queries=len(queries)):
+            dense = await asyncio.to_thread(_query_collection_many, embs, n, filter)
+        parent = sp.traceparent
+
+    async def one(i: int):
+        def run():
+            with span("retrieve.item", parent=parent, index=i):
+                return _search(queries[i], embs[i], top_k, filter, None, dense[i])
+        try:
+            return i, await asyncio.to_thread(run)
+        except Exception as e:
+            return i, e
+
+    tasks = [asyncio.ensure_future(one(i)) for i in range(len(queries))]
+    try:
+        for fut in asyncio.as_completed(tasks):
+            yield await fut
+    finally:
+        for t in tasks:
+            t.cancel()
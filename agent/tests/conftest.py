@@ -0,0 +1,77 @@
+# 测试公用的桩环境：假 Medusa + 假 LLM 跑在后台线程里，embedding 用哈希假模型，所有状态写在临时目录
+# 用法（在 agent/ 下）: python -m pytest -q
+
+import os
+import shutil
+import sys
+import tempfile
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_load import configure_env, free_port, serve_in_thread  # noqa: E402
+
+# 业务模块在 import 时读环境变量，必须在任何测试 import 它们之前设置好
+WORKDIR = tempfile.mkdtemp(prefix="agent_tests_")
+MEDUSA_PORT, LLM_PORT = free_port(), free_port()
+configure_env(WORKDIR, SimpleNamespace(backend="faiss", pool_size=2, answer_cache=True),
+              f"http://127.0.0.1:{MEDUSA_PORT}", f"http://127.0.0.1:{LLM_PORT}")
+os.environ["CATALOG_ENABLED"] = "0"  # 工具直接走（假）Medusa
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def stubs():
+    """整个测试会话共用一套假 Medusa / 假 LLM；测试可以改 stubs.medusa.state 注入故障"""
+    import embeddings
+    import fake_llm
+    import fake_medusa
+    from fake_embeddings import HashingEmbedder
+
+    embeddings.set_model(HashingEmbedder(), name="hashing-384")
+    medusa = fake_medusa.make_app(n_products=50, latency_ms=0)
+    llm = fake_llm.make_app(latency_ms=0, token_delay_ms=0)
+    servers = [serve_in_thread(medusa, MEDUSA_PORT), serve_in_thread(llm, LLM_PORT)]
+    yield SimpleNamespace(medusa=medusa, llm=llm)
+    for s in servers:
+        s.should_exit = True
+
+
+@pytest.fixture
+def api_client(stubs):
+    """返回一个异步上下文管理器：进出一遍 api 的 lifespan（MCP 会话池等），给出接到 api.app 上的 httpx 客户端"""
+    import httpx
+    import api
+
+    @asynccontextmanager
+    async def client():
+        if api.agent_cache is not None:
+            api.agent_cache.answers.clear()
+            api.agent_cache.tools.clear()
+        async with api.app.router.lifespan_context(api.app):
+            transport = httpx.ASGITransport(app=api.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as c:
+                yield c
+
+    return client
+
+
+@pytest.fixture
+def medusa(monkeypatch):
+    """进程内直接调工具函数用：agent_server 的 HTTP 客户端接到一个新的假 Medusa 上"""
+    import httpx
+    import agent_server
+    import fake_medusa
+    stub = fake_medusa.make_app(n_products=20, latency_ms=0)
+    monkeypatch.setattr(agent_server, "_http_client",
+                        httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://medusa"))
+    monkeypatch.setattr(agent_server, "medusa_breaker", agent_server.CircuitBreaker("medusa"))
+    agent_server.medusa_cache.invalidate()
+    yield stub
+    agent_server.medusa_cache.invalidate()
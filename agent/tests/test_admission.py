@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from admission import AdmissionController, DeadlineExceeded, Rejected, deadline_scope, remaining, until_deadline
+
+
+def test_per_client_limit_rejects_with_429():
+    async def run():
+        ac = AdmissionController(max_concurrent=10, max_per_client=1, max_queue=10, queue_timeout=1)
+        ticket = await ac.acquire("a")
+        with pytest.raises(Rejected) as e:
+            await ac.acquire("a")
+        assert e.value.status_code == 429 and e.value.retry_after >= 1
+        await ac.acquire("b")  # 别的客户端不受影响
+        ticket.release()
+        ticket.release()  # 重复释放是安全的
+        assert ac.stats()["in_flight"] == 1
+
+    asyncio.run(run())
+
+
+def test_queue_full_and_queue_timeout_reject_with_503():
+    async def run():
+        ac = AdmissionController(max_concurrent=1, max_per_client=10, max_queue=1, queue_timeout=0.05)
+        first = await ac.acquire("a")
+        waiter = asyncio.ensure_future(ac.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as full:
+            await ac.acquire("c")
+        assert (full.value.status_code, full.value.reason) == (503, "queue_full")
+        with pytest.raises(Rejected) as timeout:
+            await waiter
+        assert timeout.value.reason == "queue_timeout"
+        first.release()
+        assert ac.stats()["in_flight"] == 0 and ac.stats()["queue_depth"] == 0
+
+    asyncio.run(run())
+
+
+def test_queued_requests_admitted_in_order():
+    async def run():
+        ac = AdmissionController(max_concurrent=1, max_per_client=10, max_queue=10, queue_timeout=5)
+        first = await ac.acquire("a")
+        order = []
+
+        async def wait(name):
+            ticket = await ac.acquire(name)
+            order.append(name)
+            ticket.release()
+
+        waiters = [asyncio.ensure_future(wait(n)) for n in ("b", "c", "d")]
+        await asyncio.sleep(0.01)
+        assert order == [] and ac.stats()["queue_depth"] == 3
+        first.release()
+        await asyncio.gather(*waiters)
+        assert order == ["b", "c", "d"]
+
+    asyncio.run(run())
+
+
+def test_deadline_scope_and_until_deadline():
+    async def slow_events():
+        yield 1
+        await asyncio.sleep(5)
+        yield 2
+
+    async def run():
+        assert remaining() is None
+        got = []
+        with deadline_scope(0.1):
+            assert 0 < remaining() <= 0.1
+            with pytest.raises(DeadlineExceeded):
+                async for event in until_deadline(slow_events()):
+                    got.append(event)
+        assert got == [1]
+        assert remaining() is None
+
+    asyncio.run(run())
+
+
+def test_client_key_honours_header_only_from_trusted_proxies(monkeypatch):
+    import ipaddress
+
+    import admission
+    from admission import client_key
+
+    monkeypatch.setattr(admission, "TRUSTED_PROXIES", [ipaddress.ip_network("10.0.0.0/8")])
+    assert client_key("203.0.113.5", "tenant-a") == "203.0.113.5"  # 直连的客户端换头也没用
+    assert client_key("10.1.2.3", "tenant-a") == "tenant-a"
+    assert client_key("10.1.2.3", None) == "10.1.2.3"
+    assert client_key("testclient", "tenant-a") == "testclient"  # 不是 IP 的来源地址不算受信任
+    assert client_key(None, "tenant-a") == "unknown"
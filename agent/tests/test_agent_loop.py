@@ -0,0 +1,21 @@
+import asyncio
+from types import SimpleNamespace
+
+from agent_loop import _run_tool
+
+
+class FailingSession:
+    def __init__(self):
+        self.calls = []
+
+    async def call_tool(self, name, arguments, meta=None):
+        self.calls.append((name, arguments, meta))
+        raise TypeError("bad payload")
+
+
+def test_tool_exception_is_reported_once_and_not_retried():
+    session = FailingSession()
+    tool_use = SimpleNamespace(id="t1", name="search_products", input={"query": "hoodie"})
+    result = asyncio.run(_run_tool(session, tool_use))
+    assert len(session.calls) == 1 and "traceparent" in session.calls[0][2]
+    assert result["is_error"] and "bad payload" in result["output"]
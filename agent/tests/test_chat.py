@@ -0,0 +1,84 @@
+import asyncio
+import json
+
+
+def _sse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_chat_runs_tool_loop(api_client):
+    async def run():
+        async with api_client() as client:
+            r = await client.post("/chat", json={"query": "Sweatshirt"})
+            assert r.status_code == 200
+            body = r.json()
+            assert body["llm_calls"] == 2 and body["tool_calls"] == 1 and body["cached"] is False
+            assert "prod_00000000" in body["reply"]
+
+            # 同一个 session_id 追问，历史里接着往下跑
+            again = await client.post("/chat", json={"query": "Hoodie", "session_id": body["session_id"]})
+            assert again.json()["session_id"] == body["session_id"]
+            stats = (await client.get(f"/sessions/{body['session_id']}")).json()
+            assert stats["turns"] == 2
+
+    asyncio.run(run())
+
+
+def test_unknown_session_id_is_rejected(api_client):
+    async def run():
+        async with api_client() as client:
+            for path in ("/chat", "/chat/stream"):
+                r = await client.post(path, json={"query": "hoodie", "session_id": "chosen-by-client"})
+                assert r.status_code == 404
+            assert (await client.get("/sessions/chosen-by-client")).status_code == 404
+
+    asyncio.run(run())
+
+
+def test_chat_stream_emits_sse_events_in_order(api_client):
+    async def run():
+        async with api_client() as client:
+            r = await client.post("/chat/stream", json={"query": "Hoodie"})
+            assert r.status_code == 200
+            assert r.headers["content-type"].startswith("text/event-stream")
+            return _sse_events(r.text)
+
+    events = asyncio.run(run())
+    kinds = [k for k, _ in events]
+    assert kinds[0] == "session" and kinds[-1] == "final"
+    assert kinds.index("tool_call") < kinds.index("tool_result") < kinds.index("final")
+    assert "token" in kinds[:kinds.index("tool_call")]  # 文本片段边生成边推
+    tokens = "".join(e["text"] for k, e in events[kinds.index("tool_result"):] if k == "token")
+    assert tokens == events[-1][1]["reply"]
+
+
+def test_answer_cache_hit_skips_agent_loop(api_client, stubs):
+    async def run():
+        async with api_client() as client:
+            first = (await client.post("/chat", json={"query": "black hoodie"})).json()
+            calls = stubs.llm.state.calls
+            second = (await client.post("/chat", json={"query": "black hoodie"})).json()
+            assert second["cached"] is True and second["reply"] == first["reply"]
+            assert stubs.llm.state.calls == calls
+
+    asyncio.run(run())
+
+
+def test_follow_up_turns_poll_product_changes(api_client, monkeypatch):
+    import api
+
+    polls = []
+    monkeypatch.setattr(api.agent_cache, "poll_invalidations", lambda force=False: polls.append(1) or 0)
+
+    async def run():
+        async with api_client() as client:
+            first = (await client.post("/chat", json={"query": "Sweatshirt"})).json()
+            n = len(polls)
+            await client.post("/chat", json={"query": "Hoodie", "session_id": first["session_id"]})
+            assert len(polls) > n  # 追问也要拉变更流水，否则工具结果缓存会一直是旧的
+
+    asyncio.run(run())
@@ -0,0 +1,60 @@
+import pytest
+
+import chunker
+from chunker import count_tokens, iter_product_chunks, split_text
+
+
+@pytest.fixture(autouse=True)
+def approx_tokens(monkeypatch):
+    """不加载 HF tokenizer，用正则近似计数，结果和环境无关"""
+    monkeypatch.setattr(chunker, "_tokenizer", False)
+
+
+def test_split_text_respects_budget_and_keeps_sentences():
+    text = " ".join(f"Sentence number {i} talks about soft cotton." for i in range(20))
+    pieces = list(split_text(text, budget=20, overlap=4))
+    assert len(pieces) > 1
+    assert all(count_tokens(p) <= 20 for p in pieces)
+    assert all(p.endswith(".") for p in pieces)  # 能在句子边界切就不硬切
+    assert " ".join(pieces) == text
+
+
+def test_hard_split_overlaps_long_sentence():
+    words = [f"w{chr(97 + i // 26)}{chr(97 + i % 26)}" for i in range(50)]  # 纯字母，一个词一个 token
+    pieces = list(split_text(" ".join(words), budget=20, overlap=4))
+    assert all(count_tokens(p) <= 20 for p in pieces)
+    for a, b in zip(pieces, pieces[1:]):
+        assert a.split()[-4:] == b.split()[:4]
+    assert pieces[0].split()[0] == words[0] and pieces[-1].split()[-1] == words[-1]
+
+
+def test_cjk_without_spaces_is_split():
+    text = "这件卫衣采用有机棉面料，手感柔软透气适合四季穿着" * 5  # 没有空格也没有句号
+    pieces = list(split_text(text, budget=30, overlap=5))
+    assert len(pieces) > 1
+    assert all(count_tokens(p) <= 30 for p in pieces)
+    assert pieces[0].startswith("这件卫衣") and text.endswith(pieces[-1])
+
+
+def test_product_without_description(monkeypatch):
+    monkeypatch.setattr(chunker, "max_tokens", lambda: 64)
+    prod = {"id": "prod_1", "title": "Plain Tee", "description": None, "options": [],
+            "variants": [{"title": "Default", "prices": [{"amount": 1500, "currency_code": "usd"}]}]}
+    chunks = list(iter_product_chunks(prod))
+    assert len(chunks) == 1
+    text, meta = chunks[0]
+    assert text.startswith("Plain Tee\n") and "15.0 USD" in text
+    assert meta["product_id"] == "prod_1" and "description" not in meta["fields"]
+
+    bare = list(iter_product_chunks({"id": "prod_2", "title": "Mystery Box"}))
+    assert [(t, m["fields"]) for t, m in bare] == [("Mystery Box", "title")]
+
+
+def test_product_chunks_fit_budget_and_start_with_title(monkeypatch):
+    monkeypatch.setattr(chunker, "max_tokens", lambda: 40)
+    prod = {"id": "prod_3", "title": "Wool Jacket",
+            "description": " ".join(f"Detail {i} about the warm wool jacket." for i in range(15))}
+    chunks = list(iter_product_chunks(prod))
+    assert len(chunks) > 1
+    assert all(t.startswith("Wool Jacket\n") and count_tokens(t) <= 40 for t, _ in chunks)
+    assert [m["chunk_index"] for _, m in chunks] == list(range(len(chunks)))
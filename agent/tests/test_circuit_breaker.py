@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import CircuitBreaker, CircuitOpen
+
+
+async def ok():
+    return 200
+
+
+async def fail():
+    raise ConnectionError("down")
+
+
+def test_opens_after_threshold_and_rejects_without_calling():
+    async def run():
+        breaker = CircuitBreaker("t", failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                await breaker.call(fail)
+        assert breaker.state == "open"
+        calls = []
+
+        async def tracked():
+            calls.append(1)
+            return 200
+
+        with pytest.raises(CircuitOpen):
+            await breaker.call(tracked)
+        assert calls == []
+
+    asyncio.run(run())
+
+
+def test_half_open_probe_closes_or_reopens():
+    async def run():
+        breaker = CircuitBreaker("t", failure_threshold=1, reset_timeout=0.01)
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)
+        await asyncio.sleep(0.02)
+        with pytest.raises(ConnectionError):
+            await breaker.call(fail)  # 探测失败，重新打开
+        assert breaker.state == "open"
+        await asyncio.sleep(0.02)
+        assert await breaker.call(ok) == 200
+        assert breaker.state == "closed" and breaker.failures == 0
+
+    asyncio.run(run())
+
+
+def test_is_failure_counts_5xx_but_not_4xx():
+    async def run():
+        breaker = CircuitBreaker("t", failure_threshold=2, reset_timeout=60)
+
+        async def status(code):
+            return code
+
+        for _ in range(3):
+            await breaker.call(lambda: status(404), is_failure=lambda r: r >= 500)
+        assert breaker.state == "closed"
+        for _ in range(2):
+            await breaker.call(lambda: status(503), is_failure=lambda r: r >= 500)
+        assert breaker.state == "open"
+
+    asyncio.run(run())
+
+
+def test_cancellation_is_not_a_failure():
+    async def run():
+        breaker = CircuitBreaker("t", failure_threshold=1, reset_timeout=60)
+        task = asyncio.ensure_future(breaker.call(lambda: asyncio.sleep(5)))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert breaker.state == "closed" and breaker.failures == 0
+
+    asyncio.run(run())
@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+
+from conversation import CONTEXT_TAG, Conversation, ConversationStore, build_request_messages, compact
+
+
+def _turn(i, tool_output=None):
+    """一轮：提问 ->（可选）工具调用和结果 -> 回答"""
+    msgs = [{"role": "user", "content": f"q{i}"}]
+    if tool_output is not None:
+        msgs += [{"role": "assistant", "content": [{"type": "tool_use", "id": f"t{i}", "name": "search_products",
+                                                    "input": {"query": f"q{i}"}}]},
+                 {"role": "user", "content": [{"type": "tool_result", "tool_use_id": f"t{i}", "content": tool_output}]}]
+    msgs.append({"role": "assistant", "content": [{"type": "text", "text": f"a{i}"}]})
+    return msgs
+
+
+def test_compact_keeps_last_turns():
+    messages = [m for i in range(5) for m in _turn(i)]
+    compact(messages, max_turns=2)
+    assert [m["content"] for m in messages if m["role"] == "user"] == ["q3", "q4"]
+
+
+def test_compact_with_zero_max_turns_keeps_nothing():
+    messages = [m for i in range(3) for m in _turn(i)]
+    assert compact(messages, max_turns=0) == []
+
+
+def test_compact_truncates_old_tool_results_only():
+    long = "x" * 1000
+    messages = _turn(0, long) + _turn(1, long)
+    compact(messages, max_turns=6, keep_full_turns=1, max_chars=10)
+    old, new = messages[2]["content"][0]["content"], messages[6]["content"][0]["content"]
+    assert old.startswith("x" * 10) and "已截断" in old and len(old) < 100
+    assert new == long
+
+
+def test_compact_drops_grounding_context_from_old_turns():
+    context = {"type": "text", "text": f"{CONTEXT_TAG}\n[0] (prod_1) x\n</retrieved_products>"}
+    messages = [{"role": "user", "content": [context, {"type": "text", "text": "q0"}]},
+                {"role": "assistant", "content": [{"type": "text", "text": "a0"}]}] + _turn(1)
+    compact(messages, keep_full_turns=1)
+    assert messages[0]["content"] == [{"type": "text", "text": "q0"}]
+
+
+def test_build_request_messages_marks_last_block_without_mutating():
+    messages = _turn(0)
+    out = build_request_messages(messages)
+    assert out[-1]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "cache_control" not in messages[-1]["content"][-1]
+
+
+def test_turn_rolls_back_on_error():
+    conv = Conversation("s")
+
+    async def run():
+        async with conv.turn() as history:
+            history.extend(_turn(0))
+        with pytest.raises(RuntimeError):
+            async with conv.turn() as history:
+                history.append({"role": "user", "content": "q1"})
+                raise RuntimeError("llm down")
+
+    asyncio.run(run())
+    assert conv.turns == 1 and len(conv.messages) == 2
+
+
+def test_store_get_or_create_and_delete():
+    store = ConversationStore(maxsize=10, ttl=60)
+    conv = store.get_or_create()
+    assert store.get_or_create(conv.session_id) is conv
+    assert store.delete(conv.session_id) and store.get(conv.session_id) is None
+    assert store.get_or_create(conv.session_id) is None  # 删掉之后不会按旧 ID 重建
+
+
+def test_store_rejects_client_chosen_ids():
+    store = ConversationStore(maxsize=10, ttl=60)
+    assert store.get_or_create("attacker-chosen") is None
+    assert store.get("attacker-chosen") is None and len(store) == 0
@@ -0,0 +1,77 @@
+import multiprocessing
+
+import numpy as np
+
+from embeddings import EmbeddingCache
+
+DIM = 8
+
+
+def _vec(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).random(DIM, dtype=np.float32)
+
+
+def test_two_instances_on_one_dir_keep_rows_aligned(tmp_path):
+    a = EmbeddingCache(str(tmp_path), DIM)
+    b = EmbeddingCache(str(tmp_path), DIM)
+    a.add(["ka"], np.stack([_vec(1)]))
+    b.add(["kb"], np.stack([_vec(2)]))
+    assert np.array_equal(b.lookup(["kb"])[0], _vec(2))
+    assert np.array_equal(b.lookup(["ka"])[0], _vec(1))  # 另一个实例写的 key 也能读到
+    assert np.array_equal(a.lookup(["kb"])[0], _vec(2))
+    a.add(["kc", "kb"], np.stack([_vec(3), _vec(2)]))
+    fresh = EmbeddingCache(str(tmp_path), DIM)
+    assert len(fresh) == 3
+    assert all(np.array_equal(fresh.lookup([k])[0], _vec(i)) for i, k in enumerate(["ka", "kb", "kc"], 1))
+
+
+def test_reload_truncates_vectors_without_keys(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), DIM)
+    cache.add(["k1"], np.stack([_vec(1)]))
+    with open(tmp_path / "vectors.f32", "ab") as f:
+        f.write(_vec(9).tobytes())  # 写了向量、key 还没写就退出
+    again = EmbeddingCache(str(tmp_path), DIM)
+    again.add(["k2"], np.stack([_vec(2)]))
+    assert np.array_equal(EmbeddingCache(str(tmp_path), DIM).lookup(["k2"])[0], _vec(2))
+
+
+def _writer(path: str, worker: int, n: int):
+    cache = EmbeddingCache(path, DIM)
+    for i in range(n):
+        seed = worker * 1000 + i
+        cache.add([f"k{seed}"], np.stack([_vec(seed)]))
+
+
+def test_concurrent_processes_append_safely(tmp_path):
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_writer, args=(str(tmp_path), w, 100)) for w in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+        assert p.exitcode == 0
+    cache = EmbeddingCache(str(tmp_path), DIM)
+    assert len(cache) == 300
+    for w in range(3):
+        for i in range(0, 100, 7):
+            seed = w * 1000 + i
+            assert np.array_equal(cache.lookup([f"k{seed}"])[0], _vec(seed))
+
+
+def test_query_embeddings_skip_disk_cache(stubs):
+    import asyncio
+
+    import embeddings
+    import retriever
+
+    before = len(embeddings.get_cache())
+    retriever.query_cache.invalidate()
+    retriever.embed_query_text("query only cache one")
+    retriever.embed_query_texts(["query only cache two", "query only cache three"])
+
+    async def batched():
+        return await retriever.QueryBatcher(max_wait_ms=1).embed("query only cache four")
+
+    asyncio.run(batched())
+    assert len(embeddings.get_cache()) == before
+    assert retriever.query_cache.get(retriever.normalize_query("query only cache four")) is not None
@@ -0,0 +1,53 @@
+import numpy as np
+
+from faiss_store import FaissStore
+
+DIM = 16
+
+
+def _rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    ids = [f"id{seed}-{i}" for i in range(n)]
+    vecs = rng.standard_normal((n, DIM)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    return ids, [f"doc {i}" for i in ids], [{"key": i} for i in ids], vecs
+
+
+class _LockedList(list):
+    """按行号取值时检查 store 的锁在当前线程手里：并发的 upsert / delete（压缩）会移动行号"""
+
+    def __init__(self, items, lock):
+        super().__init__(items)
+        self.lock = lock
+
+    def __getitem__(self, i):
+        assert self.lock._is_owned(), "在锁外按行号读取"
+        return super().__getitem__(i)
+
+
+def test_query_reads_rows_under_lock(tmp_path):
+    store = FaissStore("test", "flat", path=str(tmp_path / "faiss"))
+    ids, docs, metas, vecs = _rows(50)
+    store.upsert(ids, docs, metas, vecs)
+    store._ids = _LockedList(store._ids, store._lock)
+    store._docs = _LockedList(store._docs, store._lock)
+    store._metas = _LockedList(store._metas, store._lock)
+
+    res = store.query(_rows(3, seed=1)[3], n_results=5)
+    for ids, docs, metas in zip(res["ids"], res["documents"], res["metadatas"]):
+        assert len(ids) == 5
+        assert docs == [f"doc {i}" for i in ids]
+        assert [m["key"] for m in metas] == ids
+
+
+def test_query_on_empty_store_returns_one_empty_row_per_query(tmp_path):
+    store = FaissStore("test", "flat", path=str(tmp_path / "faiss"))
+    queries = _rows(2, seed=1)[3]
+    assert store.query(queries, n_results=5) == {"ids": [[], []], "documents": [[], []],
+                                                  "metadatas": [[], []], "distances": [[], []]}
+    assert store.query(queries[0], n_results=5)["ids"] == [[]]
+
+    ids, docs, metas, vecs = _rows(3)
+    store.upsert(ids, docs, metas, vecs)
+    store.delete(ids=ids)
+    assert store.query(queries, n_results=5)["ids"] == [[], []]  # 只剩墓碑
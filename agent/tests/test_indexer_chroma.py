@@ -0,0 +1,60 @@
+import pytest
+
+import indexer_chroma
+from indexer_chroma import product_filter, upsert_documents
+from vector_store import match_where
+
+
+@pytest.fixture(params=["faiss", "chroma"])
+def collection(request, tmp_path, monkeypatch):
+    import embeddings
+    from fake_embeddings import HashingEmbedder
+    embeddings.set_model(HashingEmbedder(), name="hashing-384")
+    if request.param == "faiss":
+        from faiss_store import FaissStore
+        return FaissStore("test", "flat", path=str(tmp_path / "faiss"))
+    pytest.importorskip("chromadb")
+    monkeypatch.chdir(tmp_path)  # get_client 把库放在 ./chroma_db
+    monkeypatch.setattr(indexer_chroma, "_client", None)
+    return indexer_chroma.get_or_create_collection("test")
+
+
+def _chunks(pid: str, *texts):
+    return list(texts), [{"product_id": pid, "chunk_index": i} for i in range(len(texts))]
+
+
+def _ids(collection, pid):
+    return sorted(collection.get(where=product_filter([pid]), include=[])["ids"])
+
+
+def test_product_filter_uses_only_eq_and_or():
+    assert product_filter(["p1"]) == {"product_id": {"$eq": "p1"}}
+    where = product_filter(["p1", "p2", "p1"])
+    assert where == {"$or": [{"product_id": {"$eq": "p1"}}, {"product_id": {"$eq": "p2"}}]}
+    assert match_where({"product_id": "p2"}, where) and not match_where({"product_id": "p3"}, where)
+
+
+def test_reupsert_replaces_stale_chunks(collection):
+    docs_a, meta_a = _chunks("prod_a", "cotton hoodie", "black, size M")
+    docs_b, meta_b = _chunks("prod_b", "wool jacket")
+    upsert_documents(collection, docs_a + docs_b, meta_a + meta_b)
+    assert len(_ids(collection, "prod_a")) == 2
+
+    docs, meta = _chunks("prod_a", "cotton hoodie", "grey, size L")  # 第二个 chunk 内容变了
+    upsert_documents(collection, docs, meta)
+    ids = _ids(collection, "prod_a")
+    assert len(ids) == 2 and all(i.startswith("prod_a:") for i in ids)
+    assert len(_ids(collection, "prod_b")) == 1  # 别的商品不受影响
+
+
+def test_delete_products_removes_all_their_chunks(collection):
+    from indexer_chroma import delete_products
+    docs_a, meta_a = _chunks("prod_a", "cotton hoodie", "black, size M")
+    docs_b, meta_b = _chunks("prod_b", "wool jacket")
+    docs_c, meta_c = _chunks("prod_c", "navy cap")
+    upsert_documents(collection, docs_a + docs_b + docs_c, meta_a + meta_b + meta_c)
+    delete_products(collection, ["prod_a", "prod_b"])
+    assert _ids(collection, "prod_a") == [] and _ids(collection, "prod_b") == []
+    assert len(_ids(collection, "prod_c")) == 1
+    delete_products(collection, ["prod_c"])  # 只有一个商品时用单个 $eq
+    assert _ids(collection, "prod_c") == []
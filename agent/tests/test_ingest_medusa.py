@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+import ingest_medusa
+
+
+def _catalog(n):
+    return [{"id": f"prod_{i:03d}", "title": f"Product {i}", "description": "cotton"} for i in range(n)]
+
+
+def _serve(monkeypatch, products, max_limit=None, count=None, requests=None):
+    """假的 _fetch_page：max_limit 模拟 Medusa 把 limit 压小，count 可以和实际能拉到的不一致"""
+
+    async def fetch(client, offset, limit):
+        if requests is not None:
+            requests.append((offset, limit))
+        limit = min(limit, max_limit or limit)
+        return {"products": products[offset:offset + limit],
+                "count": len(products) if count is None else count, "offset": offset, "limit": limit}
+
+    monkeypatch.setattr(ingest_medusa, "_fetch_page", fetch)
+
+
+def _fetch_all(**kwargs):
+    async def run():
+        return [p async for page in ingest_medusa.iter_product_pages(**kwargs) for p in page]
+
+    return asyncio.run(run())
+
+
+def test_pages_step_by_rows_actually_returned(monkeypatch):
+    products = _catalog(95)
+    requests = []
+    _serve(monkeypatch, products, max_limit=20, requests=requests)
+    got = _fetch_all(page_size=50, concurrency=3)
+    assert sorted(p["id"] for p in got) == [p["id"] for p in products]
+    assert sorted(o for o, _ in requests) == [0, 20, 40, 60, 80]
+
+
+def test_pages_without_count_continue_past_short_pages(monkeypatch):
+    products = _catalog(45)
+    _serve(monkeypatch, products, max_limit=20)
+    fetch = ingest_medusa._fetch_page
+
+    async def no_count(client, offset, limit):
+        body = await fetch(client, offset, limit)
+        body.pop("count")
+        return body
+
+    monkeypatch.setattr(ingest_medusa, "_fetch_page", no_count)
+    assert len(_fetch_all(page_size=50)) == 45
+
+
+@pytest.fixture
+def fake_ingest(monkeypatch):
+    """把 _ingest 依赖的存储都换成内存里的，记录删除了哪些商品"""
+    state = {"saved": {}, "deleted": []}
+    monkeypatch.setattr(ingest_medusa, "get_store", lambda: None)
+    monkeypatch.setattr(ingest_medusa, "get_catalog", lambda: None)
+    monkeypatch.setattr(ingest_medusa, "load_state", lambda: dict(state["saved"]))
+    monkeypatch.setattr(ingest_medusa, "save_state", lambda s: state.update(saved=dict(s)))
+    monkeypatch.setattr(ingest_medusa, "upsert_documents", lambda *a, **kw: None)
+    monkeypatch.setattr(ingest_medusa, "persist_index", lambda col: None)
+    monkeypatch.setattr(ingest_medusa, "delete_products", lambda col, ids: state["deleted"].extend(ids))
+
+    def run(products, **serve):
+        _serve(monkeypatch, products, **serve)
+        return asyncio.run(ingest_medusa.ingest_all(incremental=True, page_size=10, workers=0))
+
+    return state, run
+
+
+def test_incomplete_fetch_does_not_delete_unseen_products(fake_ingest):
+    state, run = fake_ingest
+    products = _catalog(30)
+    run(products)
+    assert len(state["saved"]) == 30
+
+    # 目录没变，但这次只拉到 20 个（count 仍是 30）：剩下 10 个不能当成下架
+    result = run(products[:20], count=30)
+    assert result["removed"] == 0 and state["deleted"] == []
+    assert len(state["saved"]) == 30
+
+    # 拉全了，真正下架的才删
+    result = run(products[:25])
+    assert result["removed"] == 5
+    assert sorted(state["deleted"]) == [p["id"] for p in products[25:]]
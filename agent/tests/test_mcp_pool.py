@@ -0,0 +1,60 @@
+import asyncio
+import os
+
+from mcp_pool import MCPSessionPool, default_server_params
+
+SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent_server.py")
+
+
+def _text(result) -> str:
+    return "\n".join(c.text for c in result.content if getattr(c, "type", "") == "text")
+
+
+def test_pool_reuses_warm_sessions(stubs):
+    async def run():
+        pool = MCPSessionPool(default_server_params(SERVER), size=2)
+        await pool.start()
+        try:
+            assert {t["name"] for t in pool.tools} >= {"search_products", "get_product_details", "get_products_details"}
+
+            async def search():
+                async with pool.session() as session:
+                    return _text(await session.call_tool("search_products", {"query": "Sweatshirt"}))
+
+            outputs = await asyncio.gather(*(search() for _ in range(6)))
+            assert all("prod_00000000" in out for out in outputs)
+            assert pool.stats() == {"size": 2, "idle": 2, "restarts": 0}
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_pool_restarts_dead_session(stubs):
+    async def run():
+        pool = MCPSessionPool(default_server_params(SERVER), size=1)
+        await pool.start()
+        try:
+            slot = pool._slots[0]
+            await slot.stop()  # 模拟子进程退出
+            async with pool.session() as session:  # checkout 时发现不健康，先重启
+                out = _text(await session.call_tool("get_product_details", {"product_id": "prod_00000000"}))
+            assert "Sweatshirt" in out
+            assert pool.stats()["restarts"] == 1
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_pool_can_restart_after_close(stubs):
+    async def run():
+        pool = MCPSessionPool(default_server_params(SERVER), size=1)
+        for _ in range(2):
+            await pool.start()
+            async with pool.session() as session:
+                await session.send_ping()
+            assert pool.stats()["idle"] == 1
+            await pool.close()
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+
+import agent_server
+from agent_server import approx_tokens, format_products_compact
+
+
+def _product(i: int, description: str = "") -> dict:
+    return {"id": f"prod_{i}", "title": f"Hoodie {i}", "material": "cotton", "description": description,
+            "variants": [{"title": "Default", "prices": [{"amount": 2500, "currency_code": "usd"}]}]}
+
+
+def test_budget_cutoff_marks_omitted_fields():
+    products = [_product(i, "Soft brushed fleece with a relaxed fit. " * 30) for i in range(6)]
+    out = format_products_compact(products, ["price", "material", "description"], budget=300)
+    lines = out.splitlines()
+    assert all(any(line.startswith(f"[prod_{i}] ") for line in lines) for i in range(6))  # 每个商品都还在
+    assert "已省略" in lines[-1]
+    assert all(approx_tokens(line) <= 300 // 6 + 2 for line in lines[:6])
+    assert "…" in out  # 描述被截短而不是整段带上
+
+
+def test_within_budget_has_no_marker():
+    out = format_products_compact([_product(1, "Warm.")], ["price", "description"], budget=800)
+    assert out == "[prod_1] Hoodie 1 | 价格: 25.0 USD | 描述: Warm."
+
+
+def test_unknown_fields_are_rejected(medusa):
+    out = asyncio.run(agent_server.get_products_details(["prod_00000001"], fields=["price", "colour"]))
+    assert out.startswith("不支持的字段: colour") and "material" in out
+    assert medusa.state.requests == 0
+
+
+def test_fields_projection(medusa):
+    out = asyncio.run(agent_server.get_products_details(["prod_00000001", "prod_00000002"], fields=["price"]))
+    lines = out.splitlines()
+    assert [line.split("]")[0] for line in lines] == ["[prod_00000001", "[prod_00000002"]
+    assert all("价格:" in line and "材质:" not in line and "描述:" not in line for line in lines)
+
+
+def test_missing_ids_are_reported_per_item(medusa):
+    out = asyncio.run(agent_server.get_products_details(["prod_00000001", "prod_missing", "prod_00000003"]))
+    lines = out.splitlines()
+    assert lines[0].startswith("[prod_00000001] ") and lines[1].startswith("[prod_00000003] ")
+    assert "未找到: prod_missing" in lines
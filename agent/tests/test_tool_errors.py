@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from mcp.server.fastmcp.exceptions import ToolError
+
+import agent_server
+from bench_load import free_port
+
+
+def test_5xx_raises_tool_error(medusa):
+    medusa.state.fail_status = 503
+    for call in (agent_server.search_products("hoodie"), agent_server.get_product_details("prod_00000001"),
+                 agent_server.get_products_details(["prod_00000001", "prod_00000002"])):
+        with pytest.raises(ToolError):
+            asyncio.run(call)
+
+
+def test_not_found_is_a_normal_result(medusa):
+    assert "找不到" in asyncio.run(agent_server.get_product_details("prod_missing"))
+
+
+def test_connection_failure_raises_tool_error(monkeypatch):
+    monkeypatch.setattr(agent_server, "_http_client",
+                        httpx.AsyncClient(base_url=f"http://127.0.0.1:{free_port()}", timeout=2))
+    monkeypatch.setattr(agent_server, "medusa_breaker", agent_server.CircuitBreaker("medusa"))
+    agent_server.medusa_cache.invalidate()
+    with pytest.raises(ToolError, match="商品服务请求失败"):
+        asyncio.run(agent_server.search_products("hoodie"))
+
+
+def test_breaker_open_raises_tool_error(medusa, monkeypatch):
+    breaker = agent_server.CircuitBreaker("medusa", failure_threshold=1, reset_timeout=60)
+    breaker._on_failure()
+    monkeypatch.setattr(agent_server, "medusa_breaker", breaker)
+    with pytest.raises(ToolError, match="暂时不可用"):
+        asyncio.run(agent_server.search_products("hoodie"))
+    assert medusa.state.requests == 0
+
+
+def test_failed_tool_result_is_not_cached_and_next_request_succeeds(api_client, stubs):
+    import api
+
+    async def run():
+        async with api_client() as client:
+            stubs.medusa.state.fail_status = 503
+            try:
+                failed = (await client.post("/chat", json={"query": "Jacket"})).json()
+            finally:
+                stubs.medusa.state.fail_status = None
+            assert failed["tool_calls"] == 1 and "prod_" not in failed["reply"]
+            assert api.agent_cache.tools.stats()["size"] == 0
+            assert len(api.agent_cache.answers) == 0
+
+            ok = (await client.post("/chat", json={"query": "Jacket"})).json()
+            assert ok["cached"] is False and "prod_" in ok["reply"]
+            assert api.agent_cache.tools.stats()["size"] == 1 and len(api.agent_cache.answers) == 1
+
+    asyncio.run(run())
+
+
+def _ctx(deadline_ms: float):
+    """模拟 api 通过 call_tool(meta={"deadline_ms": ...}) 传过来的请求上下文"""
+    return SimpleNamespace(request_context=SimpleNamespace(meta=SimpleNamespace(deadline_ms=deadline_ms)))
+
+
+def test_deadline_is_an_error_and_does_not_cancel_other_waiters(medusa):
+    import fake_medusa
+    slow = fake_medusa.make_app(n_products=20, latency_ms=100)
+    agent_server._http_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=slow), base_url="http://medusa")
+
+    async def run():
+        late = asyncio.ensure_future(agent_server.search_products("Sweatshirt", ctx=_ctx(10)))
+        await asyncio.sleep(0)
+        patient = asyncio.ensure_future(agent_server.search_products("Sweatshirt", ctx=_ctx(5000)))
+        with pytest.raises(ToolError, match="超时"):
+            await late
+        assert "prod_00000000" in await patient
+        assert slow.state.requests == 1
+
+    asyncio.run(run())
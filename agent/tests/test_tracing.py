@@ -0,0 +1,49 @@
+import os
+
+import pytest
+
+import tracing
+from tracing import recent_spans, span
+
+
+def test_default_exporter_keeps_spans_in_memory_only():
+    assert os.environ.get("TRACE_EXPORTER") is None and tracing.TRACE_EXPORTER == "none"
+    with span("test.memory") as s:
+        s.set(n=1)
+    assert any(r["name"] == "test.memory" for r in recent_spans(s.trace_id))
+    assert tracing._export_file is None
+
+
+@pytest.fixture
+def jsonl_export(tmp_path, monkeypatch):
+    path = str(tmp_path / "traces.jsonl")
+    monkeypatch.setattr(tracing, "TRACE_EXPORTER", "jsonl")
+    monkeypatch.setattr(tracing, "TRACE_EXPORT_PATH", path)
+    monkeypatch.setattr(tracing, "TRACE_MAX_BYTES", 2000)
+    monkeypatch.setattr(tracing, "TRACE_BACKUP_COUNT", 2)
+    monkeypatch.setattr(tracing, "_export_file", None)
+    yield path
+    if tracing._export_file is not None:
+        tracing._export_file.close()
+    tracing._export_file = None
+
+
+def test_jsonl_export_rotates_and_bounds_disk_usage(jsonl_export):
+    for i in range(200):
+        with span("test.rotate", i=i):
+            pass
+    files = sorted(os.listdir(os.path.dirname(jsonl_export)))
+    assert files == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2", "traces.jsonl.lock"]
+    line = max(len(l) for l in open(jsonl_export, encoding="utf-8"))
+    for name in files[:3]:
+        assert os.path.getsize(os.path.join(os.path.dirname(jsonl_export), name)) < 2000 + line
+
+
+def test_reopens_after_another_process_rotated(jsonl_export):
+    with span("test.before"):
+        pass
+    os.replace(jsonl_export, jsonl_export + ".1")  # 别的进程轮转了
+    with span("test.after"):
+        pass
+    assert "test.after" in open(jsonl_export, encoding="utf-8").read()
+    assert "test.after" not in open(jsonl_export + ".1", encoding="utf-8").read()
@@ -0,0 +1,128 @@
+import asyncio
+
+import httpx
+import pytest
+
+from ttl_cache import TTLCache
+
+
+def test_get_set_expire_and_lru():
+    cache = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # a 变成最近使用
+    cache.set("c", 3)
+    assert cache.get("b") is None and cache.get("a") == 1 and cache.get("c") == 3
+    cache.set("d", 4, ttl=-1)
+    assert cache.get("d", "missing") == "missing"
+
+
+def test_invalidate_predicate():
+    cache = TTLCache()
+    for k in ("prod_1", "prod_2", "other"):
+        cache.set(k, k)
+    assert cache.invalidate(lambda k: k.startswith("prod_")) == 2
+    assert cache.get("other") == "other"
+    assert cache.invalidate() == 1 and cache.stats()["size"] == 0
+
+
+def test_single_flight_loads_once_for_concurrent_callers():
+    async def run():
+        cache = TTLCache()
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "v"
+
+        results = await asyncio.gather(*(cache.get_or_load("k", loader) for _ in range(5)))
+        assert results == ["v"] * 5 and len(calls) == 1
+        assert await cache.get_or_load("k", loader) == "v" and len(calls) == 1
+        assert cache.stats()["coalesced"] == 4 and cache.stats()["hits"] == 1
+
+    asyncio.run(run())
+
+
+def test_failures_propagate_to_waiters_and_are_not_cached():
+    async def run():
+        cache = TTLCache()
+
+        async def broken():
+            await asyncio.sleep(0.01)
+            raise ConnectionError("down")
+
+        results = await asyncio.gather(*(cache.get_or_load("k", broken) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, ConnectionError) for r in results)
+
+        async def fine():
+            return "ok"
+
+        assert await cache.get_or_load("k", fine) == "ok"
+
+    asyncio.run(run())
+
+
+def test_cache_if_skips_unwanted_values():
+    async def run():
+        cache = TTLCache()
+
+        async def loader():
+            return 503
+
+        await cache.get_or_load("k", loader, cache_if=lambda v: v == 200)
+        assert cache.get("k") is None
+
+    asyncio.run(run())
+
+
+@pytest.fixture
+def medusa_stub(monkeypatch):
+    import agent_server
+    import fake_medusa
+    stub = fake_medusa.make_app(n_products=20, latency_ms=10)
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub), base_url="http://medusa")
+    monkeypatch.setattr(agent_server, "_http_client", client)
+    agent_server.medusa_cache.invalidate()
+    yield stub
+    agent_server.medusa_cache.invalidate()
+
+
+def test_medusa_get_coalesces_and_caches(medusa_stub):
+    import agent_server
+
+    async def run():
+        results = await asyncio.gather(*(agent_server.medusa_get("/store/products", {"q": "Sweatshirt"})
+                                         for _ in range(5)))
+        assert all(r.status_code == 200 for r in results)
+        assert medusa_stub.state.requests == 1
+        await agent_server.medusa_get("/store/products", {"q": "Sweatshirt"})
+        assert medusa_stub.state.requests == 1
+        # 404 不缓存
+        for _ in range(2):
+            assert (await agent_server.medusa_get("/store/products/prod_missing")).status_code == 404
+        assert medusa_stub.state.requests == 3
+        await agent_server._http_client.aclose()
+
+    asyncio.run(run())
+
+
+def test_cancelled_caller_does_not_cancel_shared_load():
+    async def run():
+        cache = TTLCache()
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "v"
+
+        impatient = asyncio.ensure_future(asyncio.wait_for(cache.get_or_load("k", loader), timeout=0.01))
+        await asyncio.sleep(0.001)  # 让超时短的调用方先发起加载
+        patient = asyncio.ensure_future(cache.get_or_load("k", loader))
+        with pytest.raises(asyncio.TimeoutError):
+            await impatient
+        assert await patient == "v"
+        assert len(calls) == 1 and cache.get("k") == "v"
+
+    asyncio.run(run())
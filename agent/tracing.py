@@ -0,0 +1,193 @@
+# 轻量 tracing：contextvars 维护当前 span，结束时写本地 exporter 并记入 metrics 的耗时直方图
+
+"""
+用法:
+    with span("llm.call", model=MODEL_NAME) as s:
+        ...
+        s.set(input_tokens=123)
+- 父子关系靠 contextvars，asyncio task 和 asyncio.to_thread 都会继承当前 span
+- 跨进程（api -> MCP server）用 W3C traceparent 字符串传递：current_traceparent() / span(..., parent=...)
+- TRACE_EXPORTER=none（默认，只留在内存里）| jsonl（追加写 TRACE_EXPORT_PATH）| stderr；
+  最近的 span 总是留在内存里（TRACE_BUFFER_SIZE 条），api 的 /traces 可以直接查看，不需要外部 collector
+- jsonl 文件超过 TRACE_MAX_BYTES 就轮转成 .1/.2/…，最多留 TRACE_BACKUP_COUNT 个；api 和 MCP server
+  子进程写同一个文件，轮转时持有 flock，别的进程发现文件被换掉（inode 变了）就重新打开
+- 每个 span 结束都会记一次 smartshopper_span_duration_seconds{span=名称}
+"""
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import List, Optional
+
+from metrics import span_errors, span_seconds
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 flock：不要让多个进程写同一个 TRACE_EXPORT_PATH
+    fcntl = None
+
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+TRACE_EXPORT_PATH = os.getenv("TRACE_EXPORT_PATH", "./traces.jsonl")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(50 * 2 ** 20)))
+TRACE_BACKUP_COUNT = int(os.getenv("TRACE_BACKUP_COUNT", "3"))
+TRACE_BUFFER_SIZE = int(os.getenv("TRACE_BUFFER_SIZE", "2000"))
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_recent: deque = deque(maxlen=TRACE_BUFFER_SIZE)
+_export_lock = threading.Lock()
+_export_file = None
+SERVICE = os.getenv("TRACE_SERVICE_NAME", os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0])
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "attrs", "start", "duration", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.start = time.time()
+        self.duration = 0.0
+        self.error: Optional[str] = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {"service": SERVICE, "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id,
+                "parent_id": self.parent_id, "start": self.start, "duration_ms": round(self.duration * 1000, 3),
+                "error": self.error, "attrs": self.attrs}
+
+
+def parse_traceparent(value: Optional[str]):
+    """'00-<trace_id>-<span_id>-01' -> (trace_id, span_id)；格式不对返回 (None, None)"""
+    parts = (value or "").split("-")
+    if len(parts) == 4 and len(parts[1]) == 32 and len(parts[2]) == 16:
+        return parts[1], parts[2]
+    return None, None
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def current_traceparent() -> Optional[str]:
+    s = _current.get()
+    return s.traceparent if s is not None else None
+
+
+def _open_export():
+    os.makedirs(os.path.dirname(TRACE_EXPORT_PATH) or ".", exist_ok=True)
+    return open(TRACE_EXPORT_PATH, "a", encoding="utf-8", buffering=1)  # 行缓冲，多进程追加
+
+
+def _rotate(path: str):
+    for i in range(TRACE_BACKUP_COUNT - 1, 0, -1):
+        if os.path.exists(f"{path}.{i}"):
+            os.replace(f"{path}.{i}", f"{path}.{i + 1}")
+    if TRACE_BACKUP_COUNT > 0:
+        os.replace(path, f"{path}.1")
+    else:
+        os.remove(path)
+
+
+def _export_target():
+    """返回要写的文件：需要时先轮转，或者在别的进程轮转之后重新打开"""
+    global _export_file
+    if _export_file is None:
+        _export_file = _open_export()
+    try:
+        st = os.stat(TRACE_EXPORT_PATH)
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_ino == os.fstat(_export_file.fileno()).st_ino:
+        if TRACE_MAX_BYTES <= 0 or st.st_size < TRACE_MAX_BYTES:
+            return _export_file
+        with open(TRACE_EXPORT_PATH + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                st = os.stat(TRACE_EXPORT_PATH)
+                # 拿到锁之前别的进程可能已经轮转过了
+                if st.st_ino == os.fstat(_export_file.fileno()).st_ino and st.st_size >= TRACE_MAX_BYTES:
+                    _rotate(TRACE_EXPORT_PATH)
+            except FileNotFoundError:
+                pass
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    _export_file.close()
+    _export_file = _open_export()
+    return _export_file
+
+
+def _export(s: Span):
+    record = s.to_dict()
+    _recent.append(record)
+    if TRACE_EXPORTER == "none":
+        return
+    line = json.dumps(record, ensure_ascii=False, default=str)
+    with _export_lock:
+        if TRACE_EXPORTER == "stderr":
+            print(line, file=sys.stderr, flush=True)
+            return
+        _export_target().write(line + "\n")
+
+
+@contextmanager
+def span(name: str, parent: Optional[str] = None, **attrs):
+    """parent 是上游进程传来的 traceparent；不传就挂在当前 span 下面，没有当前 span 就开新 trace"""
+    trace_id, parent_id = parse_traceparent(parent)
+    if trace_id is None:
+        cur = _current.get()
+        trace_id, parent_id = (cur.trace_id, cur.span_id) if cur is not None else (uuid.uuid4().hex, None)
+    s = Span(name, trace_id, parent_id, attrs)
+    token = _current.set(s)
+    t0 = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        span_errors.inc(span=s.name)
+        raise
+    finally:
+        s.duration = time.perf_counter() - t0
+        try:
+            _current.reset(token)
+        except ValueError:
+            pass  # 异步生成器被别的 task 收尾时 token 不属于当前 context，忽略即可
+        span_seconds.observe(s.duration, span=s.name)
+        try:
+            _export(s)
+        except Exception:
+            pass  # 导出失败不能影响业务
+
+
+def instrument_app(app):
+    """给 FastAPI app 加一个 HTTP 请求级别的 span；span 名用路由模板（/sessions/{session_id}），不按具体路径爆炸"""
+
+    @app.middleware("http")
+    async def trace_requests(request, call_next):
+        with span("http", parent=request.headers.get("traceparent"), method=request.method) as s:
+            response = await call_next(request)
+            route = request.scope.get("route")
+            s.name = f"http {getattr(route, 'path', request.url.path)}"
+            s.set(status=response.status_code)
+            response.headers["traceparent"] = s.traceparent
+            return response
+
+
+def recent_spans(trace_id: Optional[str] = None, limit: int = 200) -> List[dict]:
+    spans = [s for s in list(_recent) if trace_id is None or s["trace_id"] == trace_id]
+    return spans[-limit:]
@@ -0,0 +1,89 @@
+# 带过期时间的 LRU 缓存，并发的相同请求只真正执行一次（single-flight）
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (过期时间, value)
+        self._inflight = {}  # key -> Future，正在加载中的 key
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0  # 搭了别人正在进行的请求的次数
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)  # 淘汰最久没用的
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> int:
+        """不传参数清空全部；传 predicate(key) 只删除匹配的 key，返回删除个数"""
+        if predicate is None:
+            n = len(self._data)
+            self._data.clear()
+            return n
+        keys = [k for k in self._data if predicate(k)]
+        for k in keys:
+            del self._data[k]
+        return len(keys)
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          cache_if: Callable[[Any], bool] = lambda v: True) -> Any:
+        """
+        加载在单独的 task 里跑，每个调用方都只是 shield 着等它：某个调用方超时/被取消
+        不会连累同一个 key 上还有时间的其他调用方，加载完的结果照样进缓存。
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        task = asyncio.ensure_future(self._load(key, loader, cache_if))
+        # 所有调用方都放弃了、加载又失败时，不报 "exception was never retrieved"
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]], cache_if: Callable[[Any], bool]):
+        try:
+            value = await loader()
+        finally:
+            self._inflight.pop(key, None)
+        if cache_if(value):
+            self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,93 @@
+# 可插拔的向量库：Chroma（默认）或进程内 FAISS
+
+"""
+indexer_chroma / retriever / ingest 只用到 Chroma collection 的这几个方法，
+任何实现了它们的对象都可以当“向量库”用（见 VectorStore）：
+    get(ids=None, where=None, include=[...]) / upsert(...) / update(...) / delete(...) / query(...) / persist()
+VECTOR_BACKEND=chroma|faiss 选择后端，FAISS 的索引类型由 FAISS_INDEX_TYPE=flat|hnsw|ivfpq 决定。
+"""
+import os
+import threading
+from typing import Dict, List, Optional, Protocol
+
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+DEFAULT_COLLECTION = "smartshopper"
+
+
+class VectorStore(Protocol):
+    def get(self, ids: Optional[List[str]] = None, where: Optional[dict] = None,
+            include: Optional[List[str]] = None) -> dict: ...
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[dict], embeddings) -> None: ...
+
+    def update(self, ids: List[str], metadatas: List[dict]) -> None: ...
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None) -> None: ...
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[dict] = None) -> dict: ...
+
+
+def match_where(meta: dict, where: Optional[dict]) -> bool:
+    """在 Python 里执行 Chroma 风格的 where 过滤（$eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$and/$or）"""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(match_where(meta, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(match_where(meta, c) for c in cond):
+                return False
+        else:
+            value = meta.get(key)
+            ops = cond if isinstance(cond, dict) else {"$eq": cond}
+            for op, target in ops.items():
+                if op == "$eq" and not value == target:
+                    return False
+                if op == "$ne" and not value != target:
+                    return False
+                if op == "$in" and value not in target:
+                    return False
+                if op == "$nin" and value in target:
+                    return False
+                if op in ("$gt", "$gte", "$lt", "$lte"):
+                    if value is None:
+                        return False
+                    if op == "$gt" and not value > target:
+                        return False
+                    if op == "$gte" and not value >= target:
+                        return False
+                    if op == "$lt" and not value < target:
+                        return False
+                    if op == "$lte" and not value <= target:
+                        return False
+    return True
+
+
+_stores: Dict[str, VectorStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(name: str = DEFAULT_COLLECTION, backend: Optional[str] = None) -> VectorStore:
+    backend = backend or VECTOR_BACKEND
+    key = f"{backend}:{name}"
+    if key not in _stores:
+        with _stores_lock:
+            if key not in _stores:
+                if backend == "faiss":
+                    from faiss_store import FaissStore
+                    _stores[key] = FaissStore.open(name)
+                elif backend == "chroma":
+                    from indexer_chroma import get_or_create_collection
+                    _stores[key] = get_or_create_collection(name)
+                else:
+                    raise ValueError(f"未知的 VECTOR_BACKEND: {backend}")
+    return _stores[key]
+
+
+def persist(store: VectorStore):
+    if hasattr(store, "persist"):
+        store.persist()
+    else:
+        from indexer_chroma import get_client
+        get_client().persist()